@@ -0,0 +1,501 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+# Carpeta del repositorio: los scripts se ejecutan desde carpetas de trabajo temporales
+raiz = os.path.dirname(os.path.abspath(__file__))
+
+# --- Etiquetas con la misma forma que los .dta de ENSIN/ELCSA ---
+etiquetas_edad = {1: ' Menores de 1 año', 2: ' 1 - 2 años', 3: ' 3-4 años', 4: ' 5 - 12 años',
+                  5: ' 13 - 17 años', 6: ' 18 – 26 años', 7: ' 27 - 49 años', 8: ' 50 – 64 años',
+                  9: ' 65 años o más'}
+etiquetas_sexo = {1: ' Hombres', 2: ' Mujeres'}
+etiquetas_educacion = {1: ' Menos de primaria completa (0-4 años)',
+                       2: ' Entre primaria completa y secundaria incompleta (5-10 años)',
+                       3: ' Entre secundaria completa y superior incompleta (11-15 años)',
+                       4: ' Superior completa y mas (16-24 años)'}
+etiquetas_cuartil = {1: ' primer cuartil', 2: ' segundo cuartil', 3: ' tercero cuartil', 4: ' cuarto cuartil'}
+etiquetas_imc = {1: ' Delgadez', 2: ' Normal', 3: ' Exceso de peso'}
+etiquetas_si_no = {0: 'No', 1: 'Sí'}
+
+
+# --- 1. Datos sintéticos (no requieren los .dta privados) ---
+def generar_dta(directorio: str, n_personas: int, columnas_extra: int = 20, semilla: int = 42) -> None:
+    rng = np.random.default_rng(semilla)
+    os.makedirs(directorio, exist_ok=True)
+
+    n_hogares = max(1, n_personas // 3)
+    hogares = np.array([f"{i:09d}" for i in range(n_hogares)], dtype=object)
+    hogar_persona = rng.integers(0, n_hogares, n_personas)
+    personas = np.array([f"{hogares[h]}{i:03d}" for i, h in enumerate(hogar_persona % n_hogares)], dtype=object)
+
+    def extras(n):
+        return {f"extra_{j}": rng.normal(size=n) for j in range(columnas_extra)}
+
+    pts = pd.DataFrame({
+        'LLAVE_HOGAR': hogares[hogar_persona],
+        'LLAVE_PERSONA': personas,
+        'edades': rng.integers(1, 10, n_personas),
+        'sexo': rng.integers(1, 3, n_personas),
+        'niveledu': rng.integers(1, 5, n_personas),
+        'cuartil_riqueza2015': rng.integers(1, 5, n_personas),
+        **extras(n_personas)
+    })
+    pyreadstat.write_dta(pts, os.path.join(directorio, "PTS_2.dta"), variable_value_labels={
+        'edades': etiquetas_edad, 'sexo': etiquetas_sexo,
+        'niveledu': etiquetas_educacion, 'cuartil_riqueza2015': etiquetas_cuartil})
+
+    con_ant = rng.random(n_personas) < 0.9
+    imc = rng.normal(26, 5, con_ant.sum()).round(2)
+    ant = pd.DataFrame({
+        'LLAVE_PERSONA': personas[con_ant],
+        'AN_IMC': np.where(rng.random(len(imc)) < 0.02, np.nan, imc),
+        'estadoImc1': np.digitize(imc, [18.5, 25]) + 1,
+        **extras(int(con_ant.sum()))
+    })
+    pyreadstat.write_dta(ant, os.path.join(directorio, "ANTROPOMETRIA.dta"),
+                         variable_value_labels={'estadoImc1': etiquetas_imc})
+
+    con_pisnsp = rng.random(n_personas) < 0.8
+    pisnsp = pd.DataFrame({
+        'LLAVE_PERSONA': personas[con_pisnsp],
+        'totalComidasDia': rng.uniform(0, 9, con_pisnsp.sum()).round(1),
+        **extras(int(con_pisnsp.sum()))
+    })
+    pyreadstat.write_dta(pisnsp, os.path.join(directorio, "PISNSP.dta"))
+
+    binarias = ['SA10_1', 'SA11_1', 'disminuir_porciones', 'pedir_prestado', 'menor_calidad']
+    sa = pd.DataFrame({'LLAVE_HOGAR': hogares, **{col: rng.integers(0, 2, n_hogares) for col in binarias}})
+    sa['puntaje'] = sa[binarias].sum(axis=1) * 3
+    sa['inseguridad'] = (sa['puntaje'] > 0).astype(int)
+    sa = pd.concat([sa, pd.DataFrame(extras(n_hogares))], axis=1)
+    pyreadstat.write_dta(sa, os.path.join(directorio, "SA_1.dta"),
+                         variable_value_labels={col: etiquetas_si_no for col in binarias + ['inseguridad']})
+
+
+# --- 2. Medición de un script en un proceso hijo: tiempo y pico de memoria (RSS) ---
+# VmHWM se lee dentro del hijo: ru_maxrss heredaría el RSS del proceso padre al hacer exec
+_lanzador = """
+import json, resource, runpy, sys
+salida, sys.argv = sys.argv[1], sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+try:
+    with open("/proc/self/status") as f:
+        pico_kb = next(int(l.split()[1]) for l in f if l.startswith("VmHWM"))
+except OSError:
+    pico_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(salida, "w") as f:
+    json.dump({"pico_kb": pico_kb}, f)
+"""
+
+
+def entorno_hijo(**variables) -> dict:
+    ruta = os.pathsep.join(filter(None, [raiz, os.environ.get("PYTHONPATH")]))
+    return {**os.environ, "PYTHONPATH": ruta, "MPLBACKEND": "Agg", **variables}
+
+
+def medir(script: str, argumentos: list, directorio: str = None, entorno: dict = None) -> dict:
+    # directorio: carpeta de trabajo del script (sus rutas data/ y models/ son relativas)
+    with tempfile.NamedTemporaryFile(suffix=".json") as salida:
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, "-c", _lanzador, salida.name, os.path.join(raiz, script), *argumentos],
+                       stdout=subprocess.DEVNULL, check=True, cwd=directorio, env=entorno or entorno_hijo())
+        segundos = time.perf_counter() - inicio
+        pico_kb = json.load(open(salida.name))["pico_kb"]
+    return {"segundos": round(segundos, 3), "pico_rss_mb": round(pico_kb / 1024, 1)}
+
+
+# --- 3. ETL en memoria vs por bloques sobre los mismos .dta ---
+def benchmark_etl(n_personas: int, chunksize: int, directorio: str = None) -> list:
+    resultados = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if directorio is None:
+            directorio = os.path.join(tmp, "datasets")
+            generar_dta(directorio, n_personas)
+
+        salidas = {}
+        resumen = os.path.join(tmp, "resumen_bloques.json")
+        for modo in ("memoria", "bloques"):
+            salidas[modo] = os.path.join(tmp, f"df_cluster_{modo}.parquet")
+            argumentos = ["--entrada", directorio, "--salida", salidas[modo], "--modo", modo,
+                          "--chunksize", str(chunksize), "--sin-diagnostico"]
+            medicion = medir("preprocess_data.py", argumentos + (["--resumen", resumen] if modo == "bloques" else []))
+            resultados.append({"etapa": f"etl_{modo}", "filas": n_personas, **medicion})
+
+        # Lo que aún crece con la encuesta en modo bloques: las tablas de búsqueda compactas
+        with open(resumen) as f:
+            busqueda = json.load(f)
+        resultados[-1]["busqueda_mb"] = busqueda["busqueda_mb"]
+        print(f" Límite de memoria del modo bloques: tablas de búsqueda de {busqueda['busqueda_mb']} MB "
+              f"({busqueda['personas']} personas, {busqueda['hogares']} hogares, "
+              f"~{busqueda['busqueda_mb'] * 2 ** 20 / max(busqueda['personas'], 1):.0f} bytes por persona); "
+              f"el resto se acota con --chunksize")
+
+        # Ambos modos deben producir el mismo contenido
+        a, b = (pd.read_parquet(salidas[m]) for m in ("memoria", "bloques"))
+        for df in (a, b):
+            for col in df.select_dtypes("category").columns:
+                df[col] = df[col].astype(str)
+        pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True), check_dtype=False)
+
+    return resultados
+
+
+# --- 4. Latencia bajo concurrencia: usuarios sueltos mientras llegan lotes grandes ---
+def usuarios_sinteticos(n: int, semilla: int = 42) -> list:
+    rng = np.random.default_rng(semilla)
+    opciones = {
+        'sexo': list(etiquetas_sexo.values()),
+        'nivel_educativo': list(etiquetas_educacion.values()),
+        'estrato': list(etiquetas_cuartil.values()),
+        'estado_imc': list(etiquetas_imc.values())
+    }
+    # IMC continuo: cada usuario es un perfil distinto y no se responde desde la caché
+    return [{
+        'edad_ordinal': int(rng.integers(1, 4)),
+        'imc': float(rng.normal(26, 5)),
+        'totalComidasDia': float(rng.uniform(0, 9)),
+        'puntaje_ia': int(rng.integers(0, 4)),
+        'inseguridad': int(rng.integers(0, 2)),
+        **{col: str(rng.choice(valores)) for col, valores in opciones.items()}
+    } for _ in range(n)]
+
+
+def _percentiles(latencias: list, prefijo: str) -> dict:
+    ms = np.array(latencias) * 1000
+    if not len(ms):
+        return {}
+    return {f"{prefijo}p50_ms": round(float(np.percentile(ms, 50)), 2),
+            f"{prefijo}p95_ms": round(float(np.percentile(ms, 95)), 2),
+            f"{prefijo}p99_ms": round(float(np.percentile(ms, 99)), 2),
+            f"{prefijo}max_ms": round(float(ms.max()), 2)}
+
+
+async def _carga(url: str, usuarios: list, concurrencia: int, lote_grande: int) -> dict:
+    import httpx
+
+    sueltos, estaticos, lotes = [], [], 0
+    pendientes = iter(usuarios)
+    terminado = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=url, timeout=120) as cliente:
+        async def usuario_suelto():
+            for usuario in pendientes:
+                inicio = time.perf_counter()
+                r = await cliente.post("/predecir", json=usuario)
+                r.raise_for_status()
+                sueltos.append(time.perf_counter() - inicio)
+
+        async def lotes_grandes():
+            nonlocal lotes
+            lote = usuarios_sinteticos(lote_grande, semilla=7)
+            while not terminado.is_set():
+                (await cliente.post("/predecir", json=lote)).raise_for_status()
+                lotes += 1
+
+        async def archivos_estaticos():
+            while not terminado.is_set():
+                inicio = time.perf_counter()
+                (await cliente.get("/static/style.css")).raise_for_status()
+                estaticos.append(time.perf_counter() - inicio)
+                await asyncio.sleep(0.02)
+
+        fondo = [asyncio.create_task(archivos_estaticos())]
+        if lote_grande > 0:
+            fondo.append(asyncio.create_task(lotes_grandes()))
+        inicio = time.perf_counter()
+        await asyncio.gather(*(usuario_suelto() for _ in range(concurrencia)))
+        segundos = time.perf_counter() - inicio
+        terminado.set()
+        await asyncio.gather(*fondo)
+        inferencia = (await cliente.get("/inferencia")).json()
+
+    return {"peticiones": len(sueltos), "peticiones_por_s": round(len(sueltos) / segundos, 1),
+            **_percentiles(sueltos, ""), **_percentiles(estaticos, "estaticos_"),
+            "lotes_grandes": lotes, "tamano_medio_lote": inferencia["tamano_medio_lote"]}
+
+
+@contextmanager
+def servicio(puerto: int, directorio: str = None, **variables):
+    import httpx
+
+    servidor = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto),
+                                 "--log-level", "warning"], cwd=directorio,
+                                env=entorno_hijo(RECARGA_MODELOS_SEGUNDOS="0", **variables),
+                                stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{puerto}"
+    try:
+        limite = time.time() + 60
+        while True:
+            try:
+                if httpx.get(f"{url}/modelos", timeout=5).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.time() > limite or servidor.poll() is not None:
+                raise RuntimeError("El servicio no arrancó (¿existen los modelos en models/?).")
+            time.sleep(0.5)
+        yield url
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+def benchmark_carga(peticiones: int, concurrencia: int, lote_grande: int, hilos: list, puerto: int = 8765) -> list:
+    usuarios = usuarios_sinteticos(peticiones)
+    resultados = []
+    # hilos = 0 reproduce el servicio original: la inferencia corre dentro del event loop
+    for n_hilos in hilos:
+        with servicio(puerto, HILOS_INFERENCIA=str(n_hilos), CACHE_PREDICCIONES="0") as url:
+            medicion = asyncio.run(_carga(url, usuarios, concurrencia, lote_grande))
+        etapa = "carga_en_loop" if n_hilos == 0 else f"carga_pool_{n_hilos}"
+        resultados.append({"etapa": etapa, "concurrencia": concurrencia, "lote_grande": lote_grande, **medicion})
+    return resultados
+
+
+# --- 5. Endpoints a distintos tamaños de lote y concurrencias ---
+def formularios_sinteticos(n: int, semilla: int = 42) -> list:
+    rng = np.random.default_rng(semilla)
+    return [{
+        'edad': str(rng.choice(['18 - 26 años', '27 - 49 años', '50 - 64 años'])),
+        'sexo': str(rng.choice(['Mujeres', 'Hombres'])),
+        'nivel_educativo': str(rng.choice([v.strip() for v in etiquetas_educacion.values()])),
+        'estrato': str(rng.choice([v.strip() for v in etiquetas_cuartil.values()])),
+        'peso': str(round(float(rng.uniform(40, 120)), 1)),
+        'altura': str(round(float(rng.uniform(140, 200)), 1)),
+        'totalComidasDia': str(int(rng.integers(1, 9))),
+        **{col: str(int(rng.integers(0, 2))) for col in ['sa10_1', 'sa11_1', 'menor_calidad']}
+    } for _ in range(n)]
+
+
+async def _endpoint(url: str, ruta: str, cuerpos: list, concurrencia: int, formulario: bool) -> dict:
+    import httpx
+
+    latencias, fallidas = [], 0
+    pendientes = iter(cuerpos)
+    async with httpx.AsyncClient(base_url=url, timeout=300) as cliente:
+        async def trabajador():
+            nonlocal fallidas
+            for cuerpo in pendientes:
+                inicio = time.perf_counter()
+                r = await (cliente.post(ruta, data=cuerpo) if formulario else cliente.post(ruta, json=cuerpo))
+                latencias.append(time.perf_counter() - inicio)
+                fallidas += r.status_code != 200
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        segundos = time.perf_counter() - inicio
+    return {"peticiones": len(latencias), "fallidas": fallidas,
+            "peticiones_por_s": round(len(latencias) / segundos, 1), **_percentiles(latencias, "")}
+
+
+def benchmark_servicio(lotes: list, concurrencias: list, peticiones: int, directorio: str = None,
+                       puerto: int = 8765) -> list:
+    resultados = []
+    formularios = formularios_sinteticos(peticiones)
+    with servicio(puerto, directorio, CACHE_PREDICCIONES="0") as url:
+        for concurrencia in concurrencias:
+            medicion = asyncio.run(_endpoint(url, "/clasificar_usuario", formularios, concurrencia, True))
+            resultados.append({"etapa": "servicio", "endpoint": "/clasificar_usuario", "lote": 1,
+                               "concurrencia": concurrencia, **medicion, "usuarios_por_s": medicion["peticiones_por_s"]})
+            for lote in lotes:
+                usuarios = usuarios_sinteticos(lote * peticiones)
+                cuerpos = [usuarios[i:i + lote] for i in range(0, len(usuarios), lote)]
+                medicion = asyncio.run(_endpoint(url, "/predecir", cuerpos, concurrencia, False))
+                resultados.append({"etapa": "servicio", "endpoint": "/predecir", "lote": lote,
+                                   "concurrencia": concurrencia, **medicion,
+                                   "usuarios_por_s": round(medicion["peticiones_por_s"] * lote, 1)})
+    return resultados
+
+
+# --- 6. Pipeline completo sobre datos sintéticos: cada etapa en su propio proceso ---
+etapas_pipeline = [
+    ("etl", "preprocess_data.py", ["--sin-diagnostico"]),
+    ("entrenamiento", "model_builder.py", []),
+    ("analisis", "model_analisis.py", []),
+    ("motor", "kernel_builder.py", []),
+    ("puntuacion_masiva", "bulk_score.py", ["data/outputs/df_cluster.parquet"])
+]
+
+
+def preparar_carpeta(directorio: str, n_personas: int) -> None:
+    generar_dta(os.path.join(directorio, "data", "datasets"), n_personas)
+    for carpeta in ("static", "template"):
+        os.symlink(os.path.join(raiz, carpeta), os.path.join(directorio, carpeta))
+
+
+# El servicio recién entrenado debe leer los artefactos mapeables: cualquier joblib.load es un fallo
+_sin_pkl = """
+import json, recommender
+def leer_pkl(ruta, *args, **kwargs):
+    raise AssertionError(f"el servicio leyó {ruta}")
+recommender.joblib.load = leer_pkl
+print(json.dumps(recommender.cargar_artefactos().modelos))
+"""
+
+
+def verificar_artefactos(directorio: str, entorno: dict) -> list:
+    proceso = subprocess.run([sys.executable, "-c", _sin_pkl], capture_output=True, text=True, cwd=directorio,
+                             env=entorno)
+    if proceso.returncode != 0:
+        raise AssertionError(f"El servicio no cargó los artefactos mapeables:\n{proceso.stderr}")
+    servidos = json.loads(proceso.stdout.strip().splitlines()[-1])
+    exportados = {os.path.basename(os.path.dirname(r))
+                  for r in glob.glob(os.path.join(directorio, "models", "*", "manifest.json"))}
+    faltan = sorted(exportados - {"preprocessor"} - set(servidos))
+    if faltan:
+        raise AssertionError(f"Modelos con artefacto que el servicio leyó del .pkl: {faltan}\n{proceso.stdout}")
+    return servidos
+
+
+def benchmark_pipeline(n_personas: int, workers: int, metricas: str, directorio: str) -> list:
+    entorno = entorno_hijo(MODEL_BUILDER_WORKERS=str(workers), MODO_METRICAS=metricas)
+    resultados = []
+    for etapa, script, argumentos in etapas_pipeline:
+        if script in ("model_builder.py", "model_analisis.py", "bulk_score.py"):
+            argumentos = argumentos + ["--workers", str(workers)]
+        medicion = medir(script, argumentos, directorio, entorno)
+        resultados.append({"etapa": etapa, "filas": n_personas, **medicion})
+        print(f" {etapa}: {medicion['segundos']} s, pico {medicion['pico_rss_mb']} MB")
+        if script == "model_builder.py":
+            servidos = verificar_artefactos(directorio, entorno)
+            print(f" Servicio cargado desde artefactos mapeables (sin .pkl): {', '.join(servidos)}")
+    return resultados
+
+
+# --- 7. Historial JSON: cada corrida se compara con la anterior de los mismos parámetros ---
+campos_clave = ("etapa", "endpoint", "filas", "lote", "concurrencia", "lote_grande")
+menor_es_mejor = ("segundos", "pico_rss_mb", "p50_ms", "p95_ms", "p99_ms")
+mayor_es_mejor = ("peticiones_por_s", "usuarios_por_s")
+
+
+def maquina() -> dict:
+    return {"cpus": os.cpu_count(), "python": platform.python_version(), "sistema": platform.platform()}
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=raiz, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _clave(fila: dict) -> tuple:
+    return tuple((campo, fila[campo]) for campo in campos_clave if campo in fila)
+
+
+def comparar(anteriores: list, actuales: list, tolerancia: float) -> list:
+    previas = {_clave(fila): fila for fila in anteriores}
+    regresiones = []
+    for fila in actuales:
+        previa = previas.get(_clave(fila))
+        if previa is None:
+            continue
+        for metrica in menor_es_mejor + mayor_es_mejor:
+            antes, ahora = previa.get(metrica), fila.get(metrica)
+            if not antes or ahora is None:
+                continue
+            cambio = (ahora - antes) / antes if metrica in menor_es_mejor else (antes - ahora) / antes
+            if cambio > tolerancia:
+                regresiones.append({**dict(_clave(fila)), "metrica": metrica, "antes": antes, "ahora": ahora,
+                                    "empeora_%": round(cambio * 100, 1)})
+    return regresiones
+
+
+def registrar(ruta: str, comando: str, parametros: dict, resultados: list, tolerancia: float) -> list:
+    historial = []
+    if os.path.exists(ruta):
+        with open(ruta) as f:
+            historial = [json.loads(linea) for linea in f if linea.strip()]
+    # Solo se comparan corridas del mismo comando, con los mismos parámetros y en la misma máquina
+    previa = next((h for h in reversed(historial) if h["comando"] == comando and h["parametros"] == parametros
+                   and h["maquina"] == maquina()), None)
+    regresiones = comparar(previa["resultados"], resultados, tolerancia) if previa else []
+
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta, "a") as f:
+        f.write(json.dumps({"fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                            "commit": commit_actual(), "maquina": maquina(), "comando": comando,
+                            "parametros": parametros, "resultados": resultados}, ensure_ascii=False) + "\n")
+    return regresiones
+
+
+def imprimir(resultados: list) -> None:
+    print(pd.DataFrame(resultados).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de rendimiento del pipeline")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    etl = sub.add_parser("etl", help="Compara el ETL en memoria con el ETL por bloques")
+    etl.add_argument("--personas", type=int, default=200_000)
+    etl.add_argument("--chunksize", type=int, default=50_000)
+    etl.add_argument("--entrada", default=None, help="Carpeta con .dta reales (por defecto se generan sintéticos)")
+
+    carga = sub.add_parser("carga", help="Latencia de usuarios sueltos con lotes grandes en paralelo")
+    carga.add_argument("--peticiones", type=int, default=2000)
+    carga.add_argument("--concurrencia", type=int, default=32)
+    carga.add_argument("--lote-grande", type=int, default=20_000, help="Usuarios por lote de fondo (0 = sin lotes)")
+    carga.add_argument("--hilos", type=int, nargs="+", default=[0, 2],
+                       help="Valores de HILOS_INFERENCIA a comparar (0 = inferencia en el event loop)")
+    carga.add_argument("--puerto", type=int, default=8765)
+
+    servicio_cli = sub.add_parser("servicio", help="Carga sobre /clasificar_usuario y /predecir con los modelos de models/")
+    servicio_cli.add_argument("--lotes", type=int, nargs="+", default=[1, 100, 1000], help="Usuarios por petición")
+    servicio_cli.add_argument("--concurrencias", type=int, nargs="+", default=[1, 8, 32])
+    servicio_cli.add_argument("--peticiones", type=int, default=200, help="Peticiones por combinación")
+    servicio_cli.add_argument("--puerto", type=int, default=8765)
+
+    suite = sub.add_parser("suite", help="Pipeline completo sobre datos sintéticos y carga del servicio entrenado")
+    suite.add_argument("--personas", type=int, default=20_000)
+    suite.add_argument("--workers", type=int, default=1)
+    suite.add_argument("--metricas", default="muestreo", help="MODO_METRICAS para el análisis")
+    suite.add_argument("--lotes", type=int, nargs="+", default=[1, 100, 1000])
+    suite.add_argument("--concurrencias", type=int, nargs="+", default=[1, 8, 32])
+    suite.add_argument("--peticiones", type=int, default=200)
+    suite.add_argument("--puerto", type=int, default=8765)
+
+    for comando in (etl, carga, servicio_cli, suite):
+        comando.add_argument("--historial", default="data/benchmarks/historial.jsonl",
+                             help="Archivo JSON Lines donde se acumulan las corridas ('' = no guardar)")
+        comando.add_argument("--tolerancia", type=float, default=0.2,
+                             help="Empeoramiento relativo que se reporta como regresión")
+
+    args = parser.parse_args()
+    if args.comando == "etl":
+        resultados = benchmark_etl(args.personas, args.chunksize, args.entrada)
+    elif args.comando == "carga":
+        resultados = benchmark_carga(args.peticiones, args.concurrencia, args.lote_grande, args.hilos, args.puerto)
+    elif args.comando == "servicio":
+        resultados = benchmark_servicio(args.lotes, args.concurrencias, args.peticiones, puerto=args.puerto)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            preparar_carpeta(tmp, args.personas)
+            resultados = benchmark_pipeline(args.personas, args.workers, args.metricas, tmp)
+            resultados += benchmark_servicio(args.lotes, args.concurrencias, args.peticiones, tmp, args.puerto)
+    imprimir(resultados)
+
+    if args.historial:
+        parametros = {k: v for k, v in vars(args).items() if k not in ("comando", "historial", "tolerancia", "puerto")}
+        regresiones = registrar(args.historial, args.comando, parametros, resultados, args.tolerancia)
+        if regresiones:
+            print(f"\n Regresiones respecto a la corrida anterior (tolerancia {args.tolerancia:.0%}):")
+            imprimir(regresiones)
+            sys.exit(1)
+        print(f"\n Corrida guardada en {args.historial}")
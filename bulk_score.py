@@ -0,0 +1,123 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from features import columnas_crudas, columnas_derivadas, derivar_caracteristicas, normalizar_categoricas
+from recommender import cargar_asignador, cargar_motor, modelo_principal, recomendaciones
+
+# --- 1. Columnas de entrada: las del modelo y las que permiten derivarlas ---
+# Los .dta nombran en mayúsculas las preguntas ELCSA que el formulario envía en minúsculas
+nombres_encuesta = {'SA10_1': 'sa10_1', 'SA11_1': 'sa11_1'}
+columnas_origen = columnas_crudas + list(nombres_encuesta)
+
+
+def preparar_tabla(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns={k: v for k, v in nombres_encuesta.items() if v not in df.columns})
+    df = derivar_caracteristicas(df)
+    faltante = next((col for col in columnas_derivadas if col not in df.columns), None)
+    if faltante is not None:
+        raise ValueError(f"Falta la columna: {faltante}")
+    return df
+
+
+# --- 2. Estado de cada proceso: el motor y el asignador se cargan una sola vez ---
+_motor = None
+_asignador = None
+
+
+def _iniciar(nombre: str) -> None:
+    global _motor, _asignador
+    _motor = cargar_motor()
+    _asignador = None if nombre == modelo_principal else cargar_asignador(nombre, _motor)
+
+
+def _puntuar(lote: pa.RecordBatch) -> np.ndarray:
+    # Misma normalización de categóricas que la API (features.py): una fila, un cluster
+    df = normalizar_categoricas(preparar_tabla(lote.to_pandas()))
+    numericos, categorias = _motor.leer_tabla(df)
+    if _asignador is None:
+        return _motor.clasificar(numericos, categorias)
+    return _asignador.predecir_matriz(_motor.matriz(numericos, categorias))
+
+
+def columnas_recomendacion(clusters: np.ndarray, nombre: str) -> tuple:
+    reglas = recomendaciones if nombre == modelo_principal else {}
+    textos = np.array([reglas.get(c, "Personalizar recomendaciones.") for c in range(clusters.max(initial=0) + 1)]
+                      + ["Personalizar recomendaciones."], dtype=object)
+    # El ruido de DBSCAN (-1) toma la última posición de la tabla
+    return pa.array(clusters, type=pa.int64()), pa.array(textos[clusters], type=pa.string())
+
+
+def _escribir(escritor, lote: pa.RecordBatch, clusters: np.ndarray, nombre: str, salida: str):
+    tabla = pa.Table.from_batches([lote])
+    tabla = tabla.drop_columns([c for c in ('cluster', 'recomendacion') if c in tabla.column_names])
+    cluster, recomendacion = columnas_recomendacion(clusters, nombre)
+    tabla = tabla.append_column("cluster", cluster).append_column("recomendacion", recomendacion)
+    if escritor is None:
+        escritor = pq.ParquetWriter(salida, tabla.schema)
+    escritor.write_table(tabla)
+    return escritor
+
+
+# --- 3. Lectura por lotes, puntuación en paralelo y escritura en orden ---
+def puntuar_archivo(entrada: str, salida: str, nombre: str = modelo_principal, workers: int = 1,
+                    tamano_lote: int = 65_536) -> dict:
+    archivo = pq.ParquetFile(entrada)
+    necesarias = [c for c in archivo.schema_arrow.names if c in columnas_derivadas + columnas_origen]
+    tmp = salida + ".tmp"
+    escritor, filas = None, 0
+
+    inicio = time.perf_counter()
+    try:
+        if workers <= 1:
+            _iniciar(nombre)
+            for lote in archivo.iter_batches(batch_size=tamano_lote):
+                escritor = _escribir(escritor, lote, _puntuar(lote.select(necesarias)), nombre, tmp)
+                filas += lote.num_rows
+        else:
+            # A lo sumo dos lotes por proceso en vuelo: la memoria no depende del tamaño del archivo
+            with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar, initargs=(nombre,)) as pool:
+                pendientes = deque()
+                for lote in archivo.iter_batches(batch_size=tamano_lote):
+                    pendientes.append((lote, pool.submit(_puntuar, lote.select(necesarias))))
+                    if len(pendientes) >= 2 * workers:
+                        previo, futuro = pendientes.popleft()
+                        escritor = _escribir(escritor, previo, futuro.result(), nombre, tmp)
+                        filas += previo.num_rows
+                while pendientes:
+                    previo, futuro = pendientes.popleft()
+                    escritor = _escribir(escritor, previo, futuro.result(), nombre, tmp)
+                    filas += previo.num_rows
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+    if escritor is None:
+        raise ValueError(f"{entrada} no tiene filas.")
+    os.replace(tmp, salida)
+    segundos = time.perf_counter() - inicio
+    return {'Modelo': nombre, 'filas': filas, 'segundos': segundos,
+            'filas_por_segundo': filas / segundos if segundos > 0 else float("inf")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Asigna cluster y recomendación a un archivo Parquet completo")
+    parser.add_argument("entrada", help="Parquet con el esquema de df_cluster o una extracción nueva de la encuesta")
+    parser.add_argument("--salida", help="Parquet de salida (por defecto <entrada>_puntuado.parquet)")
+    parser.add_argument("--modelo", default=modelo_principal, help="Modelo de models/ con el que se puntúa")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo (1 = secuencial)")
+    parser.add_argument("--lote", type=int, default=65_536, help="Filas por lote leído del Parquet")
+    args = parser.parse_args()
+
+    salida = args.salida or os.path.splitext(args.entrada)[0] + "_puntuado.parquet"
+    resumen = puntuar_archivo(args.entrada, salida, args.modelo, args.workers, args.lote)
+    print(f" {resumen['filas']} filas puntuadas con {resumen['Modelo']} en {resumen['segundos']:.2f} s "
+          f"({resumen['filas_por_segundo']:,.0f} filas/s)")
+    print(f" Resultados guardados en: {salida}")
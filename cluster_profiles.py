@@ -1,66 +1,186 @@
+import argparse
+import json
+import os
+import re
+import time
+import joblib
+import numpy as np
 import pandas as pd
 
-# --- 1. Cargar archivo parquet ---
-df = pd.read_parquet("data/outputs/df_cluster_KMeans.parquet")
-
-# --- 2. Normalizar texto y limpieza general ---
-categorical_cols = ['edad', 'sexo', 'nivel_educativo', 'estrato', 'estado_imc', 'inseguridad']
-for col in categorical_cols:
-    df[col] = (
-        df[col].astype(str)
-        .str.strip()
-        .str.encode('utf-8')
-        .str.decode('utf-8', errors='ignore')
-        .str.lower()
-    )
-
-# --- 3. Mapear edad ordinal ---
-df['edad'] = df['edad'].str.replace("–", "-").str.replace(r"\s*-\s*", "-", regex=True).str.strip()
+from data_cleaning import leer_df_cluster, normalizar_texto
+from model_builder import datos_modelo
+
+# --- 1. Columnas del perfil y bandas de severidad de la inseguridad (puntaje IA) ---
+categorical_cols = ['edad', 'sexo', 'nivel_educativo', 'estrato', 'estado_imc']
+numeric_cols = ['edad_ordinal', 'imc', 'totalComidasDia', 'puntaje_ia']
 edad_map = {'18-26 años': 1, '27-49 años': 2, '50-64 años': 3}
-df['edad_ordinal'] = df['edad'].map(edad_map)
-
-# --- 4. Seleccionar un ejemplo representativo por cluster ---
-ejemplares = df.groupby("cluster", group_keys=False).apply(
-    lambda x: x.sample(1, random_state=42)
-).sort_values("cluster").reset_index(drop=True)
-
-# --- 5. Mostrar resultados por cluster ---
-print("\n Resumen representativo de cada cluster\n" + "-"*60)
-
-for _, row in ejemplares.iterrows():
-    cluster = int(row['cluster'])
-    edad = row['edad']
-    edad_ordinal = row['edad_ordinal']
-    edad_ordinal_str = f"{int(edad_ordinal)}" if pd.notna(edad_ordinal) else "N/D"
-    sexo = row['sexo']
-    educ = row['nivel_educativo']
-    estrato = row['estrato']
-    imc = row['imc']
-    estado_imc = row['estado_imc']
-    comidas = row['totalComidasDia']
-    puntaje = row['puntaje_ia']
-    inseguridad_si = "sí" if int(row['inseguridad']) == 1 else "no"
-
-    # Inseguridad descriptiva
-    if puntaje >= 10:
-        inseg_desc = "alta"
-    elif puntaje >= 5:
-        inseg_desc = "moderada"
-    elif puntaje > 0:
-        inseg_desc = "leve"
-    else:
-        inseg_desc = "nula"
-
-    print(f"\n - Cluster {cluster}")
-    print(f"• Edad: {edad} (ordinal = {edad_ordinal_str})")
-    print(f"• Sexo: {sexo}")
-    print(f"• Nivel educativo: {educ}")
-    print(f"• Estrato socioeconómico: {estrato}")
-    print(f"• IMC: {imc:.2f} — Estado IMC: {estado_imc}")
-    print(f"• Total comidas por día: {comidas:.2f}")
-    print(f"• Puntaje IA: {puntaje:.1f} → Inseguridad {inseg_desc}")
-    print(f"• Inseguridad alimentaria (preguntas tipo sí/no): {inseguridad_si.capitalize()}")
-
-# --- 6. Resumen final por tamaño ---
-print("\n Tamaño de cada cluster:")
-print(df['cluster'].value_counts().sort_index())
+
+bandas_severidad = ['nula', 'leve', 'moderada', 'alta']
+
+ruta_reporte = "data/outputs/perfiles_clusters.json"
+
+
+def banda_severidad(puntaje: np.ndarray) -> np.ndarray:
+    # nula: 0 (o sin dato), leve: > 0, moderada: >= 5, alta: >= 10
+    return np.select([puntaje >= 10, puntaje >= 5, puntaje > 0], [3, 2, 1], 0)
+
+
+# --- 2. Normalizar texto sobre las categorías (una vez por valor distinto) ---
+def normalizar(df: pd.DataFrame) -> pd.DataFrame:
+    # Minúsculas y guiones de la edad en una sola pasada por categoría
+    def edad(x):
+        return re.sub(r"\s*-\s*", "-", x.strip().lower().replace("–", "-")).strip()
+
+    for col in categorical_cols:
+        df[col] = normalizar_texto(df[col], edad if col == 'edad' else lambda x: x.strip().lower())
+    df['edad_ordinal'] = df['edad'].map(edad_map).astype(float)
+    return df
+
+
+# --- 3. Representantes: medoide y k más cercanos al centroide, en el espacio del preprocesador ---
+def representantes(X: np.ndarray, codigos: np.ndarray, n_grupos: int, top_k: int) -> tuple:
+    tamanos = np.bincount(codigos, minlength=n_grupos)
+    # Centroide de cada cluster sin recorrerlos: sumas por grupo en una sola pasada
+    sumas = np.column_stack([np.bincount(codigos, weights=X[:, j], minlength=n_grupos) for j in range(X.shape[1])])
+    centroides = sumas / np.maximum(tamanos, 1)[:, None]
+
+    distancias = np.sqrt(((X - centroides[codigos]) ** 2).sum(axis=1))
+    # Ordenar por (cluster, distancia): los más cercanos de cada cluster quedan al inicio de su tramo
+    orden = np.lexsort((distancias, codigos))
+    inicios = np.concatenate([[0], np.cumsum(tamanos)[:-1]])
+    cercanos = [orden[inicio:inicio + min(top_k, tamano)] for inicio, tamano in zip(inicios, tamanos)]
+    return cercanos, distancias
+
+
+def _valor(valor):
+    return None if pd.isna(valor) else round(float(valor), 4)
+
+
+def distribucion(serie: pd.Series, codigos: np.ndarray, n_grupos: int) -> tuple:
+    # Conteo por (cluster, categoría) con los códigos de la categórica; los nulos no cuentan
+    categorias = serie.cat.categories
+    valores = serie.cat.codes.to_numpy()
+    validos = valores >= 0
+    conteos = np.bincount(codigos[validos] * len(categorias) + valores[validos],
+                          minlength=n_grupos * len(categorias)).reshape(n_grupos, -1)
+    return categorias, conteos
+
+
+def fila_perfil(df: pd.DataFrame, posicion: int, distancia: float) -> dict:
+    fila = df.iloc[posicion]
+    registro = {'fila': int(posicion), 'distancia': round(float(distancia), 4)}
+    for col in ['LLAVE_PERSONA'] + categorical_cols + numeric_cols + ['inseguridad']:
+        if col in df.columns:
+            valor = fila[col]
+            registro[col] = None if pd.isna(valor) else valor.item() if hasattr(valor, 'item') else valor
+    registro['severidad'] = bandas_severidad[int(banda_severidad(np.array([fila['puntaje_ia']]))[0])]
+    return registro
+
+
+# --- 4. Perfil completo de un modelo: estadísticas por cluster con operaciones sobre arreglos ---
+def perfilar(df: pd.DataFrame, X: np.ndarray, top_k: int = 5) -> list:
+    clusters, codigos = np.unique(df['cluster'].to_numpy(), return_inverse=True)
+    n_grupos = len(clusters)
+    tamanos = np.bincount(codigos, minlength=n_grupos)
+    cercanos, distancias = representantes(X, codigos, n_grupos, top_k)
+
+    numericos = df[numeric_cols].astype(float)
+    estadisticas = numericos.groupby(codigos).agg(['mean', 'std', 'min', 'median', 'max'])
+    # Una sola conversión a diccionario; las celdas se leen de ahí y no del DataFrame
+    estadisticas = estadisticas.to_dict(orient="index")
+
+    severidad = banda_severidad(numericos['puntaje_ia'].to_numpy())
+    conteo_bandas = np.bincount(codigos * len(bandas_severidad) + severidad,
+                                minlength=n_grupos * len(bandas_severidad)).reshape(n_grupos, -1)
+    inseguridad = np.bincount(codigos, weights=pd.to_numeric(df['inseguridad'], errors="coerce")
+                              .fillna(0).to_numpy(dtype=float), minlength=n_grupos)
+
+    distribuciones = {col: distribucion(df[col], codigos, n_grupos) for col in categorical_cols}
+
+    perfiles = []
+    for g, cluster in enumerate(clusters):
+        perfil = {
+            'cluster': int(cluster),
+            'tamano': int(tamanos[g]),
+            'porcentaje': round(100 * tamanos[g] / len(df), 2),
+            'numericas': {col: {stat: _valor(estadisticas[g][(col, stat)])
+                                for stat in ['mean', 'std', 'min', 'median', 'max']}
+                          for col in numeric_cols},
+            'categoricas': {col: {str(categorias[c]): round(100 * conteos[g, c] / max(conteos[g].sum(), 1), 2)
+                                  for c in np.argsort(-conteos[g], kind="stable") if conteos[g, c] > 0}
+                            for col, (categorias, conteos) in distribuciones.items()},
+            '% inseguridad': round(100 * inseguridad[g] / tamanos[g], 2),
+            'severidad': {banda: round(100 * conteo_bandas[g, b] / tamanos[g], 2)
+                          for b, banda in enumerate(bandas_severidad)}
+        }
+        # El ruido de DBSCAN no es un grupo: no tiene centroide ni representantes
+        if cluster == -1:
+            perfil['medoide'], perfil['cercanos'] = None, []
+        else:
+            perfil['cercanos'] = [fila_perfil(df, pos, distancias[pos]) for pos in cercanos[g]]
+            perfil['medoide'] = perfil['cercanos'][0]
+        perfiles.append(perfil)
+    return perfiles
+
+
+def perfilar_modelo(modelo: str, preprocessor, top_k: int) -> dict:
+    df = leer_df_cluster(f"data/outputs/df_cluster_{modelo}.parquet")
+    # Mismo espacio de características que vieron los modelos al entrenar (antes de normalizar el texto)
+    X = preprocessor.transform(datos_modelo(df))
+    df = normalizar(df)
+    return {'modelo': modelo, 'filas': len(df), 'top_k': top_k, 'clusters': perfilar(df, X, top_k)}
+
+
+# --- 5. Resumen legible del medoide de cada cluster ---
+def imprimir(reporte: dict) -> None:
+    print(f"\n Resumen representativo de cada cluster — {reporte['modelo']}\n" + "-"*60)
+    for perfil in reporte['clusters']:
+        fila = perfil['medoide']
+        if fila is None:
+            print(f"\n - Ruido ({perfil['tamano']} personas): sin representante")
+            continue
+        edad_ordinal_str = f"{int(fila['edad_ordinal'])}" if fila['edad_ordinal'] is not None else "N/D"
+        print(f"\n - Cluster {perfil['cluster']} ({perfil['tamano']} personas, {perfil['porcentaje']}%)")
+        print(f"• Edad: {fila['edad']} (ordinal = {edad_ordinal_str})")
+        print(f"• Sexo: {fila['sexo']}")
+        print(f"• Nivel educativo: {fila['nivel_educativo']}")
+        print(f"• Estrato socioeconómico: {fila['estrato']}")
+        print(f"• IMC: {fila['imc']:.2f} — Estado IMC: {fila['estado_imc']}")
+        print(f"• Total comidas por día: {fila['totalComidasDia']:.2f}")
+        print(f"• Puntaje IA: {fila['puntaje_ia']:.1f} → Inseguridad {fila['severidad']}")
+        print(f"• Inseguridad alimentaria (preguntas tipo sí/no): {'Sí' if fila['inseguridad'] == 1 else 'No'}")
+        print(f"• Severidad en el cluster: "
+              + ", ".join(f"{banda} {p}%" for banda, p in perfil['severidad'].items()))
+
+
+def guardar_reporte(reportes: list, ruta: str = ruta_reporte) -> None:
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({'modelos': reportes}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, ruta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perfil y representantes de cada cluster para cada modelo")
+    parser.add_argument("--modelos", nargs="+",
+                        help="Modelos a perfilar (por defecto los de clustering_comparison.parquet)")
+    parser.add_argument("--top-k", type=int, default=5, help="Personas más cercanas al centroide por cluster")
+    parser.add_argument("--salida", default=ruta_reporte, help="Reporte JSON de perfiles")
+    args = parser.parse_args()
+
+    modelos = args.modelos or pd.read_parquet("data/outputs/clustering_comparison.parquet")['Modelo'].tolist()
+    preprocessor = joblib.load("models/preprocessor.pkl")
+
+    reportes = []
+    for modelo in modelos:
+        if not os.path.exists(f"data/outputs/df_cluster_{modelo}.parquet"):
+            print(f" Archivo no encontrado: data/outputs/df_cluster_{modelo}.parquet")
+            continue
+        inicio = time.perf_counter()
+        reporte = perfilar_modelo(modelo, preprocessor, args.top_k)
+        imprimir(reporte)
+        print(f"\n {modelo}: {reporte['filas']} filas perfiladas en {time.perf_counter() - inicio:.2f} s")
+        reportes.append(reporte)
+
+    guardar_reporte(reportes, args.salida)
+    print(f"\n Reporte de perfiles guardado en: {args.salida}")
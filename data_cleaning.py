@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# --- Esquema compacto de df_cluster ---
+bin_cols = ['SA10_1', 'SA11_1', 'disminuir_porciones', 'pedir_prestado', 'menor_calidad', 'inseguridad']
+categoricas = ['edad', 'sexo', 'nivel_educativo', 'estrato', 'estado_imc']
+
+respuestas_binarias = {'sí': 1, 'si': 1, 'no': 0, 'nan': 0, '': 0}
+
+
+# --- 1. Valor binario de una respuesta (se evalúa una vez por categoría, no por fila) ---
+def _valor_binario(valor) -> int:
+    texto = str(valor).strip().lower()
+    if texto in respuestas_binarias:
+        return respuestas_binarias[texto]
+    numero = pd.to_numeric(texto, errors='coerce')
+    return 0 if pd.isna(numero) else int(numero)
+
+
+def _codigos_y_categorias(serie: pd.Series) -> tuple:
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(), serie.cat.categories
+    codigos, categorias = pd.factorize(serie, use_na_sentinel=True)
+    return codigos, categorias
+
+
+def a_binaria(serie: pd.Series) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.fillna(0).to_numpy().astype(np.int8)
+    codigos, categorias = _codigos_y_categorias(serie)
+    # La última posición de la tabla atiende el código -1 (faltante) -> 0
+    tabla = np.array([_valor_binario(c) for c in categorias] + [0], dtype=np.int8)
+    return tabla[codigos]
+
+
+def limpiar_binarias(df: pd.DataFrame, columnas: list = bin_cols) -> pd.DataFrame:
+    for col in columnas:
+        df[col] = a_binaria(df[col])
+    return df
+
+
+# --- 2. Normalización de texto sobre las categorías, no sobre cada fila ---
+def normalizar_texto(serie: pd.Series, funcion) -> pd.Series:
+    codigos, categorias = _codigos_y_categorias(serie)
+    nuevas = pd.Index([funcion(str(c)) for c in categorias])
+    unicas = pd.Index(nuevas.unique())
+    tabla = np.append(unicas.get_indexer(nuevas), -1)
+    return pd.Series(pd.Categorical.from_codes(tabla[codigos], categories=unicas), index=serie.index, name=serie.name)
+
+
+# --- 3. Tipos compactos: categóricas para texto, int8 para binarias ---
+def compactar_tipos(df: pd.DataFrame) -> pd.DataFrame:
+    for col in categoricas:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in bin_cols:
+        if col in df.columns and df[col].dtype != np.int8:
+            df[col] = a_binaria(df[col])
+    return df
+
+
+def leer_df_cluster(ruta: str, columnas: list = None) -> pd.DataFrame:
+    # Archivos anteriores al esquema compacto se convierten al leerlos
+    return compactar_tipos(pd.read_parquet(ruta, columns=columnas))
@@ -0,0 +1,134 @@
+import numpy as np
+
+from scipy import stats
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, pairwise_distances_chunked
+
+# --- Modos de cálculo del coeficiente Silhouette ---
+#   exacto:   todas las filas, distancias por bloques (nunca la matriz n x n completa)
+#   muestreo: muestras estratificadas por cluster, repetidas con varias semillas
+#   auto:     exacto si n <= tamano_muestra, muestreo en otro caso
+modos = ("auto", "exacto", "muestreo")
+
+config_por_defecto = {
+    "modo": "auto",
+    "tamano_muestra": 10_000,
+    "repeticiones": 5,
+    "semilla": 42,
+    "confianza": 0.95,
+    "memoria_mb": 256
+}
+
+
+# --- 1. Silhouette exacto por bloques de filas ---
+def silhouette_por_bloques(X, labels, memoria_mb: int = 256) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float64)
+    etiquetas, codigos = np.unique(labels, return_inverse=True)
+    k = len(etiquetas)
+    tamanos = np.bincount(codigos, minlength=k).astype(np.float64)
+    indicadora = np.zeros((len(codigos), k))
+    indicadora[np.arange(len(codigos)), codigos] = 1.0
+
+    def reducir(D, inicio):
+        # Suma de distancias de cada fila del bloque hacia cada cluster: (bloque x n) @ (n x k)
+        sumas = D @ indicadora
+        filas = codigos[inicio:inicio + len(D)]
+        propias = sumas[np.arange(len(D)), filas]
+        a = propias / np.maximum(tamanos[filas] - 1, 1)
+        medias = sumas / tamanos
+        medias[np.arange(len(D)), filas] = np.inf
+        b = medias.min(axis=1)
+        return a, b
+
+    partes = list(pairwise_distances_chunked(X, reduce_func=reducir, working_memory=memoria_mb))
+    a = np.concatenate([p[0] for p in partes])
+    b = np.concatenate([p[1] for p in partes])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = (b - a) / np.maximum(a, b)
+    # Igual que sklearn: clusters de un solo elemento valen 0
+    s[tamanos[codigos] <= 1] = 0.0
+    return np.nan_to_num(s)
+
+
+# --- 2. Muestra estratificada por cluster (proporcional, al menos 2 por cluster) ---
+def muestra_estratificada(labels, tamano: int, semilla: int) -> np.ndarray:
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(semilla)
+    n = len(labels)
+    if tamano >= n:
+        return np.arange(n)
+
+    etiquetas, codigos = np.unique(labels, return_inverse=True)
+    orden = np.argsort(codigos, kind="stable")
+    limites = np.cumsum(np.bincount(codigos, minlength=len(etiquetas)))[:-1]
+    indices = []
+    for grupo in np.split(orden, limites):
+        m = min(len(grupo), max(2, int(round(len(grupo) * tamano / n))))
+        indices.append(rng.choice(grupo, size=m, replace=False))
+    return np.sort(np.concatenate(indices))
+
+
+def _intervalo(valores: np.ndarray, confianza: float) -> tuple:
+    media = float(np.mean(valores))
+    if len(valores) < 2:
+        return media, np.nan, np.nan
+    margen = stats.t.ppf((1 + confianza) / 2, len(valores) - 1) * np.std(valores, ddof=1) / np.sqrt(len(valores))
+    return media, float(media - margen), float(media + margen)
+
+
+def resolver_modo(n: int, config: dict) -> str:
+    modo = config["modo"]
+    if modo not in modos:
+        raise ValueError(f"Modo de métricas desconocido: {modo}")
+    if modo == "auto":
+        return "exacto" if n <= config["tamano_muestra"] else "muestreo"
+    return modo
+
+
+# --- 3. Silhouette global según el modo configurado ---
+def silhouette(X, labels, config: dict = None) -> dict:
+    config = {**config_por_defecto, **(config or {})}
+    labels = np.asarray(labels)
+    modo = resolver_modo(len(labels), config)
+
+    if modo == "exacto":
+        valor = float(np.mean(silhouette_por_bloques(X, labels, config["memoria_mb"])))
+        return {"Silhouette": valor, "Silhouette_IC_inf": valor, "Silhouette_IC_sup": valor,
+                "Modo_metricas": modo, "n_muestra": len(labels), "repeticiones": 1,
+                "semilla": config["semilla"]}
+
+    valores, n_muestra = [], 0
+    for r in range(config["repeticiones"]):
+        idx = muestra_estratificada(labels, config["tamano_muestra"], config["semilla"] + r)
+        n_muestra = len(idx)
+        if len(np.unique(labels[idx])) < 2:
+            continue
+        valores.append(np.mean(silhouette_por_bloques(X[idx], labels[idx], config["memoria_mb"])))
+    if not valores:
+        raise ValueError("La muestra no contiene al menos dos clusters.")
+
+    media, inf, sup = _intervalo(np.array(valores), config["confianza"])
+    return {"Silhouette": media, "Silhouette_IC_inf": inf, "Silhouette_IC_sup": sup,
+            "Modo_metricas": modo, "n_muestra": n_muestra, "repeticiones": len(valores),
+            "semilla": config["semilla"]}
+
+
+# --- 4. Valores por muestra para graficar (todas las filas o una muestra estratificada) ---
+def silhouette_muestras(X, labels, config: dict = None) -> tuple:
+    config = {**config_por_defecto, **(config or {})}
+    labels = np.asarray(labels)
+    modo = resolver_modo(len(labels), config)
+    if modo == "exacto":
+        idx = np.arange(len(labels))
+    else:
+        idx = muestra_estratificada(labels, config["tamano_muestra"], config["semilla"])
+    return idx, silhouette_por_bloques(np.asarray(X)[idx], labels[idx], config["memoria_mb"]), modo
+
+
+# --- 5. Métricas completas de un clustering ---
+def evaluar_clustering(X, labels, config: dict = None) -> dict:
+    # Calinski-Harabasz y Davies-Bouldin son O(n·k): siempre sobre todas las filas
+    metricas = silhouette(X, labels, config)
+    metricas["Calinski-Harabasz"] = calinski_harabasz_score(X, labels)
+    metricas["Davies-Bouldin"] = davies_bouldin_score(X, labels)
+    return metricas
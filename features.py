@@ -0,0 +1,224 @@
+import typing
+import numpy as np
+import pandas as pd
+
+from pydantic import BaseModel, Field
+
+from data_cleaning import a_binaria
+
+
+# --- 1. Esquemas de entrada ---
+class UsuarioCrudo(BaseModel):
+    # Respuestas tal como llegan del formulario o de la API (límites iguales a los del formulario)
+    edad: str
+    sexo: str
+    nivel_educativo: str
+    estrato: str
+    peso: float = Field(ge=20, le=250)
+    altura: float = Field(ge=120, le=250)
+    totalComidasDia: float = Field(ge=1, le=8)
+    sa10_1: int = Field(ge=0, le=1)
+    sa11_1: int = Field(ge=0, le=1)
+    menor_calidad: int = Field(ge=0, le=1)
+
+
+class UsuarioDerivado(BaseModel):
+    # Características que consumen los modelos; null se imputa igual que al entrenar
+    edad_ordinal: float | None
+    imc: float | None = Field(gt=0)
+    totalComidasDia: float | None = Field(ge=0)
+    puntaje_ia: float | None = Field(ge=0)
+    sexo: str | None
+    nivel_educativo: str | None
+    estado_imc: str | None
+    estrato: str | None
+    inseguridad: int | None = Field(ge=0, le=1)
+
+
+columnas_crudas = list(UsuarioCrudo.model_fields)
+columnas_derivadas = list(UsuarioDerivado.model_fields)
+
+# Campos que solo existen en la forma cruda: con alguno de ellos el usuario se deriva
+solo_crudas = [col for col in columnas_crudas if col not in columnas_derivadas]
+claves_derivadas = frozenset(columnas_derivadas)
+texto_formulario = ['sexo', 'nivel_educativo', 'estrato']
+# Categóricas del preprocesador (model_builder.categorical_cols): se ajustó con ellas como texto
+categoricas_modelo = ['sexo', 'nivel_educativo', 'estado_imc', 'estrato', 'inseguridad']
+
+# El formulario usa guion y los .dta raya: se normalizan ambos
+edad_map = {
+    '18 - 26 años': 1,
+    '27 - 49 años': 2,
+    '50 - 64 años': 3
+}
+
+
+# --- 2. Reglas de validación leídas de los modelos Pydantic ---
+def _reglas(modelo) -> list:
+    reglas = []
+    for campo, info in modelo.model_fields.items():
+        tipos = [t for t in typing.get_args(info.annotation) if t is not type(None)] or [info.annotation]
+        limites = {op: getattr(m, op) for m in info.metadata for op in ('gt', 'ge', 'lt', 'le') if hasattr(m, op)}
+        anulable = type(None) in typing.get_args(info.annotation)
+        reglas.append((campo, tipos[0], anulable, limites))
+    return reglas
+
+
+reglas_crudas = _reglas(UsuarioCrudo)
+reglas_derivadas = _reglas(UsuarioDerivado)
+
+comparaciones = {
+    'gt': (np.greater, ">"),
+    'ge': (np.greater_equal, ">="),
+    'lt': (np.less, "<"),
+    'le': (np.less_equal, "<=")
+}
+
+
+def _anotar(errores: dict, filas: np.ndarray, campo: str, tipo: str, mensaje: str) -> None:
+    for fila in filas:
+        errores.setdefault(int(fila), []).append({"campo": campo, "tipo": tipo, "mensaje": mensaje})
+
+
+# --- 3. Validación vectorizada: una pasada por columna para todo el lote ---
+def validar_tabla(df: pd.DataFrame, presentes: pd.DataFrame, reglas: list, filas: np.ndarray) -> dict:
+    errores = {}
+    for campo, tipo, anulable, limites in reglas:
+        presente = presentes[campo].to_numpy() if campo in presentes else np.zeros(len(df), dtype=bool)
+        _anotar(errores, filas[~presente], campo, "faltante", f"Falta la columna: {campo}")
+        if not presente.any():
+            continue
+
+        valores = df[campo]
+        nulos = valores.isna().to_numpy() & presente
+        if not anulable:
+            _anotar(errores, filas[nulos], campo, "nulo", f"La columna {campo} no puede ser nula.")
+
+        if tipo in (int, float):
+            numeros = pd.to_numeric(valores, errors="coerce").to_numpy(dtype=np.float64)
+            no_numericos = np.isnan(numeros) & ~nulos & presente
+            _anotar(errores, filas[no_numericos], campo, "tipo", f"Valor no numérico en la columna: {campo}")
+            ok = ~np.isnan(numeros)
+            if tipo is int:
+                _anotar(errores, filas[ok & (numeros % 1 != 0)], campo, "tipo", f"La columna {campo} debe ser entera.")
+            for op, limite in limites.items():
+                funcion, simbolo = comparaciones[op]
+                fuera = ok.copy()
+                fuera[ok] = ~funcion(numeros[ok], limite)
+                _anotar(errores, filas[fuera], campo, "rango", f"La columna {campo} debe ser {simbolo} {limite}.")
+        elif tipo is str and not isinstance(valores.dtype, pd.StringDtype):
+            no_texto = ~valores.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool) & ~nulos & presente
+            _anotar(errores, filas[no_texto], campo, "tipo", f"Valor inválido en la columna: {campo}")
+    return errores
+
+
+# --- 4. Derivación vectorizada de características (reglas del formulario) ---
+def derivar_caracteristicas(df: pd.DataFrame) -> pd.DataFrame:
+    # Solo se derivan las columnas que faltan: los archivos con columnas ya calculadas se respetan
+    if 'edad_ordinal' not in df.columns and 'edad' in df.columns:
+        edad = df['edad'].astype(str).str.strip().str.replace("–", "-", regex=False)
+        df['edad_ordinal'] = edad.map(edad_map).astype(float)
+
+    if 'imc' not in df.columns and {'peso', 'altura'} <= set(df.columns):
+        altura = pd.to_numeric(df['altura'], errors="coerce") / 100
+        df['imc'] = pd.to_numeric(df['peso'], errors="coerce") / altura ** 2
+
+    if 'estado_imc' not in df.columns and 'imc' in df.columns:
+        imc = pd.to_numeric(df['imc'], errors="coerce")
+        estado = np.select([imc < 18.5, imc < 25, imc >= 25], ["delgadez", "normal", "exceso de peso"], None)
+        df['estado_imc'] = pd.Series(estado, index=df.index, dtype=object)
+
+    if 'puntaje_ia' not in df.columns and {'sa10_1', 'sa11_1', 'menor_calidad'} <= set(df.columns):
+        # Acepta 0/1 del formulario y las etiquetas Sí/No de los .dta
+        df['puntaje_ia'] = sum(a_binaria(df[col]).astype(np.int64) for col in ['sa10_1', 'sa11_1', 'menor_calidad'])
+
+    if 'inseguridad' not in df.columns and 'puntaje_ia' in df.columns:
+        df['inseguridad'] = (pd.to_numeric(df['puntaje_ia'], errors="coerce") > 0).astype(int)
+    return df
+
+
+# --- 5. Categóricas en la forma del entrenamiento (datos_modelo): 1, 1.0, True y "1" son "1" ---
+def texto_categoria(valor):
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    if isinstance(valor, (bool, np.bool_, int, np.integer)):
+        return str(int(valor))
+    if isinstance(valor, (float, np.floating)) and float(valor).is_integer():
+        return str(int(valor))
+    if isinstance(valor, float):
+        return str(valor)
+    # Texto y tipos no válidos pasan tal cual: el motor marca estos últimos como error
+    return valor
+
+
+def normalizar_categoricas(df: pd.DataFrame) -> pd.DataFrame:
+    # Una conversión por valor distinto, no por fila
+    for col in categoricas_modelo:
+        if col in df.columns:
+            codigos, unicos = pd.factorize(df[col], use_na_sentinel=True)
+            tabla = np.array([texto_categoria(v) for v in unicos] + [None], dtype=object)
+            df[col] = pd.Series(tabla[codigos], index=df.index, dtype=object)
+    return df
+
+
+def normalizar_usuario(usuario: dict) -> dict:
+    return {**usuario, **{col: texto_categoria(usuario[col]) for col in categoricas_modelo if col in usuario}}
+
+
+def normalizar_formulario(df: pd.DataFrame) -> pd.DataFrame:
+    for col in texto_formulario:
+        df[col] = df[col].astype(str).str.lower().str.strip()
+    return df
+
+
+def _tabla(registros: list, columnas: list) -> tuple:
+    df = pd.DataFrame.from_records(registros, columns=columnas) if registros else pd.DataFrame(columns=columnas)
+    # Un nulo puede ser un campo ausente o un null explícito: solo esas celdas se revisan una a una
+    presentes = df.notna()
+    for col in columnas:
+        nulas = np.flatnonzero(~presentes[col].to_numpy())
+        if len(nulas):
+            presentes.iloc[nulas, presentes.columns.get_loc(col)] = [col in registros[j] for j in nulas]
+    return df, presentes
+
+
+# --- 6. Lote de la API: valida una vez y deriva a los usuarios que llegan en forma cruda ---
+def preparar_lote(usuarios: list) -> tuple:
+    errores = {}
+    preparados = [None] * len(usuarios)
+    posiciones = []
+    for i, usuario in enumerate(usuarios):
+        if isinstance(usuario, dict):
+            posiciones.append(i)
+        else:
+            errores[i] = [{"campo": None, "tipo": "tipo", "mensaje": "Cada usuario debe ser un objeto JSON."}]
+    if not posiciones:
+        return preparados, errores
+
+    filas = np.array(posiciones)
+    registros = [usuarios[i] for i in posiciones]
+    # Un usuario con algún campo de formulario y sin todas las características se deriva
+    crudo = np.array([not u.keys().isdisjoint(solo_crudas) and not u.keys() >= claves_derivadas
+                      for u in registros], dtype=bool)
+
+    df_derivado, presentes = _tabla([r for r, c in zip(registros, crudo) if not c], columnas_derivadas)
+    errores.update(validar_tabla(df_derivado, presentes, reglas_derivadas, filas[~crudo]))
+    df, presentes = _tabla([r for r, c in zip(registros, crudo) if c], columnas_crudas)
+    errores.update(validar_tabla(df, presentes, reglas_crudas, filas[crudo]))
+
+    # Los usuarios que ya traen las características pasan tal cual
+    for j in np.flatnonzero(~crudo):
+        if posiciones[j] not in errores:
+            preparados[posiciones[j]] = normalizar_usuario(registros[j])
+
+    validos = ~np.isin(filas[crudo], list(errores))
+    if validos.any():
+        derivados = derivar_caracteristicas(normalizar_formulario(df[validos].copy()))
+        for campo, tipo, _, _ in reglas_derivadas:
+            if tipo in (int, float):
+                derivados[campo] = pd.to_numeric(derivados[campo])
+        # inseguridad se valida como entero, pero el modelo la ve como texto
+        derivados = normalizar_categoricas(derivados)
+        for i, usuario in zip(filas[crudo][validos], derivados[columnas_derivadas].to_dict(orient="records")):
+            preparados[i] = usuario
+    return preparados, errores
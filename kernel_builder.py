@@ -0,0 +1,228 @@
+import joblib
+import numpy as np
+
+# --- Columnas que espera el preprocesador ---
+numeric_cols = ['edad_ordinal', 'imc', 'totalComidasDia', 'puntaje_ia']
+categorical_cols = ['sexo', 'nivel_educativo', 'estado_imc', 'estrato', 'inseguridad']
+
+
+# --- 1. Extraer constantes del ColumnTransformer y del KMeans ajustados ---
+def compilar_preprocesador(preprocessor) -> dict:
+    transformadores = {name: (pipe, cols) for name, pipe, cols in preprocessor.transformers_
+                       if name in ("num", "cat")}
+    num_pipe, num_cols = transformadores["num"]
+    cat_pipe, cat_cols = transformadores["cat"]
+
+    imp_num = num_pipe.named_steps["imp"]
+    scaler = num_pipe.named_steps["scale"]
+    imp_cat = cat_pipe.named_steps["imp"]
+    enc = cat_pipe.named_steps["enc"]
+
+    if enc.drop is not None or enc.handle_unknown != "ignore":
+        raise ValueError("El motor solo soporta OneHotEncoder(handle_unknown='ignore', drop=None).")
+    if imp_num.add_indicator or imp_cat.add_indicator:
+        raise ValueError("El motor no soporta SimpleImputer(add_indicator=True).")
+
+    # SimpleImputer descarta las columnas sin ningún valor observado en el ajuste
+    num_cols = list(num_cols)
+    conservadas = set(imp_num.get_feature_names_out(num_cols))
+    mascara = np.array([col in conservadas for col in num_cols])
+
+    n_num = int(mascara.sum())
+    media = scaler.mean_ if scaler.mean_ is not None and scaler.with_mean else np.zeros(n_num)
+    escala = scaler.scale_ if scaler.scale_ is not None and scaler.with_std else np.ones(n_num)
+
+    artefacto = {
+        "num_cols": np.array(num_cols, dtype=str),
+        "num_conservadas": mascara,
+        "num_imputacion": np.asarray(imp_num.statistics_, dtype=np.float64),
+        "num_media": np.asarray(media, dtype=np.float64),
+        "num_escala": np.asarray(escala, dtype=np.float64),
+        "cat_cols": np.array(list(cat_cols), dtype=str),
+        "cat_imputacion": np.array([str(v) for v in imp_cat.statistics_], dtype=str),
+    }
+    for i, categorias in enumerate(enc.categories_):
+        artefacto[f"cat_categorias_{i}"] = np.array([str(v) for v in categorias], dtype=str)
+    return artefacto
+
+
+def compilar_motor(preprocessor, model) -> dict:
+    artefacto = compilar_preprocesador(preprocessor)
+    artefacto["centroides"] = np.asarray(model.cluster_centers_, dtype=np.float64)
+    artefacto.update(compilar_tabla(artefacto))
+    return artefacto
+
+
+# --- 2. Tabla de decisión: la distancia a cada centroide es una constante por combinación
+#         de categorías más una función lineal de las columnas numéricas ---
+#   d_j(x) = ||c_j||² - 2 x·c_j = puntos[combinación, j] + Σ_d v_d · pendientes[d, j]
+def compilar_tabla(artefacto: dict) -> dict:
+    centroides = np.asarray(artefacto["centroides"], dtype=np.float64)
+    media = np.asarray(artefacto["num_media"], dtype=np.float64)
+    escala = np.asarray(artefacto["num_escala"], dtype=np.float64)
+    n_num = int(np.asarray(artefacto["num_conservadas"], dtype=bool).sum())
+    k = len(centroides)
+
+    # Parte numérica: x_d = (v_d - media_d) / escala_d; la constante se suma a cada fila de la tabla
+    c_num = centroides[:, :n_num]
+    pendientes = (-2.0 * c_num / escala).T
+    base = (centroides ** 2).sum(axis=1) + 2.0 * (c_num * (media / escala)).sum(axis=1)
+
+    # Parte categórica: una fila por categoría conocida y una última (ceros) para desconocidas
+    puntos = base
+    tamanos = []
+    columna = n_num
+    i = 0
+    while f"cat_categorias_{i}" in artefacto:
+        m = len(artefacto[f"cat_categorias_{i}"])
+        aporte = np.vstack([-2.0 * centroides[:, columna:columna + m].T, np.zeros(k)])
+        puntos = puntos[..., None, :] + aporte
+        tamanos.append(m + 1)
+        columna += m
+        i += 1
+
+    pasos = np.cumprod([1] + tamanos[:0:-1])[::-1] if tamanos else np.array([], dtype=np.int64)
+    return {
+        "tabla_puntos": np.ascontiguousarray(puntos.reshape(-1, k)),
+        "tabla_pendientes": np.ascontiguousarray(pendientes),
+        "tabla_pasos": np.asarray(pasos, dtype=np.int64)
+    }
+
+
+# --- 3. Verificar que el motor reproduce exactamente a sklearn ---
+def verificar_paridad(motor, preprocessor, model, df) -> int:
+    import pandas as pd
+
+    # Mismas conversiones que model_builder aplica antes de ajustar el preprocesador
+    columnas = df[numeric_cols + categorical_cols].astype({col: str for col in categorical_cols})
+    usuarios = columnas.astype(object).where(columnas.notna(), None).to_dict(orient="records")
+
+    # Casos sintéticos: categorías desconocidas, faltantes y enteros en lugar de texto
+    rng = np.random.default_rng(42)
+    for i in range(min(len(usuarios), 500)):
+        u = dict(usuarios[i])
+        u["imc"] = float(rng.uniform(12, 50))
+        u["totalComidasDia"] = float(rng.uniform(0.5, 8))
+        u[categorical_cols[i % len(categorical_cols)]] = None if i % 2 else "desconocido"
+        u["inseguridad"] = int(i % 2)
+        usuarios.append(u)
+
+    esperado = model.predict(preprocessor.transform(pd.DataFrame(usuarios, columns=numeric_cols + categorical_cols)))
+    obtenido, errores = motor.predecir_lote(usuarios)
+    if errores:
+        raise AssertionError(f"El motor rechazó {len(errores)} filas válidas para sklearn.")
+
+    diferencias = np.flatnonzero(esperado != obtenido)
+    if len(diferencias):
+        raise AssertionError(f"El motor difiere de sklearn en {len(diferencias)} de {len(usuarios)} filas.")
+    return len(usuarios)
+
+
+# --- 3b. Un mismo usuario recibe el mismo cluster sin importar el tipo JSON de sus categóricas,
+#          tanto en la API (preparar_lote) como en la puntuación masiva (leer_tabla) ---
+def verificar_tipos(motor, df, n: int = 500) -> int:
+    import pandas as pd
+    from features import columnas_derivadas, normalizar_categoricas, preparar_lote
+
+    base = df[columnas_derivadas].head(n).astype(object)
+    base = base.where(base.notna(), None).to_dict(orient="records")
+    variantes = {
+        "entero": [{**u, "inseguridad": int(float(u["inseguridad"] or 0))} for u in base],
+        "decimal": [{**u, "inseguridad": float(u["inseguridad"] or 0)} for u in base],
+        "texto": [{**u, "inseguridad": str(int(float(u["inseguridad"] or 0)))} for u in base]
+    }
+
+    clusters = {}
+    for nombre, usuarios in variantes.items():
+        preparados, errores = preparar_lote(usuarios)
+        if errores:
+            raise AssertionError(f"La validación rechazó {len(errores)} usuarios ({nombre}).")
+        clusters[f"api_{nombre}"], _ = motor.predecir_lote(preparados)
+        tabla = normalizar_categoricas(pd.DataFrame(usuarios, columns=columnas_derivadas))
+        clusters[f"masiva_{nombre}"] = motor.clasificar(*motor.leer_tabla(tabla))
+
+    referencia = clusters["api_texto"]
+    for nombre, obtenido in clusters.items():
+        diferencias = np.flatnonzero(obtenido != referencia)
+        if len(diferencias):
+            raise AssertionError(f"{nombre} difiere de api_texto en {len(diferencias)} de {len(referencia)} filas.")
+    return len(referencia)
+
+
+# --- 4. Verificación exhaustiva de la tabla: toda combinación de categorías (incluidas
+#         desconocidas y faltantes) sobre una rejilla de valores numéricos ---
+rejilla_numerica = {
+    "imc": [None] + list(np.linspace(12, 50, 16)),
+    "totalComidasDia": [None] + list(np.linspace(0.5, 8, 8)),
+    "puntaje_ia": [None, 0, 1, 2, 3]
+}
+
+
+def verificar_tabla(motor, preprocessor, model, aleatorios: int = 100, bloque: int = 50) -> tuple:
+    import itertools
+    import pandas as pd
+
+    rng = np.random.default_rng(42)
+    opciones = [[str(c) for c in categorias] + ["desconocido", None]
+                for categorias in preprocessor.named_transformers_["cat"].named_steps["enc"].categories_]
+    numericas = [rejilla_numerica.get(col, [None]) for col in numeric_cols]
+    rejilla = list(itertools.product(*numericas))
+    combinaciones = list(itertools.product(*opciones))
+
+    filas = 0
+    for inicio in range(0, len(combinaciones), bloque):
+        usuarios = []
+        for combinacion in combinaciones[inicio:inicio + bloque]:
+            categoricas = dict(zip(categorical_cols, combinacion))
+            for valores in rejilla:
+                usuarios.append({**dict(zip(numeric_cols, valores)), **categoricas})
+            # Puntos continuos al azar para cruzar fronteras fuera de la rejilla
+            for _ in range(aleatorios):
+                usuarios.append({"edad_ordinal": None, "imc": float(rng.uniform(10, 70)),
+                                 "totalComidasDia": float(rng.uniform(0, 9)),
+                                 "puntaje_ia": float(rng.uniform(0, 15)), **categoricas})
+
+        df = pd.DataFrame(usuarios, columns=numeric_cols + categorical_cols)
+        df[numeric_cols] = df[numeric_cols].astype(float)
+        # Un bloque con la columna entera en None queda como object y sklearn no lo ve como faltante
+        for col in categorical_cols:
+            df[col] = np.where(df[col].isna(), np.nan, df[col].astype(object))
+        esperado = model.predict(preprocessor.transform(df))
+        obtenido, errores = motor.predecir_lote(usuarios)
+        if errores:
+            raise AssertionError(f"La tabla rechazó {len(errores)} filas válidas para sklearn.")
+        diferencias = np.flatnonzero(esperado != obtenido)
+        if len(diferencias):
+            raise AssertionError(f"La tabla difiere de sklearn en {len(diferencias)} filas "
+                                 f"(primera: {usuarios[diferencias[0]]}).")
+        filas += len(usuarios)
+    return len(combinaciones), filas
+
+
+if __name__ == "__main__":
+    import pandas as pd
+    from model_artifacts import exportar_modelo, exportar_preprocesador
+    from recommender import MotorInferencia, migrar_perfiles
+
+    # --- 5. Compilar desde los objetos ajustados ---
+    model = joblib.load("models/KMeans_model.pkl")
+    preprocessor = joblib.load("models/preprocessor.pkl")
+    artefacto = compilar_motor(preprocessor, model)
+    motor = MotorInferencia(artefacto)
+
+    # --- 6. Validar contra sklearn antes de publicar ---
+    df = pd.read_parquet("data/outputs/df_cluster_KMeans.parquet")
+    n = verificar_paridad(motor, preprocessor, model, df)
+    print(f" Paridad verificada con sklearn en {n} filas.")
+    n = verificar_tipos(motor, df)
+    print(f" Mismo cluster con inseguridad como entero, decimal o texto (API y masiva) en {n} filas.")
+    combinaciones, filas = verificar_tabla(motor, preprocessor, model)
+    print(f" Tabla de decisión verificada: {combinaciones} combinaciones de categorías, {filas} filas.")
+
+    # --- 7. Publicar en el formato mapeable (manifiesto + .npy); el modelo lleva la tabla de decisión ---
+    print(f" Preprocesador exportado en: {exportar_preprocesador(preprocessor)}")
+    print(f" Motor compilado guardado en: {exportar_modelo('KMeans', model, preprocessor)}")
+
+    # --- 8. Migración única: perfiles de modelos entrenados antes de models/*_perfiles.parquet ---
+    for ruta in migrar_perfiles():
+        print(f" Perfiles migrados a: {ruta}")
@@ -1,19 +1,49 @@
 # main.py
+import json
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from recommender import recomendar
+from starlette.requests import ClientDisconnect
+from metrics import MiddlewareMetricas, metricas
+from micro_batcher import AgrupadorPeticiones, ColaLlena
+from recommender import cache_predicciones, recomendar_batch, registro
 
 import pandas as pd
 
-app = FastAPI()
+
+# --- Inferencia fuera del event loop: pool acotado de hilos y agrupación de peticiones sueltas ---
+agrupador = AgrupadorPeticiones(
+    recomendar_batch,
+    hilos=int(os.environ.get("HILOS_INFERENCIA", "2")),
+    max_lote=int(os.environ.get("MAX_LOTE_INFERENCIA", "256")),
+    espera_ms=float(os.environ.get("ESPERA_LOTE_MS", "2")),
+    max_cola=int(os.environ.get("MAX_COLA_INFERENCIA", "10000"))
+)
+
+
+# --- Precarga de modelos al arrancar cada worker y vigilancia de nuevos .pkl ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registro.precargar()
+    registro.iniciar_vigilancia()
+    agrupador.iniciar()
+    yield
+    await agrupador.detener()
+    registro.detener_vigilancia()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MiddlewareMetricas)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="template")
 
 @app.get("/", response_class=HTMLResponse)
 async def form_home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
 @app.post("/clasificar_usuario", response_class=HTMLResponse)
 async def clasificar_usuario(
@@ -29,73 +59,236 @@ async def clasificar_usuario(
     sa11_1: str = Form(...),
     menor_calidad: str = Form(...)
 ):
-    # --- Mapear edad a ordinal ---
-    edad_map = {
-        '18 - 26 años': 1,
-        '27 - 49 años': 2,
-        '50 - 64 años': 3
+    # --- Respuestas crudas: la derivación (edad, IMC, estado, puntaje IA) es la misma de /predecir ---
+    usuario = {
+        "edad": edad,
+        "sexo": sexo,
+        "nivel_educativo": nivel_educativo,
+        "estrato": estrato,
+        "peso": peso,
+        "altura": altura,
+        "totalComidasDia": totalComidasDia,
+        "sa10_1": sa10_1,
+        "sa11_1": sa11_1,
+        "menor_calidad": menor_calidad
     }
-    edad_ordinal = edad_map.get(edad.strip(), None)
 
-    # --- Calcular IMC y estado ---
-    imc = peso / ((altura/100) ** 2)
-    if imc < 18.5:
-        estado_imc = "delgadez"
-    elif imc < 25:
-        estado_imc = "normal"
-    else:
-        estado_imc = "exceso de peso"
+    try:
+        resultado = await agrupador.enviar(usuario)
+    except ColaLlena as e:
+        metricas.incrementar("errores_total", tipo="cola_llena")
+        return HTMLResponse(str(e), status_code=503)
 
-    # --- Convertir respuestas tipo ELCSA ---
-    #sa10_1_val = 1 if sa10_1.lower() == "sí" else 0
-    #sa11_1_val = 1 if sa11_1.lower() == "sí" else 0
-    #menor_calidad_val = 1 if menor_calidad.lower() == "sí" else 0
+    with metricas.tramo("plantilla"):
+        return templates.TemplateResponse(request, "index.html", {
+            "cluster": resultado.get("cluster"),
+            "perfil": resultado.get("perfil_resumido"),
+            "recomendacion": resultado.get("recomendacion") or resultado.get("error"),
+            "usuario": usuario
+        })
 
-    sa10_1_val = int(sa10_1)
-    sa11_1_val = int(sa11_1)
-    menor_calidad_val = int(menor_calidad)
+# --- Forma pública de un resultado (sin el perfil completo) ---
+def resumir(resultado: dict) -> dict:
+    if "error" in resultado:
+        return {k: resultado[k] for k in ("error", "errores") if k in resultado}
+    if "modelos" in resultado:
+        return {"modelos": {nombre: resumir(r) for nombre, r in resultado["modelos"].items()}}
+    return {
+        "cluster": resultado.get("cluster"),
+        "recomendacion": resultado.get("recomendacion")
+    }
 
-    print(sa10_1, sa11_1)
 
-    # --- Calcular puntaje IA e inseguridad ---
-    puntaje_ia = sa10_1_val + sa11_1_val + menor_calidad_val
-    inseguridad = 1 if puntaje_ia > 0 else 0
+def nombres_modelos(modelo: str = None, modelos: str = None) -> list:
+    # ?modelo=DBSCAN elige un modelo; ?modelos=KMeans,DBSCAN los compara sobre el mismo lote
+    if modelos:
+        return [m.strip() for m in modelos.split(",") if m.strip()]
+    return [modelo] if modelo else None
 
-    usuario = {
-        "edad_ordinal": edad_ordinal,
-        "imc": imc,
-        "totalComidasDia": totalComidasDia,
-        "puntaje_ia": puntaje_ia,
-        "sexo": sexo.lower().strip(),
-        "nivel_educativo": nivel_educativo.lower().strip(),
-        "estado_imc": estado_imc,
-        "estrato": estrato.lower().strip(),
-        "inseguridad": inseguridad
-    }
 
-    resultado = recomendar(usuario)
-
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "cluster": resultado.get("cluster"),
-        "perfil": resultado.get("perfil_resumido"),
-        "recomendacion": resultado.get("recomendacion"),
-        "usuario": usuario
+def respuesta_predecir(salida: list) -> JSONResponse:
+    return JSONResponse(content={
+        "message": "Predicción realizada exitosamente.",
+        "resultados": [resumir(resultado) for resultado in salida]
     })
 
+
+def lista_usuarios(data) -> list:
+    # El cuerpo es un usuario (objeto) o un lote (lista); cualquier otro JSON es una petición inválida
+    if isinstance(data, dict):
+        return [data]
+    if not isinstance(data, list):
+        raise ValueError(f"El cuerpo debe ser un objeto JSON o una lista de objetos, no {type(data).__name__}.")
+    return data
+
+
+def predecir_lote(usuarios: list, nombres: list) -> JSONResponse:
+    # Clasificar y serializar un lote grande ocurre entero en el pool
+    return respuesta_predecir(recomendar_batch(usuarios, nombres))
+
+
+# Cuerpos mayores se decodifican fuera del event loop
+max_json_en_loop = 64 * 1024
+
+
 @app.post("/predecir")
-async def predecir(request: Request):
-    data = await request.json()
-    resultados = []
+async def predecir(request: Request, modelo: str = None, modelos: str = None):
+    cuerpo = await request.body()
+    nombres = nombres_modelos(modelo, modelos)
+    try:
+        # Un cuerpo grande se decodifica en el pool; después se sabe cuántos usuarios trae
+        data = json.loads(cuerpo) if len(cuerpo) <= max_json_en_loop else await agrupador.ejecutar(json.loads, cuerpo)
+        data = lista_usuarios(data)
+        # Un usuario suelto se agrupa con los que lleguen a la vez; un lote va directo al pool
+        if len(data) == 1:
+            return respuesta_predecir([await agrupador.enviar(data[0], nombres)])
+        return await agrupador.ejecutar(predecir_lote, data, nombres, filas=len(data))
+    except ValueError as e:
+        metricas.incrementar("errores_total", tipo="peticion_invalida")
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except ColaLlena as e:
+        metricas.incrementar("errores_total", tipo="cola_llena")
+        return JSONResponse(status_code=503, content={"error": str(e)})
 
-    for usuario in data:
-        resultado = recomendar(usuario)
-        resultados.append({
-            "cluster": resultado.get("cluster"),
-            "recomendacion": resultado.get("recomendacion")
-        })
 
-    return {
-        "message": "Predicción realizada exitosamente.",
-        "resultados": resultados
-    }
\ No newline at end of file
+# --- Clasificación masiva en streaming: NDJSON de entrada y de salida ---
+max_linea_ndjson = int(os.environ.get("MAX_LINEA_NDJSON", str(1024 * 1024)))
+
+
+async def leer_lineas(request: Request, maximo: int = max_linea_ndjson):
+    # El cuerpo se consume por fragmentos; solo se guarda la línea incompleta, hasta maximo bytes.
+    # Una línea más larga se descarta y se entrega como None: su error sale en su posición
+    pendiente = bytearray()
+    descartando = False
+    async for fragmento in request.stream():
+        # Lo ya guardado no tiene saltos de línea: la búsqueda empieza en el fragmento nuevo
+        buscar = len(pendiente)
+        pendiente += fragmento
+        inicio = 0
+        while True:
+            fin = pendiente.find(b"\n", buscar)
+            if fin < 0:
+                break
+            yield None if descartando or fin - inicio > maximo else bytes(pendiente[inicio:fin])
+            descartando = False
+            inicio = buscar = fin + 1
+        del pendiente[:inicio]
+        if len(pendiente) > maximo:
+            descartando = True
+            pendiente.clear()
+    if descartando:
+        yield None
+    elif pendiente:
+        yield bytes(pendiente)
+
+
+class RespuestaNDJSON(StreamingResponse):
+    # El generador lee el cuerpo de la petición mientras responde. StreamingResponse escucha
+    # la desconexión en paralelo con receive() y se quedaría con esos mismos mensajes;
+    # aquí la desconexión llega por request.stream() (ClientDisconnect) o al fallar el envío
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except (ClientDisconnect, OSError):
+            # El cliente se desconectó: no queda a quién responder (igual que StreamingResponse)
+            return
+        if self.background is not None:
+            await self.background()
+
+
+def procesar_lineas(lineas: list, nombres: list) -> bytes:
+    usuarios, posiciones = [], []
+    salida = [None] * len(lineas)
+    for pos, (numero, linea) in enumerate(lineas):
+        if linea is None:
+            metricas.incrementar("errores_total", tipo="linea_larga")
+            salida[pos] = {"linea": numero, "error": f"Línea mayor que {max_linea_ndjson} bytes."}
+            continue
+        try:
+            usuarios.append(json.loads(linea))
+            posiciones.append(pos)
+        except ValueError:
+            metricas.incrementar("errores_total", tipo="json_invalido")
+            salida[pos] = {"linea": numero, "error": "JSON inválido."}
+
+    try:
+        resultados = recomendar_batch(usuarios, nombres)
+    except ValueError as e:
+        resultados = [{"error": str(e)}] * len(usuarios)
+
+    for pos, resultado in zip(posiciones, resultados):
+        salida[pos] = {"linea": lineas[pos][0], **resumir(resultado)}
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in salida).encode("utf-8")
+
+
+@app.post("/predecir_ndjson")
+async def predecir_ndjson(request: Request, modelo: str = None, modelos: str = None, lote: int = 500):
+    nombres = nombres_modelos(modelo, modelos)
+    disponibles = registro.obtener().modelos
+    faltantes = [nombre for nombre in nombres or [] if nombre not in disponibles]
+    if faltantes:
+        return JSONResponse(status_code=400, content={
+            "error": f"Modelo no disponible: {faltantes[0]}. Disponibles: {', '.join(disponibles)}"})
+    lote = max(1, min(lote, 10_000))
+    # La respuesta en streaming ya no puede cambiar su código: con la cola llena se rechaza antes
+    if agrupador.saturado():
+        metricas.incrementar("errores_total", tipo="cola_llena")
+        return JSONResponse(status_code=503, content={"error": "Cola de inferencia llena."})
+
+    async def clasificar(lineas: list) -> bytes:
+        try:
+            return await agrupador.ejecutar(procesar_lineas, lineas, nombres, filas=len(lineas))
+        except ColaLlena as e:
+            # Ya empezado el stream, el micro-lote rechazado se informa línea por línea
+            metricas.incrementar("errores_total", tipo="cola_llena")
+            return "".join(json.dumps({"linea": numero, "error": str(e)}, ensure_ascii=False) + "\n"
+                           for numero, _ in lineas).encode("utf-8")
+
+    async def generar():
+        # Cada micro-lote se clasifica en el pool de inferencia y se envía antes de leer el siguiente:
+        # si el cliente no consume la respuesta, tampoco se sigue leyendo la entrada
+        lineas, numero = [], 0
+        async for linea in leer_lineas(request):
+            numero += 1
+            if linea is not None and not linea.strip():
+                continue
+            lineas.append((numero, linea))
+            if len(lineas) >= lote:
+                yield await clasificar(lineas)
+                lineas = []
+        if lineas:
+            yield await clasificar(lineas)
+
+    return RespuestaNDJSON(generar())
+
+
+@app.get("/modelos")
+async def listar_modelos():
+    artefactos, version = registro.obtener_con_version()
+    return {"principal": artefactos.modelos[0], "disponibles": artefactos.modelos, "version": version}
+
+
+@app.get("/cache_predicciones")
+async def estado_cache():
+    return cache_predicciones.estadisticas()
+
+
+@app.get("/inferencia")
+async def estado_inferencia():
+    return agrupador.estadisticas()
+
+
+# --- Métricas en formato de texto de Prometheus ---
+metricas.medidor("cola_inferencia", "Peticiones sueltas esperando lote.",
+                 lambda: agrupador.estadisticas()["profundidad_cola"])
+metricas.medidor("usuarios_en_proceso", "Usuarios en el pool o esperándolo (sueltos y de lotes).",
+                 lambda: agrupador.en_proceso)
+metricas.medidor("cache_predicciones_entradas", "Perfiles guardados en la caché de predicciones.",
+                 lambda: cache_predicciones.estadisticas()["tamano"])
+
+
+@app.get("/metrics")
+async def exportar_metricas():
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4")
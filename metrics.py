@@ -0,0 +1,148 @@
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# --- 1. Límites de los histogramas (segundos y usuarios por lote) ---
+limites_latencia = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                    2.5, 5.0, 10.0)
+limites_lote = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+prefijo = "pdgrado_"
+
+
+class Histograma:
+    def __init__(self, limites: tuple):
+        self.limites = limites
+        # Una cuenta por límite más la del +Inf; se acumulan solo al exportar
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0.0
+
+    def observar(self, valor: float) -> None:
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(etiquetas: tuple) -> str:
+    if not etiquetas:
+        return ""
+    texto = ",".join(f'{k}="{_escapar(v)}"' for k, v in etiquetas)
+    return "{" + texto + "}"
+
+
+def _numero(valor) -> str:
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+# --- 2. Registro en proceso: contadores, histogramas y medidores leídos al exportar ---
+class Metricas:
+    def __init__(self):
+        self.descripciones = {}
+        self._contadores = {}
+        self._histogramas = {}
+        self._medidores = {}
+        self._lock = threading.Lock()
+
+    def describir(self, nombre: str, tipo: str, ayuda: str, limites: tuple = None) -> None:
+        self.descripciones[nombre] = (tipo, ayuda, limites)
+
+    def incrementar(self, nombre: str, valor: float = 1, **etiquetas) -> None:
+        clave = (nombre, tuple(etiquetas.items()))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre: str, valor: float, **etiquetas) -> None:
+        clave = (nombre, tuple(etiquetas.items()))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma(self.descripciones[nombre][2] or limites_latencia)
+            histograma.observar(valor)
+
+    def medidor(self, nombre: str, ayuda: str, funcion) -> None:
+        # funcion() se llama solo cuando se consulta /metrics (profundidad de cola, tamaño de caché...)
+        self.describir(nombre, "gauge", ayuda)
+        self._medidores[nombre] = funcion
+
+    @contextmanager
+    def tramo(self, nombre: str, **etiquetas):
+        # Dos lecturas del reloj y una observación: se puede dejar activo en producción
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar("tramo_segundos", time.perf_counter() - inicio, tramo=nombre, **etiquetas)
+
+    def exportar(self) -> str:
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {clave: (list(h.cuentas), h.suma) for clave, h in self._histogramas.items()}
+
+        lineas = []
+        for nombre, (tipo, ayuda, limites) in self.descripciones.items():
+            completo = prefijo + nombre
+            lineas += [f"# HELP {completo} {ayuda}", f"# TYPE {completo} {tipo}"]
+            if tipo == "gauge" and nombre in self._medidores:
+                lineas.append(f"{completo} {_numero(self._medidores[nombre]())}")
+            elif tipo == "counter":
+                for (n, etiquetas), valor in contadores.items():
+                    if n == nombre:
+                        lineas.append(f"{completo}{_etiquetas(etiquetas)} {_numero(valor)}")
+            elif tipo == "histogram":
+                for (n, etiquetas), (cuentas, suma) in histogramas.items():
+                    if n != nombre:
+                        continue
+                    acumulado = 0
+                    for limite, cuenta in zip(tuple(limites or limites_latencia) + ("+Inf",), cuentas):
+                        acumulado += cuenta
+                        lineas.append(f"{completo}_bucket{_etiquetas(etiquetas + (('le', limite),))} {acumulado}")
+                    lineas.append(f"{completo}_sum{_etiquetas(etiquetas)} {_numero(suma)}")
+                    lineas.append(f"{completo}_count{_etiquetas(etiquetas)} {acumulado}")
+        return "\n".join(lineas) + "\n"
+
+
+metricas = Metricas()
+metricas.describir("peticiones_total", "counter", "Peticiones HTTP atendidas por ruta, método y código de estado.")
+metricas.describir("peticion_segundos", "histogram", "Duración de las peticiones HTTP por ruta.")
+metricas.describir("tramo_segundos", "histogram",
+                   "Tiempo de cada tramo de la inferencia (derivacion, cache, transformacion, prediccion, "
+                   "perfiles, plantilla).")
+metricas.describir("tamano_lote", "histogram", "Usuarios por llamada a recomendar_batch.", limites_lote)
+metricas.describir("usuarios_total", "counter", "Usuarios clasificados por modelo.")
+metricas.describir("cache_predicciones_total", "counter", "Consultas a la caché de predicciones por resultado.")
+metricas.describir("errores_total", "counter", "Errores por tipo (validación, motor, perfil, cola llena...).")
+
+
+# --- 3. Middleware ASGI: cuenta y mide cada petición sin envolver la respuesta ---
+class MiddlewareMetricas:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # La plantilla de la ruta (no la URL) evita una serie por cada dirección desconocida
+            ruta = getattr(scope.get("route"), "path", None)
+            if ruta is None:
+                ruta = "/static" if scope["path"].startswith("/static/") else "otra"
+            metricas.observar("peticion_segundos", time.perf_counter() - inicio, ruta=ruta)
+            metricas.incrementar("peticiones_total", ruta=ruta, metodo=scope["method"], estado=estado)
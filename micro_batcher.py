@@ -0,0 +1,154 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ColaLlena(Exception):
+    pass
+
+
+# --- Agrupador de peticiones: usuarios sueltos que llegan juntos se predicen en un solo lote ---
+class AgrupadorPeticiones:
+    def __init__(self, funcion, hilos: int = 2, max_lote: int = 256, espera_ms: float = 2.0,
+                 max_cola: int = 10_000):
+        # funcion(usuarios, modelos) -> lista de resultados, síncrona (se ejecuta en el pool)
+        # hilos = 0 conserva el comportamiento original: todo corre dentro del event loop
+        self.funcion = funcion
+        self.hilos = hilos
+        self.max_lote = max_lote
+        self.espera = espera_ms / 1000
+        self.max_cola = max_cola
+
+        self.peticiones = 0
+        self.lotes = 0
+        self.usuarios_en_lotes = 0
+        self.ultimo_lote = 0
+        self.lote_maximo = 0
+        # Usuarios en el pool o esperándolo, sueltos o de lotes (ejecutar); con la cola, contra max_cola
+        self.en_proceso = 0
+        self.rechazadas = 0
+        self.directos = 0
+
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="inferencia") if hilos > 0 else None
+        self._cola = None
+        self._libres = None
+        self._tarea = None
+        # Referencias a los lotes en curso: una tarea sin referencia puede ser recolectada
+        self._lotes = set()
+
+    def iniciar(self) -> None:
+        if self._tarea is not None or self._ejecutor is None:
+            return
+        self._cola = asyncio.Queue(maxsize=self.max_cola)
+        # Mientras todos los hilos están ocupados no se saca nada de la cola: los pendientes se acumulan
+        # y salen juntos en el siguiente lote
+        self._libres = asyncio.Semaphore(self.hilos)
+        self._tarea = asyncio.get_running_loop().create_task(self._recolectar())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    def saturado(self, filas: int = 1) -> bool:
+        # Se cuentan usuarios, no peticiones: un lote de 10.000 pesa lo mismo que 10.000 sueltos.
+        # Un lote mayor que max_cola solo entra con el pool vacío
+        if self._ejecutor is None:
+            return False
+        carga = (self._cola.qsize() if self._cola is not None else 0) + self.en_proceso
+        return carga > 0 and carga + filas > self.max_cola
+
+    async def ejecutar(self, funcion, *args, filas: int = 1):
+        # Trabajo que ya viene en lote (/predecir con varios usuarios, NDJSON): al pool, con el mismo
+        # límite de usuarios en curso que los sueltos
+        if self._ejecutor is None:
+            return funcion(*args)
+        if self.saturado(filas):
+            self.rechazadas += 1
+            raise ColaLlena(f"Cola de inferencia llena ({self.max_cola} usuarios en espera o en proceso).")
+        self.directos += 1
+        self.en_proceso += filas
+        try:
+            return await self._en_pool(funcion, *args)
+        finally:
+            self.directos -= 1
+            self.en_proceso -= filas
+
+    async def _en_pool(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._ejecutor, funcion, *args)
+
+    async def enviar(self, usuario, modelos: list = None):
+        if self._ejecutor is None:
+            return self.funcion([usuario], modelos)[0]
+        self.iniciar()
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            if self.saturado():
+                raise asyncio.QueueFull
+            self._cola.put_nowait((usuario, tuple(modelos) if modelos else None, futuro))
+        except asyncio.QueueFull:
+            self.rechazadas += 1
+            raise ColaLlena(f"Cola de inferencia llena ({self.max_cola} usuarios en espera o en proceso).")
+        self.peticiones += 1
+        return await futuro
+
+    async def _recolectar(self) -> None:
+        while True:
+            await self._libres.acquire()
+            pendientes = [await self._cola.get()]
+            # Con el pool libre se espera unos milisegundos a que lleguen más peticiones
+            if self._cola.empty() and self.espera > 0:
+                await asyncio.sleep(self.espera)
+            while len(pendientes) < self.max_lote and not self._cola.empty():
+                pendientes.append(self._cola.get_nowait())
+            tarea = asyncio.get_running_loop().create_task(self._procesar(pendientes))
+            self._lotes.add(tarea)
+            tarea.add_done_callback(self._lotes.discard)
+
+    async def _procesar(self, pendientes: list) -> None:
+        self.en_proceso += len(pendientes)
+        self.lotes += 1
+        self.usuarios_en_lotes += len(pendientes)
+        self.ultimo_lote = len(pendientes)
+        self.lote_maximo = max(self.lote_maximo, len(pendientes))
+        try:
+            # Una llamada por combinación de modelos pedida
+            grupos = {}
+            for usuario, modelos, futuro in pendientes:
+                grupos.setdefault(modelos, []).append((usuario, futuro))
+            for modelos, grupo in grupos.items():
+                try:
+                    # Ya admitidos en la cola: no vuelven a pasar por el límite
+                    resultados = await self._en_pool(self.funcion, [u for u, _ in grupo],
+                                                     list(modelos) if modelos else None)
+                except Exception as e:
+                    for _, futuro in grupo:
+                        if not futuro.done():
+                            futuro.set_exception(e)
+                    continue
+                for (_, futuro), resultado in zip(grupo, resultados):
+                    if not futuro.done():
+                        futuro.set_result(resultado)
+        finally:
+            self.en_proceso -= len(pendientes)
+            self._libres.release()
+
+    def estadisticas(self) -> dict:
+        return {
+            "hilos": self.hilos,
+            "profundidad_cola": self._cola.qsize() if self._cola is not None else 0,
+            "en_proceso": self.en_proceso,
+            "peticiones": self.peticiones,
+            "rechazadas": self.rechazadas,
+            "directos": self.directos,
+            "lotes": self.lotes,
+            "tamano_medio_lote": round(self.usuarios_en_lotes / self.lotes, 2) if self.lotes else 0.0,
+            "ultimo_lote": self.ultimo_lote,
+            "lote_maximo": self.lote_maximo,
+            "max_lote": self.max_lote,
+            "espera_ms": self.espera * 1000
+        }
@@ -1,145 +1,305 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import matplotlib
+matplotlib.use("Agg")
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import joblib
-import os
 
-from sklearn.metrics import silhouette_samples
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.impute import SimpleImputer
+from threadpoolctl import threadpool_limits
+
+from data_cleaning import leer_df_cluster
+from evaluation import config_por_defecto, silhouette_muestras
+from model_builder import datos_modelo
+from sweep import curva_codo
 
-# --- 1. Cargar métricas y preprocesador ---
-results_df = pd.read_parquet("data/outputs/clustering_comparison.parquet")
-preprocessor = joblib.load("models/preprocessor.pkl")
+# --- Configuración de Silhouette (MODO_METRICAS=auto|exacto|muestreo) ---
+config_metricas = {
+    **config_por_defecto,
+    "modo": os.environ.get("MODO_METRICAS", config_por_defecto["modo"]),
+    "tamano_muestra": int(os.environ.get("MUESTRA_METRICAS", config_por_defecto["tamano_muestra"]))
+}
 
-# --- 2. Definir columnas numéricas ---
+# --- Columnas numéricas ---
 numeric_cols = ['edad_ordinal', 'imc', 'totalComidasDia', 'puntaje_ia']
 
-# --- 3. Analizar todos los modelos ---
-for modelo in results_df['Modelo']:
-    print(f"\n Analizando modelo: {modelo}")
-    path_parquet = f"data/outputs/df_cluster_{modelo}.parquet"
+# --- Manifiesto: hash de las entradas con que se generó cada gráfico en la corrida anterior ---
+ruta_manifiesto = "data/outputs/analisis_manifest.json"
+# Cambiar el dibujo de un gráfico obliga a regenerarlo aunque los datos sean los mismos
+version_graficos = 1
+ks_codo = list(range(2, 11))
+
+
+def hash_archivo(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def clave_grafico(contenido: dict) -> str:
+    return hashlib.sha256(json.dumps({**contenido, 'version': version_graficos},
+                                     sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+
+def leer_manifiesto(ruta: str = ruta_manifiesto) -> dict:
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta) as f:
+        return json.load(f)
 
-    if not os.path.exists(path_parquet):
-        print(f" Archivo no encontrado: {path_parquet}")
-        continue
 
-    df = pd.read_parquet(path_parquet)
-    df[numeric_cols + ['cluster']] = df[numeric_cols + ['cluster']].apply(pd.to_numeric, errors='coerce')
-    df[numeric_cols + ['cluster']] = df[numeric_cols + ['cluster']].fillna(df[numeric_cols + ['cluster']].mean())
+def guardar_manifiesto(manifiesto: dict, ruta: str = ruta_manifiesto) -> None:
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifiesto, f, indent=2, sort_keys=True)
+    os.replace(tmp, ruta)
 
-    # --- A. Elbow (solo para KMeans y MiniBatchKMeans) ---
+
+# --- 1. Gráficos que produce cada modelo y de qué entradas dependen ---
+def graficos_modelo(modelo: str, hash_parquet: str, hash_preprocesador: str) -> dict:
+    graficos = {}
     if modelo in ["KMeans", "MiniBatchKMeans"]:
-        imputer = SimpleImputer(strategy="mean")
-        X_imputed = imputer.fit_transform(df[numeric_cols])
-        X_scaled = StandardScaler().fit_transform(X_imputed)
-
-        sse = []
-        for k in range(2, 11):
-            km = KMeans(n_clusters=k, random_state=42)
-            km.fit(X_scaled)
-            sse.append(km.inertia_)
-
-        plt.figure(figsize=(6,4))
-        plt.plot(range(2,11), sse, marker='o')
-        plt.title(f"Elbow Method — {modelo}")
-        plt.xlabel("Número de Clusters")
-        plt.ylabel("SSE")
-        plt.grid()
-        plt.tight_layout()
-        plt.savefig(f"data/outputs/elbow_method_{modelo}.png")
-        plt.close()
-
-    # --- B. Silhouette Plot ---
-    try:
-        imputer = SimpleImputer(strategy="mean")
-        X_imputed = imputer.fit_transform(df[numeric_cols])
-        X_scaled = StandardScaler().fit_transform(X_imputed)
-
-        sil_vals = silhouette_samples(X_scaled, df['cluster'])
-        df['silhouette'] = sil_vals
-
-        plt.figure(figsize=(8,5))
-        y_lower = 10
-        k = df['cluster'].nunique()
-        for i in range(k):
-            ith = sil_vals[df['cluster'] == i]
-            ith.sort()
-            size = len(ith)
-            y_upper = y_lower + size
-            color = plt.cm.nipy_spectral(float(i) / k)
-            plt.fill_betweenx(np.arange(y_lower, y_upper), 0, ith, facecolor=color, alpha=0.7)
-            plt.text(-0.05, y_lower + 0.5 * size, str(i))
-            y_lower = y_upper + 10
-        plt.axvline(np.mean(sil_vals), color="red", linestyle="--")
-        plt.xlabel("Coef. Silhouette")
-        plt.ylabel("Cluster")
-        plt.title(f"Silhouette — {modelo}")
-        plt.grid(True)
-        plt.tight_layout()
-        plt.savefig(f"data/outputs/silhouette_plot_{modelo}.png")
-        plt.close()
-    except Exception as e:
-        print(f" No se pudo graficar Silhouette para {modelo}: {e}")
+        # El codo se calcula sobre la matriz del preprocesador
+        graficos['codo'] = ([f"data/outputs/elbow_method_{modelo}.png"],
+                            clave_grafico({'tipo': 'codo', 'datos': hash_parquet,
+                                           'preprocesador': hash_preprocesador, 'ks': ks_codo}))
+    graficos['silhouette'] = ([f"data/outputs/silhouette_plot_{modelo}.png"],
+                              clave_grafico({'tipo': 'silhouette', 'datos': hash_parquet,
+                                             'metricas': config_metricas}))
+    graficos['pca'] = ([f"data/outputs/pca_2d_{modelo}.png", f"data/outputs/pca_3d_{modelo}.png"],
+                       clave_grafico({'tipo': 'pca', 'datos': hash_parquet}))
+    graficos['heatmap'] = ([f"data/outputs/heatmap_correlaciones_{modelo}.png"],
+                           clave_grafico({'tipo': 'heatmap', 'datos': hash_parquet}))
+    return graficos
+
+
+def vigente(manifiesto: dict, archivos: list, clave: str) -> bool:
+    return all(manifiesto.get(a) == clave and os.path.exists(a) for a in archivos)
+
+
+# --- 2. Matrices compartidas: se calculan una vez por modelo y los procesos las abren como memmap ---
+def matrices_modelo(modelo: str, path_parquet: str, preprocessor, pendientes: set, directorio: str) -> dict:
+    # Esquema compacto: las columnas numéricas ya llegan tipadas desde model_builder
+    df = leer_df_cluster(path_parquet)
+    matrices = {}
+
+    def guardar(nombre, matriz):
+        # Se pasa la ruta del .npy, no el arreglo: los procesos no reciben copias serializadas
+        matrices[nombre] = os.path.join(directorio, f"{modelo}_{nombre}.npy")
+        np.save(matrices[nombre], np.ascontiguousarray(matriz))
+
+    guardar('clusters', df['cluster'].to_numpy())
+    if 'codo' in pendientes:
+        # Misma matriz que en model_builder: el codo sale de la caché del barrido
+        guardar('X_modelo', preprocessor.transform(datos_modelo(df)))
+    if pendientes & {'silhouette', 'pca'}:
+        X_imputed = SimpleImputer(strategy="mean").fit_transform(df[numeric_cols])
+        guardar('X_scaled', StandardScaler().fit_transform(X_imputed))
+    if 'heatmap' in pendientes:
+        df[numeric_cols] = df[numeric_cols].fillna(df[numeric_cols].mean())
+        matrices['correlaciones'] = df[numeric_cols + ['cluster']].corr()
+    return matrices
+
+
+# --- 3. Cada gráfico se dibuja en un proceso del pool (backend Agg, sin pantalla) ---
+def grafico_codo(modelo, matrices, archivos) -> str:
+    codo = curva_codo(np.load(matrices['X_modelo'], mmap_mode='r'), modelo, ks_codo)
+    plt.figure(figsize=(6,4))
+    plt.plot(codo['k'], codo['inercia'], marker='o')
+    plt.title(f"Elbow Method — {modelo}")
+    plt.xlabel("Número de Clusters")
+    plt.ylabel("SSE")
+    plt.grid()
+    plt.tight_layout()
+    plt.savefig(archivos[0])
+    plt.close()
+    return f"Elbow: {int(codo['desde_cache'].sum())}/{len(codo)} valores de k desde caché"
 
-    # --- C. PCA 2D y 3D ---
+
+def grafico_silhouette(modelo, matrices, archivos) -> str:
+    clusters = np.load(matrices['clusters'])
+    # Exacto por bloques o muestra estratificada por cluster, según config_metricas
+    idx_sil, sil_vals, modo_sil = silhouette_muestras(np.load(matrices['X_scaled'], mmap_mode='r'), clusters,
+                                                      config_metricas)
+    clusters_sil = clusters[idx_sil]
+
+    plt.figure(figsize=(8,5))
+    y_lower = 10
+    k = len(np.unique(clusters))
+    for i in range(k):
+        ith = sil_vals[clusters_sil == i]
+        ith.sort()
+        size = len(ith)
+        y_upper = y_lower + size
+        color = plt.cm.nipy_spectral(float(i) / k)
+        plt.fill_betweenx(np.arange(y_lower, y_upper), 0, ith, facecolor=color, alpha=0.7)
+        plt.text(-0.05, y_lower + 0.5 * size, str(i))
+        y_lower = y_upper + 10
+    plt.axvline(np.mean(sil_vals), color="red", linestyle="--")
+    plt.xlabel("Coef. Silhouette")
+    plt.ylabel("Cluster")
+    plt.title(f"Silhouette — {modelo} ({modo_sil}, n={len(idx_sil)})")
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(archivos[0])
+    plt.close()
+    return f"Silhouette por muestra ({modo_sil}, n={len(idx_sil)}): {np.mean(sil_vals):.4f}"
+
+
+def grafico_pca(modelo, matrices, archivos) -> str:
+    clusters = np.load(matrices['clusters'])
+    X_pca = PCA(n_components=3).fit_transform(np.load(matrices['X_scaled'], mmap_mode='r'))
+
+    # 2D
+    plt.figure(figsize=(6,5))
+    plt.scatter(X_pca[:,0], X_pca[:,1], c=clusters, cmap='tab10', alpha=0.6)
+    plt.title(f"PCA 2D — {modelo}")
+    plt.xlabel("PCA 1")
+    plt.ylabel("PCA 2")
+    plt.tight_layout()
+    plt.savefig(archivos[0])
+    plt.close()
+
+    # 3D
+    fig = plt.figure(figsize=(8,6))
+    ax = fig.add_subplot(111, projection='3d')
+    ax.scatter(X_pca[:,0], X_pca[:,1], X_pca[:,2], c=clusters, cmap='tab10', alpha=0.6)
+    ax.set_xlabel("PCA 1")
+    ax.set_ylabel("PCA 2")
+    ax.set_zlabel("PCA 3")
+    plt.title(f"PCA 3D — {modelo}")
+    plt.tight_layout()
+    plt.savefig(archivos[1])
+    plt.close()
+    return "PCA 2D y 3D generados"
+
+
+def grafico_heatmap(modelo, matrices, archivos) -> str:
+    plt.figure(figsize=(6,5))
+    sns.heatmap(matrices['correlaciones'], annot=True, cmap='coolwarm', fmt=".2f")
+    plt.title(f"Mapa de Correlaciones — {modelo}")
+    plt.tight_layout()
+    plt.savefig(archivos[0])
+    plt.close()
+    return "Mapa de correlaciones generado"
+
+
+funciones_grafico = {
+    'codo': grafico_codo,
+    'silhouette': grafico_silhouette,
+    'pca': grafico_pca,
+    'heatmap': grafico_heatmap
+}
+
+
+def _dibujar(tipo: str, modelo: str, matrices: dict, archivos: list, hilos) -> tuple:
     try:
-        pca = PCA(n_components=3)
-        X_pca = pca.fit_transform(X_scaled)
-
-        # 2D
-        plt.figure(figsize=(6,5))
-        plt.scatter(X_pca[:,0], X_pca[:,1], c=df['cluster'], cmap='tab10', alpha=0.6)
-        plt.title(f"PCA 2D — {modelo}")
-        plt.xlabel("PCA 1")
-        plt.ylabel("PCA 2")
-        plt.tight_layout()
-        plt.savefig(f"data/outputs/pca_2d_{modelo}.png")
-        plt.close()
-
-        # 3D
-        from mpl_toolkits.mplot3d import Axes3D
-        fig = plt.figure(figsize=(8,6))
-        ax = fig.add_subplot(111, projection='3d')
-        ax.scatter(X_pca[:,0], X_pca[:,1], X_pca[:,2], c=df['cluster'], cmap='tab10', alpha=0.6)
-        ax.set_xlabel("PCA 1")
-        ax.set_ylabel("PCA 2")
-        ax.set_zlabel("PCA 3")
-        plt.title(f"PCA 3D — {modelo}")
-        plt.tight_layout()
-        plt.savefig(f"data/outputs/pca_3d_{modelo}.png")
-        plt.close()
+        with threadpool_limits(limits=hilos):
+            return True, funciones_grafico[tipo](modelo, matrices, archivos)
     except Exception as e:
-        print(f" Error en PCA para {modelo}: {e}")
+        plt.close("all")
+        return False, f"No se pudo graficar {tipo} para {modelo}: {e}"
+
+
+# --- 4. Analizar todos los modelos ---
+def analizar(workers: int, forzar: bool = False) -> None:
+    results_df = pd.read_parquet("data/outputs/clustering_comparison.parquet")
+    preprocessor = joblib.load("models/preprocessor.pkl")
+    hash_preprocesador = hash_archivo("models/preprocessor.pkl")
+    manifiesto = {} if forzar else leer_manifiesto()
 
-    # --- D. Heatmap de correlación ---
+    directorio = tempfile.mkdtemp(prefix="analisis_")
+    tareas = []
     try:
-        corr = df[numeric_cols + ['cluster']].corr()
-        plt.figure(figsize=(6,5))
-        sns.heatmap(corr, annot=True, cmap='coolwarm', fmt=".2f")
-        plt.title(f"Mapa de Correlaciones — {modelo}")
-        plt.tight_layout()
-        plt.savefig(f"data/outputs/heatmap_correlaciones_{modelo}.png")
-        plt.close()
-    except Exception as e:
-        print(f" No se pudo graficar heatmap para {modelo}: {e}")
+        for modelo in results_df['Modelo']:
+            print(f"\n Analizando modelo: {modelo}")
+            path_parquet = f"data/outputs/df_cluster_{modelo}.parquet"
+
+            if not os.path.exists(path_parquet):
+                print(f" Archivo no encontrado: {path_parquet}")
+                continue
+
+            graficos = graficos_modelo(modelo, hash_archivo(path_parquet), hash_preprocesador)
+            pendientes = {tipo for tipo, (archivos, clave) in graficos.items()
+                          if not vigente(manifiesto, archivos, clave)}
+            omitidos = sorted(set(graficos) - pendientes)
+            if omitidos:
+                print(f" Sin cambios en las entradas, se conservan: {', '.join(omitidos)}")
+            if not pendientes:
+                continue
+
+            matrices = matrices_modelo(modelo, path_parquet, preprocessor, pendientes, directorio)
+            tareas += [(tipo, modelo, matrices, *graficos[tipo]) for tipo in graficos if tipo in pendientes]
+
+        # Reparte los núcleos entre procesos para no sobresuscribir BLAS/OpenMP
+        hilos = max(1, (os.cpu_count() or 1) // max(1, workers))
+        resultados = {}
+        if workers <= 1 or len(tareas) <= 1:
+            for i, (tipo, modelo, matrices, archivos, _) in enumerate(tareas):
+                resultados[i] = _dibujar(tipo, modelo, matrices, archivos, None)
+        elif tareas:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tareas))) as pool:
+                futuros = {pool.submit(_dibujar, tipo, modelo, matrices, archivos, hilos): i
+                           for i, (tipo, modelo, matrices, archivos, _) in enumerate(tareas)}
+                for futuro in as_completed(futuros):
+                    resultados[futuros[futuro]] = futuro.result()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if tareas:
+        print()
+    for i, (tipo, modelo, matrices, archivos, clave) in enumerate(tareas):
+        correcto, mensaje = resultados[i]
+        print(f" {modelo}: {mensaje}")
+        # Un gráfico que falló no entra al manifiesto y se reintenta en la siguiente corrida
+        for archivo in archivos:
+            if correcto:
+                manifiesto[archivo] = clave
+            else:
+                manifiesto.pop(archivo, None)
+    guardar_manifiesto(manifiesto)
+    print(f"\n Gráficos: {len(tareas)} generados en {workers} procesos; manifiesto en {ruta_manifiesto}")
+
+    # --- 5. Selección automática del mejor modelo ---
+    filtered = results_df[(results_df['n_clusters'] >= 2) & (results_df['n_clusters'] <= 10)].dropna(subset=['Silhouette'])
+
+    if filtered.empty:
+        print("\n No se encontraron modelos con 2–10 clusters válidos.")
+    else:
+        ranked = filtered.sort_values(by="Silhouette", ascending=False)
+        print("\n Ranking de modelos (clusters entre 2–10):")
+        columnas = [c for c in ['Modelo', 'Silhouette', 'Silhouette_IC_inf', 'Silhouette_IC_sup',
+                                'Modo_metricas', 'n_muestra', 'n_clusters'] if c in ranked.columns]
+        print(ranked[columnas].to_string(index=False))
 
-# --- 4. Selección automática del mejor modelo ---
-filtered = results_df[(results_df['n_clusters'] >= 2) & (results_df['n_clusters'] <= 10)].dropna()
+        best_model = ranked.iloc[0]
+        print(f"\n Modelo recomendado: {best_model['Modelo']} "
+              f"(Silhouette={best_model['Silhouette']:.4f}, "
+              f"Clusters={int(best_model['n_clusters'])})")
 
-if filtered.empty:
-    print("\n No se encontraron modelos con 2–10 clusters válidos.")
-else:
-    ranked = filtered.sort_values(by="Silhouette", ascending=False)
-    print("\n Ranking de modelos (clusters entre 2–10):")
-    print(ranked[['Modelo', 'Silhouette', 'n_clusters']].to_string(index=False))
+    print("\n Análisis gráfico y selección completados.")
 
-    best_model = ranked.iloc[0]
-    print(f"\n Modelo recomendado: {best_model['Modelo']} "
-          f"(Silhouette={best_model['Silhouette']:.4f}, "
-          f"Clusters={int(best_model['n_clusters'])})")
 
-print("\n Análisis gráfico y selección completados.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gráficos de análisis por modelo y selección del mejor")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("MODEL_ANALISIS_WORKERS", os.cpu_count() or 1)),
+                        help="Procesos que dibujan en paralelo (1 = secuencial)")
+    parser.add_argument("--forzar", action="store_true",
+                        help="Regenera todos los gráficos aunque el manifiesto indique que no cambiaron")
+    args = parser.parse_args()
+    analizar(args.workers, args.forzar)
@@ -0,0 +1,177 @@
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+
+from kernel_builder import compilar_preprocesador, compilar_tabla
+
+# --- 1. Formato en disco: models/<nombre>/manifest.json + un .npy por arreglo ---
+# El manifiesto se escribe al final y de forma atómica: quien lo lee nunca ve un artefacto a medias.
+# Los .npy se nombran por su contenido, así que un artefacto nuevo no pisa los archivos mapeados
+# por un proceso que aún sirve la versión anterior.
+formato_artefactos = 1
+base_modelos = "models"
+nombre_preprocesador = "preprocessor"
+
+
+class ArtefactoIncompatible(ValueError):
+    pass
+
+
+def carpeta_artefacto(nombre: str, base: str = base_modelos) -> str:
+    return os.path.join(base, nombre)
+
+
+def ruta_manifiesto(nombre: str, base: str = base_modelos) -> str:
+    return os.path.join(carpeta_artefacto(nombre, base), "manifest.json")
+
+
+def hash_archivo(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def huella_arreglos(arreglos: dict) -> str:
+    # Identidad del contenido (no de los archivos): igual si se compiló del .pkl o se leyó del disco
+    h = hashlib.sha256()
+    for clave in sorted(arreglos):
+        arreglo = np.ascontiguousarray(arreglos[clave])
+        h.update(f"{clave}|{arreglo.dtype.str}|{arreglo.shape}|".encode())
+        h.update(arreglo.tobytes())
+    return h.hexdigest()
+
+
+# --- 2. Escritura ---
+def guardar_arreglos(nombre: str, tipo: str, arreglos: dict, metadatos: dict = None,
+                     base: str = base_modelos) -> str:
+    carpeta = carpeta_artefacto(nombre, base)
+    os.makedirs(carpeta, exist_ok=True)
+
+    entradas = {}
+    for clave, arreglo in arreglos.items():
+        arreglo = np.ascontiguousarray(arreglo)
+        if arreglo.dtype.hasobject:
+            raise TypeError(f"El arreglo {clave} de {nombre} no se puede mapear (dtype object).")
+        tmp = os.path.join(carpeta, f".{clave}.{os.getpid()}.tmp.npy")
+        np.save(tmp, arreglo, allow_pickle=False)
+        sha = hash_archivo(tmp)
+        archivo = f"{clave}-{sha[:16]}.npy"
+        os.replace(tmp, os.path.join(carpeta, archivo))
+        entradas[clave] = {"archivo": archivo, "dtype": arreglo.dtype.str, "forma": list(arreglo.shape),
+                           "sha256": sha}
+
+    manifiesto = {
+        "formato": formato_artefactos,
+        "nombre": nombre,
+        "tipo": tipo,
+        "creado": datetime.datetime.now().isoformat(timespec="seconds"),
+        "numpy": np.__version__,
+        **(metadatos or {}),
+        "huella": huella_arreglos(arreglos),
+        "arreglos": entradas
+    }
+    ruta = ruta_manifiesto(nombre, base)
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, ruta)
+
+    # Los .npy de versiones anteriores ya no están en el manifiesto
+    vigentes = {e["archivo"] for e in entradas.values()}
+    for archivo in os.listdir(carpeta):
+        if archivo.endswith(".npy") and archivo not in vigentes and not archivo.startswith("."):
+            try:
+                os.remove(os.path.join(carpeta, archivo))
+            except OSError:
+                pass
+    return ruta
+
+
+# --- 3. Lectura: mapeo en memoria, con verificación de formato, forma, dtype y checksum ---
+def leer_manifiesto(nombre: str, base: str = base_modelos) -> dict:
+    with open(ruta_manifiesto(nombre, base), encoding="utf-8") as f:
+        manifiesto = json.load(f)
+    if manifiesto.get("formato") != formato_artefactos:
+        raise ArtefactoIncompatible(f"{nombre}: formato {manifiesto.get('formato')} no soportado "
+                                    f"(se espera {formato_artefactos}).")
+    return manifiesto
+
+
+def cargar_arreglos(nombre: str, base: str = base_modelos, verificar: bool = True) -> tuple:
+    manifiesto = leer_manifiesto(nombre, base)
+    carpeta = carpeta_artefacto(nombre, base)
+    arreglos = {}
+    for clave, entrada in manifiesto["arreglos"].items():
+        ruta = os.path.join(carpeta, entrada["archivo"])
+        if verificar and hash_archivo(ruta) != entrada["sha256"]:
+            raise ArtefactoIncompatible(f"{nombre}: checksum inválido en {entrada['archivo']}.")
+        # Las páginas se leen del disco al usarse y las comparten todos los procesos que sirven
+        arreglo = np.load(ruta, mmap_mode="r", allow_pickle=False)
+        if arreglo.dtype.str != entrada["dtype"] or list(arreglo.shape) != entrada["forma"]:
+            raise ArtefactoIncompatible(f"{nombre}: {clave} no coincide con el manifiesto "
+                                        f"({arreglo.dtype.str} {list(arreglo.shape)}).")
+        arreglos[clave] = arreglo
+    return manifiesto, arreglos
+
+
+def artefacto_vigente(nombre: str, origenes: list, base: str = base_modelos) -> bool:
+    # Mismo criterio que el motor .npz: solo vale si es más reciente que los .pkl de origen
+    ruta = ruta_manifiesto(nombre, base)
+    if not os.path.exists(ruta):
+        return False
+    origen = max([os.path.getmtime(r) for r in origenes if os.path.exists(r)], default=0)
+    return os.path.getmtime(ruta) >= origen
+
+
+# --- 4. Exportar modelos ajustados (solo atributos; no hace falta sklearn para leerlos) ---
+def arreglos_modelo(model) -> tuple:
+    if hasattr(model, "cluster_centers_"):
+        return "centroides", {"centroides": np.asarray(model.cluster_centers_, dtype=np.float64)}, {}
+    if hasattr(model, "precisions_cholesky_"):
+        arreglos = {
+            "medias": np.asarray(model.means_, dtype=np.float64),
+            "covarianzas": np.asarray(model.covariances_, dtype=np.float64),
+            "precisiones_cholesky": np.asarray(model.precisions_cholesky_, dtype=np.float64),
+            "pesos": np.asarray(model.weights_, dtype=np.float64)
+        }
+        return "gaussianas", arreglos, {"covarianza": model.covariance_type}
+    if hasattr(model, "core_sample_indices_"):
+        metrica = model.metric
+        if metrica == "minkowski" and model.p in (None, 2):
+            metrica = "euclidean"
+        arreglos = {
+            "nucleos": np.asarray(model.components_, dtype=np.float64),
+            "etiquetas": np.asarray(model.labels_, dtype=np.int64)[model.core_sample_indices_]
+        }
+        return "dbscan", arreglos, {"eps": float(model.eps), "metrica": metrica}
+    raise ArtefactoIncompatible(f"{type(model).__name__} no tiene exportación a arreglos.")
+
+
+def _parametros(model) -> dict:
+    return {k: v for k, v in model.get_params().items() if isinstance(v, (int, float, str, bool, type(None)))}
+
+
+def exportar_preprocesador(preprocessor, base: str = base_modelos) -> str:
+    return guardar_arreglos(nombre_preprocesador, "preprocesador", compilar_preprocesador(preprocessor), base=base)
+
+
+def exportar_modelo(nombre: str, model, preprocessor, base: str = base_modelos) -> str:
+    import sklearn
+
+    preprocesador = compilar_preprocesador(preprocessor)
+    tipo, arreglos, metadatos = arreglos_modelo(model)
+    if tipo == "centroides":
+        # La tabla de decisión del motor viaja con el modelo: el servicio no la recompila al arrancar
+        arreglos.update(compilar_tabla({**preprocesador, **arreglos}))
+    metadatos.update({
+        "modelo": type(model).__name__,
+        "sklearn": sklearn.__version__,
+        "parametros": _parametros(model),
+        "n_features": int(next(iter(arreglos.values())).shape[-1]),
+        "preprocesador": huella_arreglos(preprocesador)
+    })
+    return guardar_arreglos(nombre, tipo, arreglos, metadatos, base)
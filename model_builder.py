@@ -1,105 +1,177 @@
-import pandas as pd
-import numpy as np
+import argparse
 import os
 import joblib
+import numpy as np
+import pandas as pd
 
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 
-from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
-from sklearn.mixture import GaussianMixture
+from data_cleaning import leer_df_cluster
+from evaluation import config_por_defecto, modos
+from model_artifacts import ArtefactoIncompatible, cargar_arreglos, exportar_modelo, exportar_preprocesador
+from recommender import asignador_arreglos, construir_perfiles, guardar_perfiles
+from sweep import ajustar_seleccion, cargar_resultado, ejecutar_barrido, grillas_por_defecto, ruta_cache
 
-from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bouldin_score
-
-# --- 1. Cargar datos preprocesados desde parquet ---
-df = pd.read_parquet("data/outputs/df_cluster.parquet")
-
-# --- 2. Mapear edad ordinal ---
+# --- Mapeo de edad ordinal ---
 edad_map = {
     '18 – 26 años': 1,
     '27 - 49 años': 2,
     '50 – 64 años': 3
 }
-df['edad_ordinal'] = df['edad'].map(edad_map)
 
-# --- 3. Definir columnas ---
+# --- Columnas del modelo ---
 numeric_cols = ['edad_ordinal', 'imc', 'totalComidasDia', 'puntaje_ia']
 categorical_cols = ['sexo', 'nivel_educativo', 'estado_imc', 'estrato', 'inseguridad']
 
-df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
-df[categorical_cols] = df[categorical_cols].astype(str)
-
-# --- 4. Preprocesamiento ---
-preprocessor = ColumnTransformer([
-    ('num', Pipeline([
-        ('imp', SimpleImputer(strategy='mean')),
-        ('scale', StandardScaler())
-    ]), numeric_cols),
-    ('cat', Pipeline([
-        ('imp', SimpleImputer(strategy='most_frequent')),
-        ('enc', OneHotEncoder(handle_unknown='ignore', sparse_output=False))
-    ]), categorical_cols)
-])
-
-X = preprocessor.fit_transform(df)
-
-# --- 5. Definir modelos ---
-models = {
-    'KMeans': KMeans(n_clusters=4, random_state=42),
-    'MiniBatchKMeans': MiniBatchKMeans(n_clusters=4, random_state=42),
-    'DBSCAN': DBSCAN(eps=0.5, min_samples=5),
-    'GaussianMixture': GaussianMixture(n_components=4, random_state=42)
-}
-
-results = []
-os.makedirs("models", exist_ok=True)
-os.makedirs("data/outputs", exist_ok=True)
-
-# --- 6. Entrenar y evaluar modelos ---
-for name, model in models.items():
-    print(f"\n Evaluando modelo: {name}")
-    try:
-        if name == "GaussianMixture":
-            clusters = model.fit_predict(X)
-        else:
-            model.fit(X)
-            clusters = model.labels_
-
-        valid_mask = clusters != -1
-        if np.sum(valid_mask) < 2:
+# --- Modelos a entrenar: parámetros por defecto (configurables desde la línea de comandos) ---
+def seleccion_modelos(k: int = 4, eps: float = 0.5, min_samples: int = 5) -> dict:
+    return {
+        'KMeans': {'n_clusters': k, 'random_state': 42},
+        'MiniBatchKMeans': {'n_clusters': k, 'random_state': 42},
+        'DBSCAN': {'eps': eps, 'min_samples': min_samples},
+        'GaussianMixture': {'n_components': k, 'random_state': 42}
+    }
+
+
+modelos = seleccion_modelos()
+
+
+# --- Escrituras atómicas: quien lea las salidas (pipeline.py, el servicio) nunca ve un archivo a medias ---
+def guardar_pkl(objeto, ruta: str) -> None:
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    joblib.dump(objeto, tmp)
+    os.replace(tmp, ruta)
+
+
+def guardar_parquet(df: pd.DataFrame, ruta: str) -> None:
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, ruta)
+
+
+# --- Artefacto mapeable: el asignador leído del disco debe predecir lo mismo que el modelo ---
+def exportar_verificado(nombre: str, modelo, preprocessor, X, muestra: int = 20000) -> str:
+    ruta = exportar_modelo(nombre, modelo, preprocessor)
+    if hasattr(modelo, "predict"):
+        manifiesto, arreglos = cargar_arreglos(nombre)
+        filas = X[:muestra]
+        asignados = asignador_arreglos(manifiesto['tipo'], arreglos, manifiesto).predecir_matriz(filas)
+        if not np.array_equal(asignados, modelo.predict(filas)):
+            raise ArtefactoIncompatible(f"El artefacto de {nombre} no reproduce las predicciones del modelo.")
+    return ruta
+
+
+# --- 1. Cargar datos preprocesados desde parquet (esquema compacto) ---
+def cargar_datos(ruta: str = "data/outputs/df_cluster.parquet") -> tuple:
+    df = leer_df_cluster(ruta)
+    df['edad_ordinal'] = df['edad'].map(edad_map).astype(float)
+    return df, datos_modelo(df)
+
+
+def datos_modelo(df: pd.DataFrame) -> pd.DataFrame:
+    # El preprocesador se ajusta con las categorías como texto; df conserva los tipos compactos
+    return df[numeric_cols + categorical_cols].astype({col: str for col in categorical_cols})
+
+
+# --- 2. Preprocesamiento ---
+def construir_preprocesador() -> ColumnTransformer:
+    return ColumnTransformer([
+        ('num', Pipeline([
+            ('imp', SimpleImputer(strategy='mean')),
+            ('scale', StandardScaler())
+        ]), numeric_cols),
+        ('cat', Pipeline([
+            ('imp', SimpleImputer(strategy='most_frequent')),
+            ('enc', OneHotEncoder(handle_unknown='ignore', sparse_output=False))
+        ]), categorical_cols)
+    ])
+
+
+# --- 3. Entrenar (o leer desde la caché del barrido) y guardar cada modelo ---
+def main(workers: int, config_metricas: dict = None, seleccion: dict = None, barrido: bool = False,
+         directorio_cache: str = ruta_cache) -> None:
+    os.makedirs("models", exist_ok=True)
+    os.makedirs("data/outputs", exist_ok=True)
+    seleccion = seleccion or modelos
+
+    df, df_modelo = cargar_datos()
+    preprocessor = construir_preprocesador()
+    X = preprocessor.fit_transform(df_modelo)
+
+    # --- 4. Guardar preprocesador; va antes que los modelos, cuyos manifiestos guardan su huella ---
+    guardar_pkl(preprocessor, "models/preprocessor.pkl")
+    print(" Preprocesador guardado en: models/preprocessor.pkl")
+    print(f" Preprocesador mapeable en: {exportar_preprocesador(preprocessor)}")
+
+    # --- 5. Barrido de hiperparámetros (opcional); reutiliza la caché en cada corrida ---
+    if barrido:
+        tabla = ejecutar_barrido(X, grillas_por_defecto, workers, config_metricas, directorio_cache)
+        guardar_parquet(tabla, "data/outputs/sweep_results.parquet")
+        print(f"\n Barrido: {len(tabla)} configuraciones ({int(tabla['desde_cache'].sum())} desde caché)")
+        print(" Resultados del barrido guardados en sweep_results.parquet")
+
+    # --- 6. Guardar etiquetas y perfiles de cada modelo ---
+    results = []
+    for resultado in ajustar_seleccion(X, seleccion, workers, config_metricas, directorio_cache):
+        name = resultado['Modelo']
+        if 'error' in resultado:
+            print(f" {resultado['error']}")
+            continue
+        if resultado['n_clusters'] < 1 or 'Silhouette' not in resultado:
             print(f" {name} no generó clusters válidos.")
             continue
 
-        sil = silhouette_score(X[valid_mask], clusters[valid_mask])
-        ch = calinski_harabasz_score(X[valid_mask], clusters[valid_mask])
-        db = davies_bouldin_score(X[valid_mask], clusters[valid_mask])
-
-        results.append({
-            'Modelo': name,
-            'Silhouette': sil,
-            'Calinski-Harabasz': ch,
-            'Davies-Bouldin': db,
-            'n_clusters': len(set(clusters)) - (1 if -1 in clusters else 0)
-        })
-
+        origen = "caché" if resultado['desde_cache'] else "entrenado"
+        print(f"\n Modelo evaluado: {name} {resultado['params']} ({origen})")
+        entrada = cargar_resultado(resultado['clave'], directorio_cache)
+        guardar_pkl(entrada['modelo'], f"models/{name}_model.pkl")
+        # El estado de online_update.py acumulaba sobre el modelo anterior
+        if os.path.exists(f"models/{name}_online.npz"):
+            os.remove(f"models/{name}_online.npz")
+        try:
+            print(f" Artefacto mapeable en: {exportar_verificado(name, entrada['modelo'], preprocessor, X)}")
+        except (ArtefactoIncompatible, TypeError) as e:
+            # El servicio vuelve al .pkl si el artefacto falta o es más antiguo
+            print(f" No se exportó el artefacto de {name}: {e}")
+
+        results.append({'Modelo': name, **{k: v for k, v in resultado.items()
+                                           if k not in ('Modelo', 'clave', 'desde_cache', 'inicializacion')}})
         df_result = df.copy()
-        df_result['cluster'] = clusters
-        df_result.to_parquet(f"data/outputs/df_cluster_{name}.parquet", index=False)
-        joblib.dump(model, f"models/{name}_model.pkl")
+        df_result['cluster'] = entrada['labels']
+        guardar_parquet(df_result, f"data/outputs/df_cluster_{name}.parquet")
+        guardar_perfiles(construir_perfiles(df_result.copy()), f"models/{name}_perfiles.parquet")
 
         print(f" Etiquetas guardadas en Parquet: df_cluster_{name}.parquet")
+        print(f" Perfiles guardados en: models/{name}_perfiles.parquet")
         print(f" Modelo guardado en: models/{name}_model.pkl")
 
-    except Exception as e:
-        print(f" Error con {name}: {e}")
-
-# --- 7. Guardar métricas comparativas ---
-results_df = pd.DataFrame(results)
-results_df.to_parquet("data/outputs/clustering_comparison.parquet", index=False)
-print("\n Métricas guardadas en clustering_comparison.parquet")
-
-# --- 8. Guardar preprocesador ---
-joblib.dump(preprocessor, "models/preprocessor.pkl")
-print(" Preprocesador guardado en: models/preprocessor.pkl")
+    # --- 7. Guardar métricas comparativas (incluye el modo de cálculo de Silhouette) ---
+    results_df = pd.DataFrame(results)
+    guardar_parquet(results_df, "data/outputs/clustering_comparison.parquet")
+    print("\n Métricas guardadas en clustering_comparison.parquet")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena y compara los modelos de clustering")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("MODEL_BUILDER_WORKERS", min(len(modelos), os.cpu_count() or 1))),
+                        help="Procesos en paralelo (1 = secuencial)")
+    parser.add_argument("--k", type=int, default=4, help="Clusters para KMeans, MiniBatchKMeans y GaussianMixture")
+    parser.add_argument("--eps", type=float, default=0.5, help="Radio de vecindad de DBSCAN")
+    parser.add_argument("--min-samples", type=int, default=5, help="Vecinos mínimos de DBSCAN")
+    parser.add_argument("--barrido", action="store_true",
+                        help="Recorre las grillas de hiperparámetros y guarda sweep_results.parquet")
+    parser.add_argument("--cache", default=ruta_cache, help="Carpeta de la caché de resultados")
+    parser.add_argument("--metricas", choices=modos, default=config_por_defecto["modo"],
+                        help="Cálculo de Silhouette: exacto por bloques, muestreo estratificado o auto")
+    parser.add_argument("--muestra", type=int, default=config_por_defecto["tamano_muestra"],
+                        help="Filas por muestra estratificada")
+    parser.add_argument("--repeticiones", type=int, default=config_por_defecto["repeticiones"],
+                        help="Semillas de muestreo para el intervalo de confianza")
+    args = parser.parse_args()
+    main(args.workers, {**config_por_defecto, "modo": args.metricas, "tamano_muestra": args.muestra,
+                        "repeticiones": args.repeticiones},
+         seleccion_modelos(args.k, args.eps, args.min_samples), args.barrido, args.cache)
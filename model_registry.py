@@ -0,0 +1,127 @@
+import glob
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# --- Registro de artefactos con carga diferida y recarga en caliente ---
+class RegistroModelos:
+    def __init__(self, cargador, patrones: list, intervalo: float = 10.0, bloqueo: str = None,
+                 vencimiento_bloqueo: float = 300.0):
+        # cargador: función sin argumentos que devuelve los artefactos listos para servir
+        # bloqueo: archivo que existe mientras se publica una versión con varios archivos
+        self.cargador = cargador
+        self.patrones = patrones
+        self.intervalo = intervalo
+        self.bloqueo = bloqueo
+        self.vencimiento_bloqueo = vencimiento_bloqueo
+        self.version = 0
+        self.ultimo_error = None
+
+        self._artefactos = None
+        self._vigente = (None, 0)
+        self._huella = None
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def _calcular_huella(self) -> tuple:
+        archivos = sorted({ruta for patron in self.patrones for ruta in glob.glob(patron)})
+        huella = []
+        for ruta in archivos:
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            huella.append((ruta, st.st_mtime_ns, st.st_size))
+        return tuple(huella)
+
+    def _publicacion_en_curso(self) -> bool:
+        if not self.bloqueo:
+            return False
+        try:
+            edad = time.time() - os.path.getmtime(self.bloqueo)
+        except FileNotFoundError:
+            return False
+        # Un bloqueo abandonado (proceso caído) no detiene las recargas para siempre
+        return edad < self.vencimiento_bloqueo
+
+    def obtener(self):
+        artefactos = self._artefactos
+        if artefactos is None:
+            with self._lock:
+                if self._artefactos is None:
+                    self._cargar()
+                artefactos = self._artefactos
+        return artefactos
+
+    def obtener_con_version(self) -> tuple:
+        # Artefactos y número de versión leídos juntos (sin carrera con una recarga)
+        self.obtener()
+        return self._vigente
+
+    def precargar(self) -> None:
+        self.obtener()
+
+    def _cargar(self) -> None:
+        # Se construye todo antes de publicar: los lectores nunca ven un estado parcial
+        huella = self._calcular_huella()
+        artefactos = self.cargador()
+        self._huella = huella
+        self._artefactos = artefactos
+        self.version += 1
+        self._vigente = (artefactos, self.version)
+        self.ultimo_error = None
+
+    def recargar(self, forzar: bool = False) -> bool:
+        if not forzar and self._publicacion_en_curso():
+            return False
+        with self._lock:
+            if not forzar and self._artefactos is not None and self._calcular_huella() == self._huella:
+                return False
+            try:
+                self._cargar()
+            except Exception as e:
+                # Si la recarga falla se sigue sirviendo la versión anterior
+                self.ultimo_error = str(e)
+                if self._artefactos is None:
+                    raise
+                print(f" Recarga de modelos fallida, se mantiene la versión {self.version}: {e}")
+                return False
+        print(f" Modelos recargados (versión {self.version}).")
+        return True
+
+    def _vigilar(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            if self._artefactos is None:
+                continue
+            try:
+                self.recargar()
+            except Exception as e:
+                print(f" Error al vigilar modelos: {e}")
+
+    def iniciar_vigilancia(self) -> None:
+        if self.intervalo <= 0 or (self._hilo is not None and self._hilo.is_alive()):
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._vigilar, name="vigilancia-modelos", daemon=True)
+        self._hilo.start()
+
+    def detener_vigilancia(self) -> None:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self.intervalo + 1)
+            self._hilo = None
+
+
+# --- Publicación de una versión: el registro no recarga hasta que terminen todos los archivos ---
+@contextmanager
+def publicacion(ruta_bloqueo: str):
+    with open(ruta_bloqueo, "w") as f:
+        f.write(str(os.getpid()))
+    try:
+        yield
+    finally:
+        os.remove(ruta_bloqueo)
@@ -0,0 +1,216 @@
+import argparse
+import os
+import joblib
+import numpy as np
+import pandas as pd
+
+from data_cleaning import compactar_tipos, leer_df_cluster
+from kernel_builder import compilar_motor, verificar_paridad
+from model_artifacts import exportar_modelo, huella_arreglos
+from model_builder import datos_modelo, edad_map
+from model_registry import publicacion
+from recommender import MotorInferencia, guardar_perfiles, ruta_bloqueo
+
+# --- Estadísticas acumuladas que reproducen construir_perfiles sin releer los datos ---
+columnas_perfil = ['edad_ordinal', 'imc', 'totalComidasDia', 'puntaje_ia']
+
+
+def rutas(nombre: str) -> dict:
+    return {
+        'modelo': f"models/{nombre}_model.pkl",
+        'perfiles': f"models/{nombre}_perfiles.parquet",
+        'estado': f"models/{nombre}_online.npz",
+        'df_cluster': f"data/outputs/df_cluster_{nombre}.parquet"
+    }
+
+
+# --- 1. Estado: sumas y conteos por cluster ---
+def estado_vacio(k: int) -> dict:
+    return {
+        'version': np.array(0),
+        'n': np.zeros(k, dtype=np.int64),
+        # Peso de cada centroide en la media móvil (registros que ya lo movieron)
+        'pesos': np.zeros(k),
+        'sumas': np.zeros((k, len(columnas_perfil))),
+        'conteos': np.zeros((k, len(columnas_perfil)), dtype=np.int64),
+        'mujeres': np.zeros(k, dtype=np.int64),
+        'inseguridad': np.zeros(k, dtype=np.int64),
+        'estratos': np.array([], dtype=str),
+        'conteos_estrato': np.zeros((k, 0), dtype=np.int64)
+    }
+
+
+def sumar_estadisticas(estado: dict, df: pd.DataFrame, clusters: np.ndarray) -> dict:
+    k = len(estado['n'])
+    estado['n'] = estado['n'] + np.bincount(clusters, minlength=k)
+
+    for j, col in enumerate(columnas_perfil):
+        valores = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+        ok = ~np.isnan(valores)
+        estado['sumas'][:, j] += np.bincount(clusters[ok], weights=valores[ok], minlength=k)
+        estado['conteos'][:, j] += np.bincount(clusters[ok], minlength=k)
+
+    mujeres = (df['sexo'].astype(str).str.lower().str.strip() == "mujeres").to_numpy()
+    estado['mujeres'] = estado['mujeres'] + np.bincount(clusters[mujeres], minlength=k)
+    inseguridad = pd.to_numeric(df['inseguridad'], errors="coerce").fillna(0).astype(int).to_numpy()
+    estado['inseguridad'] = estado['inseguridad'] + np.bincount(clusters, weights=inseguridad, minlength=k).astype(np.int64)
+
+    # Las columnas de estrato se mantienen ordenadas: el empate en la moda se resuelve igual que pandas
+    estrato = df['estrato'].astype(object)
+    presentes = estrato.notna().to_numpy()
+    valores = estrato[presentes].astype(str).to_numpy()
+    estratos = np.union1d(estado['estratos'], np.unique(valores)).astype(str)
+    conteos = np.zeros((k, len(estratos)), dtype=np.int64)
+    conteos[:, np.searchsorted(estratos, estado['estratos'])] = estado['conteos_estrato']
+    np.add.at(conteos, (clusters[presentes], np.searchsorted(estratos, valores)), 1)
+    estado['estratos'], estado['conteos_estrato'] = estratos, conteos
+    return estado
+
+
+def perfiles_desde_estado(estado: dict) -> pd.DataFrame:
+    n = estado['n']
+    presentes = np.flatnonzero(n > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        medias = estado['sumas'] / estado['conteos']
+
+    perfiles = pd.DataFrame(medias[presentes], columns=columnas_perfil,
+                            index=pd.Index(presentes, name="cluster"))
+    conteos = estado['conteos_estrato'][presentes]
+    perfiles['estrato'] = pd.Categorical([estado['estratos'][np.argmax(fila)] if fila.sum() else "N/D"
+                                          for fila in conteos])
+    perfiles['tamaño'] = n[presentes]
+    perfiles['% mujeres'] = (estado['mujeres'][presentes] / n[presentes] * 100).round(1)
+    perfiles['% inseguridad'] = (estado['inseguridad'][presentes] / n[presentes] * 100).round(1)
+    return perfiles
+
+
+def huella_centroides(centroides: np.ndarray) -> np.ndarray:
+    return np.array(huella_arreglos({'centroides': np.asarray(centroides, dtype=np.float64)}))
+
+
+def cargar_estado(nombre: str, centroides: np.ndarray) -> dict:
+    ruta = rutas(nombre)['estado']
+    if os.path.exists(ruta):
+        with np.load(ruta, allow_pickle=False) as datos:
+            estado = {clave: datos[clave] for clave in datos.files}
+        # Solo vale para los centroides que publicó: tras reentrenar (o sin huella) se reconstruye
+        if 'modelo' in estado and str(estado['modelo']) == str(huella_centroides(centroides)):
+            return estado
+        print(f" Estado de {nombre} de otro modelo: se reconstruye desde {rutas(nombre)['df_cluster']}")
+    # Primera actualización: el estado se inicializa con las etiquetas del entrenamiento completo
+    df = leer_df_cluster(rutas(nombre)['df_cluster'])
+    estado = sumar_estadisticas(estado_vacio(len(centroides)), df, df['cluster'].to_numpy().astype(np.int64))
+    # Cada centroide pesa, de entrada, lo que su cluster
+    estado['pesos'] = estado['n'].astype(np.float64)
+    return estado
+
+
+def guardar_estado(estado: dict, ruta: str) -> None:
+    tmp = ruta + ".tmp.npz"
+    np.savez(tmp, **estado)
+    os.replace(tmp, ruta)
+
+
+# --- 2. Actualización de centroides por media móvil ponderada por conteos ---
+def actualizar_centroides(centroides: np.ndarray, pesos: np.ndarray, X: np.ndarray, clusters: np.ndarray) -> None:
+    k = len(centroides)
+    b = np.bincount(clusters, minlength=k)
+    sumas = np.zeros_like(centroides)
+    np.add.at(sumas, clusters, X)
+    activos = b > 0
+    pesos += b
+    centroides[activos] += (sumas[activos] - b[activos, None] * centroides[activos]) / pesos[activos, None]
+
+
+def preparar_registros(registros: pd.DataFrame) -> pd.DataFrame:
+    df = compactar_tipos(registros.copy())
+    if 'edad_ordinal' not in df.columns:
+        df['edad_ordinal'] = df['edad'].map(edad_map).astype(float)
+    return df
+
+
+# --- 3. Pasar los registros nuevos por mini-lotes y publicar una versión ---
+def actualizar(registros: pd.DataFrame, nombre: str = "KMeans", tamano_lote: int = 1024) -> dict:
+    r = rutas(nombre)
+    model = joblib.load(r['modelo'])
+    preprocessor = joblib.load("models/preprocessor.pkl")
+    if not hasattr(model, "cluster_centers_"):
+        raise ValueError(f"{nombre} no tiene centroides; solo se actualizan modelos tipo KMeans.")
+
+    k = len(model.cluster_centers_)
+    estado = cargar_estado(nombre, model.cluster_centers_)
+    df = preparar_registros(registros)
+    X = preprocessor.transform(datos_modelo(df))
+
+    # Registros etiquetados (columna cluster) se usan tal cual; el resto se asigna con el modelo vigente
+    if 'cluster' in df.columns:
+        etiquetas = pd.to_numeric(df['cluster'], errors="coerce").to_numpy()
+    else:
+        etiquetas = np.full(len(df), np.nan)
+    etiquetada = ~np.isnan(etiquetas)
+    if etiquetada.any() and not np.isin(etiquetas[etiquetada], np.arange(k)).all():
+        raise ValueError(f"Etiquetas fuera de rango: se esperan clusters entre 0 y {k - 1}.")
+
+    iniciales = np.array(model.cluster_centers_, dtype=np.float64)
+    centroides = iniciales.copy()
+    pesos = estado['pesos'].astype(np.float64)
+    clusters = np.empty(len(df), dtype=np.int64)
+
+    for inicio in range(0, len(df), tamano_lote):
+        lote = slice(inicio, inicio + tamano_lote)
+        Xb, m = X[lote], etiquetada[lote]
+        model.cluster_centers_ = centroides
+        cb = model.predict(Xb).astype(np.int64)
+        cb[m] = etiquetas[lote][m].astype(np.int64)
+        clusters[lote] = cb
+
+        # Etiquetados y asignados se actualizan igual (el paso de MiniBatchKMeans es esta misma media
+        # ponderada); los pesos viven en el estado, no en atributos privados de sklearn
+        actualizar_centroides(centroides, pesos, Xb, cb)
+
+    model.cluster_centers_ = centroides
+    estado['pesos'] = pesos
+    estado['modelo'] = huella_centroides(centroides)
+    estado = sumar_estadisticas(estado, df, clusters)
+    estado['version'] = np.array(int(estado['version']) + 1)
+
+    # --- 4. Validar el motor compilado antes de publicar ---
+    artefacto = compilar_motor(preprocessor, model)
+    verificar_paridad(MotorInferencia(artefacto), preprocessor, model, df)
+
+    # Dentro del bloqueo el registro del servicio no recarga una versión a medio escribir;
+    # el artefacto mapeable se escribe después del .pkl para que no se considere desactualizado
+    with publicacion(ruta_bloqueo):
+        tmp = r['modelo'] + ".tmp"
+        joblib.dump(model, tmp)
+        os.replace(tmp, r['modelo'])
+        exportar_modelo(nombre, model, preprocessor)
+        guardar_perfiles(perfiles_desde_estado(estado), r['perfiles'])
+        guardar_estado(estado, r['estado'])
+
+    return {
+        'Modelo': nombre,
+        'version': int(estado['version']),
+        'registros': len(df),
+        'etiquetados': int(etiquetada.sum()),
+        'desplazamiento_max': float(np.linalg.norm(centroides - iniciales, axis=1).max())
+    }
+
+
+def leer_registros(ruta: str) -> pd.DataFrame:
+    if ruta.endswith(".csv"):
+        return pd.read_csv(ruta)
+    return pd.read_parquet(ruta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Actualiza centroides y perfiles con registros nuevos")
+    parser.add_argument("registros", help="Parquet o CSV con el esquema de df_cluster (columna cluster opcional)")
+    parser.add_argument("--modelo", default="KMeans", choices=["KMeans", "MiniBatchKMeans"])
+    parser.add_argument("--lote", type=int, default=1024, help="Registros por mini-lote")
+    args = parser.parse_args()
+
+    resumen = actualizar(leer_registros(args.registros), args.modelo, args.lote)
+    print(f" {resumen['Modelo']} actualizado con {resumen['registros']} registros "
+          f"({resumen['etiquetados']} etiquetados). Versión publicada: {resumen['version']}")
+    print(f" Desplazamiento máximo de un centroide: {resumen['desplazamiento_max']:.4f}")
@@ -0,0 +1,241 @@
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from datetime import datetime, timezone
+
+from evaluation import config_por_defecto, modos
+from model_artifacts import hash_archivo
+
+# Carpeta del repositorio; los datos y las salidas son relativos a la carpeta de trabajo
+raiz = os.path.dirname(os.path.abspath(__file__))
+
+# --- 1. Estado del pipeline y almacén de salidas por contenido ---
+ruta_pipeline = "data/cache/pipeline"
+ruta_estado = os.path.join(ruta_pipeline, "estado.json")
+ruta_objetos = os.path.join(ruta_pipeline, "objetos")
+ruta_versiones = os.path.join(ruta_pipeline, "versiones")
+
+version_pipeline = 1
+
+
+def leer_estado(ruta: str = ruta_estado) -> dict:
+    if not os.path.exists(ruta):
+        return {"version": version_pipeline, "etapas": {}, "archivos": {}}
+    with open(ruta) as f:
+        estado = json.load(f)
+    # Un estado de otra versión del runner no se reutiliza: todas las etapas se revalidan
+    if estado.get("version") != version_pipeline:
+        return {"version": version_pipeline, "etapas": {}, "archivos": {}}
+    return estado
+
+
+def guardar_json(contenido: dict, ruta: str) -> None:
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(contenido, f, indent=2, sort_keys=True)
+    os.replace(tmp, ruta)
+
+
+# --- 2. Huellas: archivos (sha256 recordado por tamaño y fecha), código y parámetros ---
+def huella_archivo(ruta: str, conocidos: dict) -> str:
+    # Los .dta y los parquet pueden pesar varios GB: solo se releen si cambian tamaño o fecha
+    info = os.stat(ruta)
+    previo = conocidos.get(ruta)
+    if previo and previo[0] == info.st_size and previo[1] == info.st_mtime_ns:
+        return previo[2]
+    sha = hash_archivo(ruta)
+    conocidos[ruta] = [info.st_size, info.st_mtime_ns, sha]
+    return sha
+
+
+def modulos_locales(script: str, vistos: set = None) -> list:
+    # El script y todo lo que importa del repositorio, también dentro de funciones
+    vistos = set() if vistos is None else vistos
+    ruta = os.path.join(raiz, script)
+    if script in vistos or not os.path.exists(ruta):
+        return sorted(vistos)
+    vistos.add(script)
+    with open(ruta, encoding="utf-8") as f:
+        arbol = ast.parse(f.read())
+    for nodo in ast.walk(arbol):
+        if isinstance(nodo, ast.Import):
+            nombres = [alias.name for alias in nodo.names]
+        elif isinstance(nodo, ast.ImportFrom) and nodo.module and not nodo.level:
+            nombres = [nodo.module]
+        else:
+            continue
+        for nombre in nombres:
+            modulos_locales(nombre.split(".")[0] + ".py", vistos)
+    return sorted(vistos)
+
+
+def resolver(patrones: list) -> list:
+    return sorted({ruta for patron in patrones for ruta in glob.glob(patron) if os.path.isfile(ruta)})
+
+
+def huella_etapa(etapa: dict, conocidos: dict) -> tuple:
+    contenido = {
+        "etapa": etapa["nombre"],
+        "codigo": {m: huella_archivo(os.path.join(raiz, m), {}) for m in modulos_locales(etapa["script"])},
+        "argumentos": etapa["argumentos"],
+        "entradas": {ruta: huella_archivo(ruta, conocidos) for ruta in resolver(etapa["entradas"])}
+    }
+    huella = hashlib.sha256(json.dumps(contenido, sort_keys=True).encode()).hexdigest()
+    return huella, contenido
+
+
+# --- 3. Etapas: script, argumentos que cambian el resultado, entradas y salidas ---
+def etapas(args) -> list:
+    metricas = {**config_por_defecto, "modo": args.metricas}
+    return [
+        {"nombre": "etl", "script": "preprocess_data.py",
+         "argumentos": ["--entrada", args.entrada, "--modo", args.modo, "--chunksize", str(args.chunksize),
+                        "--sin-diagnostico"],
+         "entradas": [os.path.join(args.entrada, "*.dta")],
+         "salidas": ["data/outputs/df_cluster.parquet"]},
+        {"nombre": "modelos", "script": "model_builder.py",
+         "argumentos": ["--k", str(args.k), "--eps", str(args.eps), "--min-samples", str(args.min_samples),
+                        "--metricas", metricas["modo"], "--muestra", str(metricas["tamano_muestra"]),
+                        "--repeticiones", str(metricas["repeticiones"])],
+         "workers": ["--workers", str(args.workers)],
+         "entradas": ["data/outputs/df_cluster.parquet"],
+         "salidas": ["models/*_model.pkl", "models/preprocessor.pkl", "models/*_perfiles.parquet",
+                     "models/*/manifest.json", "models/*/*.npy", "data/outputs/df_cluster_*.parquet",
+                     "data/outputs/clustering_comparison.parquet"]},
+        {"nombre": "analisis", "script": "model_analisis.py",
+         "argumentos": [],
+         "workers": ["--workers", str(args.workers)],
+         "entradas": ["data/outputs/clustering_comparison.parquet", "data/outputs/df_cluster_*.parquet",
+                      "models/preprocessor.pkl"],
+         "salidas": ["data/outputs/*.png", "data/outputs/analisis_manifest.json"]},
+        {"nombre": "perfiles", "script": "cluster_profiles.py",
+         "argumentos": [],
+         "entradas": ["data/outputs/clustering_comparison.parquet", "data/outputs/df_cluster_*.parquet",
+                      "models/preprocessor.pkl"],
+         "salidas": ["data/outputs/perfiles_clusters.json"]}
+    ]
+
+
+# --- 4. Versiones: cada huella guarda sus salidas en el almacén y se puede restaurar sin recalcular ---
+def ruta_objeto(sha: str) -> str:
+    return os.path.join(ruta_objetos, sha[:2], sha)
+
+
+def guardar_objetos(salidas: dict) -> None:
+    for ruta, sha in salidas.items():
+        destino = ruta_objeto(sha)
+        if os.path.exists(destino):
+            continue
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Copia (no enlace): un script que reescriba el archivo en su sitio no altera la versión guardada
+        tmp = f"{destino}.{os.getpid()}.tmp"
+        shutil.copy2(ruta, tmp)
+        os.replace(tmp, destino)
+
+
+def restaurar(salidas: dict, conocidos: dict) -> bool:
+    if not all(os.path.exists(ruta_objeto(sha)) for sha in salidas.values()):
+        return False
+    for ruta, sha in salidas.items():
+        if os.path.exists(ruta) and huella_archivo(ruta, conocidos) == sha:
+            continue
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        # copy2 conserva la fecha original: los artefactos mapeables siguen siendo más recientes que su .pkl
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        shutil.copy2(ruta_objeto(sha), tmp)
+        os.replace(tmp, ruta)
+        huella_archivo(ruta, conocidos)
+    return True
+
+
+def intactas(salidas: dict, conocidos: dict) -> bool:
+    return all(os.path.exists(ruta) and huella_archivo(ruta, conocidos) == sha for ruta, sha in salidas.items())
+
+
+# --- 5. Ejecutar una etapa solo si cambió su huella o se tocaron sus salidas ---
+def ejecutar_etapa(etapa: dict, estado: dict, forzar: bool = False) -> dict:
+    conocidos = estado["archivos"]
+    nombre = etapa["nombre"]
+    huella, contenido = huella_etapa(etapa, conocidos)
+    previa = estado["etapas"].get(nombre)
+
+    if not forzar and previa and previa["huella"] == huella and intactas(previa["salidas"], conocidos):
+        return {"etapa": nombre, "resultado": "vigente", "segundos": 0.0}
+
+    ruta_version = os.path.join(ruta_versiones, nombre, f"{huella}.json")
+    inicio = time.perf_counter()
+    if not forzar and os.path.exists(ruta_version):
+        with open(ruta_version) as f:
+            version = json.load(f)
+        if restaurar(version["salidas"], conocidos):
+            estado["etapas"][nombre] = version
+            return {"etapa": nombre, "resultado": "restaurada", "segundos": round(time.perf_counter() - inicio, 3)}
+
+    entorno = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [raiz, os.environ.get("PYTHONPATH")])),
+               "MPLBACKEND": "Agg"}
+    comando = [sys.executable, os.path.join(raiz, etapa["script"])] + etapa["argumentos"] + etapa.get("workers", [])
+    subprocess.run(comando, env=entorno, check=True)
+    segundos = round(time.perf_counter() - inicio, 3)
+
+    salidas = {ruta: huella_archivo(ruta, conocidos) for ruta in resolver(etapa["salidas"])}
+    guardar_objetos(salidas)
+    version = {
+        "huella": huella,
+        "entradas": contenido["entradas"],
+        "codigo": contenido["codigo"],
+        "argumentos": contenido["argumentos"],
+        "salidas": salidas,
+        "segundos": segundos,
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds")
+    }
+    guardar_json(version, ruta_version)
+    estado["etapas"][nombre] = version
+    return {"etapa": nombre, "resultado": "ejecutada", "segundos": segundos}
+
+
+def ejecutar(args) -> list:
+    estado = leer_estado()
+    seleccion = args.etapas or [etapa["nombre"] for etapa in etapas(args)]
+    resultados = []
+    for etapa in etapas(args):
+        if etapa["nombre"] not in seleccion:
+            continue
+        print(f"\n --- Etapa {etapa['nombre']} ({etapa['script']}) ---")
+        resultado = ejecutar_etapa(etapa, estado, args.forzar)
+        # El estado se guarda tras cada etapa: si una falla, las anteriores no se repiten
+        guardar_json(estado, ruta_estado)
+        print(f" {resultado['etapa']}: {resultado['resultado']} ({resultado['segundos']} s)")
+        resultados.append(resultado)
+    return resultados
+
+
+if __name__ == "__main__":
+    nombres_etapas = ["etl", "modelos", "analisis", "perfiles"]
+    parser = argparse.ArgumentParser(description="ETL → modelos → análisis → perfiles, omitiendo las etapas vigentes")
+    parser.add_argument("--etapas", nargs="+", choices=nombres_etapas, help="Etapas a revisar (por defecto todas)")
+    parser.add_argument("--forzar", action="store_true", help="Ejecuta las etapas aunque sus salidas estén vigentes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Procesos para modelos y análisis (no cambia los resultados)")
+    parser.add_argument("--entrada", default="data/datasets", help="Carpeta con los archivos .dta")
+    parser.add_argument("--modo", choices=["bloques", "memoria"], default="bloques")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Filas por bloque en modo bloques")
+    parser.add_argument("--k", type=int, default=4, help="Clusters para KMeans, MiniBatchKMeans y GaussianMixture")
+    parser.add_argument("--eps", type=float, default=0.5, help="Radio de vecindad de DBSCAN")
+    parser.add_argument("--min-samples", type=int, default=5, help="Vecinos mínimos de DBSCAN")
+    parser.add_argument("--metricas", choices=modos, default=config_por_defecto["modo"],
+                        help="Cálculo de Silhouette en model_builder.py")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    resultados = ejecutar(args)
+    print(f"\n Pipeline completado en {time.perf_counter() - inicio:.2f} s: "
+          + ", ".join(f"{r['etapa']} {r['resultado']}" for r in resultados))
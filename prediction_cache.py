@@ -0,0 +1,70 @@
+import threading
+
+from collections import OrderedDict
+
+
+# --- Caché LRU de clusters por vector de características normalizado ---
+class CachePredicciones:
+    def __init__(self, capacidad: int = 50_000):
+        # capacidad <= 0 desactiva la caché
+        self.capacidad = capacidad
+        self.aciertos = 0
+        self.fallos = 0
+        self.version = None
+
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sincronizar(self, version) -> None:
+        # Una versión nueva de los modelos invalida todo lo guardado
+        if version != self.version:
+            self._datos.clear()
+            self.version = version
+
+    def obtener_lote(self, claves: list, version) -> list:
+        if self.capacidad <= 0:
+            self.fallos += len(claves)
+            return [None] * len(claves)
+
+        valores = []
+        with self._lock:
+            self._sincronizar(version)
+            for clave in claves:
+                valor = None if clave is None else self._datos.get(clave)
+                if valor is None:
+                    self.fallos += 1
+                else:
+                    self._datos.move_to_end(clave)
+                    self.aciertos += 1
+                valores.append(valor)
+        return valores
+
+    def guardar_lote(self, claves: list, valores: list, version) -> None:
+        if self.capacidad <= 0:
+            return
+        with self._lock:
+            self._sincronizar(version)
+            for clave, valor in zip(claves, valores):
+                if clave is None:
+                    continue
+                self._datos[clave] = valor
+                self._datos.move_to_end(clave)
+            while len(self._datos) > self.capacidad:
+                self._datos.popitem(last=False)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "capacidad": self.capacidad,
+            "tamano": len(self._datos),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+            "version_modelos": self.version
+        }
@@ -1,77 +1,278 @@
-import pandas as pd
-import numpy as np
+import argparse
+import json
 import os
 
-# --- 1. Cargar archivos .dta ---
-df_pts = pd.read_stata("data/datasets/PTS_2.dta")
-df_ant = pd.read_stata("data/datasets/ANTROPOMETRIA.dta")
-df_pisnsp = pd.read_stata("data/datasets/PISNSP.dta")
-df_sa = pd.read_stata("data/datasets/SA_1.dta")
-
-# --- 2. Seleccionar y renombrar columnas ---
-df_pts = df_pts[['LLAVE_HOGAR', 'LLAVE_PERSONA', 'edades', 'sexo', 'niveledu', 'cuartil_riqueza2015']].rename(columns={
-    'edades': 'edad',
-    'niveledu': 'nivel_educativo',
-    'cuartil_riqueza2015': 'estrato'
-})
-df_ant = df_ant[['LLAVE_PERSONA', 'AN_IMC', 'estadoImc1']].rename(columns={
-    'AN_IMC': 'imc',
-    'estadoImc1': 'estado_imc'
-})
-df_pisnsp = df_pisnsp[['LLAVE_PERSONA', 'totalComidasDia']]
-df_sa = df_sa[['LLAVE_HOGAR', 'SA10_1', 'SA11_1', 'disminuir_porciones', 'pedir_prestado', 'menor_calidad', 'puntaje', 'inseguridad']]
-
-# --- 3. Asegurar llaves como texto ---
-for df in [df_pts, df_ant, df_pisnsp, df_sa]:
-    if 'LLAVE_PERSONA' in df.columns:
-        df['LLAVE_PERSONA'] = df['LLAVE_PERSONA'].astype(str).str.strip()
-    if 'LLAVE_HOGAR' in df.columns:
-        df['LLAVE_HOGAR'] = df['LLAVE_HOGAR'].astype(str).str.strip()
-
-# --- 4. Unir datasets ---
-df_cluster = df_pts.merge(df_ant, on='LLAVE_PERSONA', how='inner')
-df_cluster = df_cluster.merge(df_pisnsp, on='LLAVE_PERSONA', how='left')
-df_cluster = df_cluster.merge(df_sa, on='LLAVE_HOGAR', how='left')
-df_cluster.drop(columns=['LLAVE_HOGAR'], inplace=True)
-
-# --- 5. Limpiar columnas binarias ---
-bin_cols = ['SA10_1', 'SA11_1', 'disminuir_porciones', 'pedir_prestado', 'menor_calidad', 'inseguridad']
-for col in bin_cols:
-    df_cluster[col] = (
-        df_cluster[col].astype(str)
-        .str.strip().str.lower()
-        .replace({'sí': 1, 'si': 1, 'no': 0, 'nan': 0, '': 0})
-        .fillna(0)
-    )
-    df_cluster[col] = pd.to_numeric(df_cluster[col], errors='coerce').fillna(0).astype(int)
-
-# --- 6. Procesar puntaje IA ---
-df_cluster.rename(columns={'puntaje': 'puntaje_ia'}, inplace=True)
-df_cluster['puntaje_ia'] = pd.to_numeric(df_cluster['puntaje_ia'], errors='coerce').fillna(0)
-
-# --- 7. Limpiar totalComidasDia ---
-df_cluster['totalComidasDia'] = pd.to_numeric(df_cluster['totalComidasDia'], errors='coerce')
-df_cluster.loc[(df_cluster['totalComidasDia'] <= 0.3) | (df_cluster['totalComidasDia'] > 8), 'totalComidasDia'] = np.nan
-df_cluster['totalComidasDia'].fillna(df_cluster['totalComidasDia'].mean(), inplace=True)
-
-# --- 8. Eliminar filas con valores esenciales faltantes ---
-df_cluster = df_cluster.dropna(subset=['edad', 'sexo', 'nivel_educativo', 'estrato', 'imc', 'estado_imc'])
-
-# --- 9. Crear carpeta y exportar en formato binario ---
-os.makedirs("data/outputs", exist_ok=True)
-df_cluster.to_parquet("data/outputs/df_cluster.parquet", index=False)
-df_cluster.to_pickle("data/outputs/df_cluster.pkl")
-
-# --- 10. Diagnóstico de totalComidasDia ---
-print("\n totalComidasDia: valores mínimos y máximos")
-print(df_cluster['totalComidasDia'].sort_values().unique()[:10])
-print(df_cluster['totalComidasDia'].sort_values(ascending=False).unique()[:10])
-
-print(f"\n df_cluster guardado como .parquet y .pkl con {df_cluster.shape[0]} filas y {df_cluster.shape[1]} columnas.")
-
-# --- Vista previa para validación rápida ---
-print("\n Vista previa del dataframe df_cluster:\n")
-print(df_cluster.head(5))
-
-print("\n Resumen del DataFrame:")
-print(df_cluster.info())
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pyreadstat
+
+from data_cleaning import compactar_tipos, limpiar_binarias
+
+# --- Columnas requeridas por archivo y su nombre final ---
+columnas_pts = {'LLAVE_HOGAR': 'LLAVE_HOGAR', 'LLAVE_PERSONA': 'LLAVE_PERSONA', 'edades': 'edad',
+                'sexo': 'sexo', 'niveledu': 'nivel_educativo', 'cuartil_riqueza2015': 'estrato'}
+columnas_ant = {'LLAVE_PERSONA': 'LLAVE_PERSONA', 'AN_IMC': 'imc', 'estadoImc1': 'estado_imc'}
+columnas_pisnsp = {'LLAVE_PERSONA': 'LLAVE_PERSONA', 'totalComidasDia': 'totalComidasDia'}
+columnas_sa = {'LLAVE_HOGAR': 'LLAVE_HOGAR', 'SA10_1': 'SA10_1', 'SA11_1': 'SA11_1',
+               'disminuir_porciones': 'disminuir_porciones', 'pedir_prestado': 'pedir_prestado',
+               'menor_calidad': 'menor_calidad', 'puntaje': 'puntaje', 'inseguridad': 'inseguridad'}
+
+esenciales = ['edad', 'sexo', 'nivel_educativo', 'estrato', 'imc', 'estado_imc']
+columnas_salida = ['LLAVE_PERSONA', 'edad', 'sexo', 'nivel_educativo', 'estrato', 'imc', 'estado_imc',
+                   'totalComidasDia', 'SA10_1', 'SA11_1', 'disminuir_porciones', 'pedir_prestado',
+                   'menor_calidad', 'puntaje_ia', 'inseguridad']
+
+
+# --- Limpieza común a ambos modos (pasos 5 a 7) ---
+def limpiar_bloque(df_cluster: pd.DataFrame) -> pd.DataFrame:
+    # Binarias vía códigos de categoría (int8) y texto como categóricas
+    df_cluster = compactar_tipos(limpiar_binarias(df_cluster))
+    df_cluster.rename(columns={'puntaje': 'puntaje_ia'}, inplace=True)
+    df_cluster['puntaje_ia'] = pd.to_numeric(df_cluster['puntaje_ia'], errors='coerce').fillna(0)
+    df_cluster['totalComidasDia'] = pd.to_numeric(df_cluster['totalComidasDia'], errors='coerce')
+    df_cluster.loc[(df_cluster['totalComidasDia'] <= 0.3) | (df_cluster['totalComidasDia'] > 8), 'totalComidasDia'] = np.nan
+    return df_cluster
+
+
+# --- Modo en memoria: carga completa de los .dta (implementación original) ---
+def procesar_en_memoria(directorio: str, salida: str) -> None:
+    # --- 1. Cargar archivos .dta ---
+    df_pts = pd.read_stata(os.path.join(directorio, "PTS_2.dta"))
+    df_ant = pd.read_stata(os.path.join(directorio, "ANTROPOMETRIA.dta"))
+    df_pisnsp = pd.read_stata(os.path.join(directorio, "PISNSP.dta"))
+    df_sa = pd.read_stata(os.path.join(directorio, "SA_1.dta"))
+
+    # --- 2. Seleccionar y renombrar columnas ---
+    df_pts = df_pts[list(columnas_pts)].rename(columns=columnas_pts)
+    df_ant = df_ant[list(columnas_ant)].rename(columns=columnas_ant)
+    df_pisnsp = df_pisnsp[list(columnas_pisnsp)]
+    df_sa = df_sa[list(columnas_sa)]
+
+    # --- 3. Asegurar llaves como texto ---
+    for df in [df_pts, df_ant, df_pisnsp, df_sa]:
+        if 'LLAVE_PERSONA' in df.columns:
+            df['LLAVE_PERSONA'] = df['LLAVE_PERSONA'].astype(str).str.strip()
+        if 'LLAVE_HOGAR' in df.columns:
+            df['LLAVE_HOGAR'] = df['LLAVE_HOGAR'].astype(str).str.strip()
+
+    # --- 4. Unir datasets ---
+    df_cluster = df_pts.merge(df_ant, on='LLAVE_PERSONA', how='inner')
+    df_cluster = df_cluster.merge(df_pisnsp, on='LLAVE_PERSONA', how='left')
+    df_cluster = df_cluster.merge(df_sa, on='LLAVE_HOGAR', how='left')
+    df_cluster.drop(columns=['LLAVE_HOGAR'], inplace=True)
+
+    # --- 5 a 7. Binarias, puntaje IA y totalComidasDia ---
+    df_cluster = limpiar_bloque(df_cluster)
+    df_cluster['totalComidasDia'] = df_cluster['totalComidasDia'].fillna(df_cluster['totalComidasDia'].mean())
+
+    # --- 8. Eliminar filas con valores esenciales faltantes ---
+    df_cluster = df_cluster.dropna(subset=esenciales)
+
+    # --- 9. Exportar en formato binario (escritura atómica) ---
+    tmp_salida = salida + ".tmp"
+    df_cluster.to_parquet(tmp_salida, index=False)
+    os.replace(tmp_salida, salida)
+
+
+# --- Lectura por bloques: solo columnas necesarias y etiquetas como códigos ---
+def _tipos_categoricos(ruta: str, columnas: list) -> dict:
+    _, meta = pyreadstat.read_dta(ruta, metadataonly=True)
+    tipos = {}
+    for col in columnas:
+        etiquetas = meta.variable_value_labels.get(col)
+        if not etiquetas:
+            continue
+        codigos = np.array(sorted(etiquetas), dtype=np.float64)
+        categorias = list(dict.fromkeys(etiquetas[c] for c in sorted(etiquetas)))
+        posiciones = np.array([categorias.index(etiquetas[c]) for c in sorted(etiquetas)])
+        tipos[col] = (codigos, posiciones, pd.CategoricalDtype(categorias, ordered=True))
+    return tipos
+
+
+def _a_categoria(serie: pd.Series, codigos, posiciones, tipo) -> pd.Categorical:
+    valores = serie.to_numpy(dtype=np.float64, na_value=np.nan)
+    idx = np.searchsorted(codigos, valores).clip(max=len(codigos) - 1)
+    encontrado = codigos[idx] == valores
+    return pd.Categorical.from_codes(np.where(encontrado, posiciones[idx], -1), dtype=tipo)
+
+
+def leer_por_bloques(ruta: str, columnas: dict, chunksize: int):
+    tipos = _tipos_categoricos(ruta, list(columnas))
+    lector = pyreadstat.read_file_in_chunks(pyreadstat.read_dta, ruta, chunksize=chunksize,
+                                            usecols=list(columnas), apply_value_formats=False)
+    for bloque, _ in lector:
+        for col, (codigos, posiciones, tipo) in tipos.items():
+            bloque[col] = _a_categoria(bloque[col], codigos, posiciones, tipo)
+        for llave in ('LLAVE_PERSONA', 'LLAVE_HOGAR'):
+            if llave in bloque.columns:
+                bloque[llave] = bloque[llave].astype(str).str.strip()
+        yield bloque.rename(columns=columnas)
+
+
+def hash_llaves(llaves: pd.Series) -> np.ndarray:
+    # Llave de texto -> entero de 64 bits: 8 bytes por fila en lugar de un objeto str de Python.
+    # Una colisión entre dos llaves distintas es improbable (~n² / 2^65; 1e-8 con un millón de llaves)
+    return pd.util.hash_array(llaves.to_numpy(dtype=object), categorize=False)
+
+
+def _tabla_busqueda(ruta: str, columnas: dict, llave: str, chunksize: int, filtro: np.ndarray = None) -> tuple:
+    # Tabla derecha del join reducida a llave hasheada + columnas compactas (float64 / códigos de categoría),
+    # ordenada por llave para buscar con searchsorted en cada bloque de PTS
+    llaves, bloques = [], []
+    for bloque in leer_por_bloques(ruta, columnas, chunksize):
+        h = hash_llaves(bloque.pop(llave))
+        if filtro is not None:
+            # Personas sin antropometría nunca sobreviven al join interno
+            conservar = _buscar(filtro, h)[1] > 0
+            h, bloque = h[conservar], bloque[conservar]
+        llaves.append(h)
+        bloques.append(bloque.reset_index(drop=True))
+    llaves = np.concatenate(llaves) if llaves else np.empty(0, dtype=np.uint64)
+    tabla = pd.concat(bloques, ignore_index=True)
+    del bloques
+
+    # Orden estable: con llaves repetidas se conserva el orden del archivo, como en pd.merge
+    orden = np.argsort(llaves, kind="stable")
+    tabla = tabla.take(orden).reset_index(drop=True)
+    # Fila final vacía: el índice -1 de un join izquierdo sin pareja lee nulos
+    tabla = pd.concat([tabla, tabla.iloc[:0].reindex([len(tabla)])], ignore_index=True)
+    return llaves[orden], tabla
+
+
+def _buscar(ordenadas: np.ndarray, llaves: np.ndarray) -> tuple:
+    inicio = np.searchsorted(ordenadas, llaves, side="left")
+    return inicio, np.searchsorted(ordenadas, llaves, side="right") - inicio
+
+
+def unir(izquierda: pd.DataFrame, llaves: np.ndarray, ordenadas: np.ndarray, tabla: pd.DataFrame,
+         how: str) -> pd.DataFrame:
+    # Equivalente a izquierda.merge(tabla, how=how) sobre la llave, con el orden de pd.merge
+    inicio, cuantos = _buscar(ordenadas, llaves)
+    salida = np.maximum(cuantos, 1) if how == "left" else cuantos
+    filas = np.repeat(np.arange(len(izquierda)), salida)
+    desplazamiento = np.arange(len(filas)) - np.repeat(np.cumsum(salida) - salida, salida)
+    derecha = np.repeat(inicio, salida) + desplazamiento
+    if how == "left":
+        derecha[np.repeat(cuantos == 0, salida)] = -1
+    unido = izquierda.take(filas).reset_index(drop=True)
+    pareja = tabla.take(derecha).reset_index(drop=True)
+    return pd.concat([unido, pareja], axis=1)
+
+
+def memoria_busqueda(*tablas) -> int:
+    return int(sum(t.nbytes if isinstance(t, np.ndarray) else t.memory_usage(deep=True).sum() for t in tablas))
+
+
+# --- Modo por bloques: memoria acotada y escritura por row groups ---
+def procesar_por_bloques(directorio: str, salida: str, chunksize: int = 100_000) -> dict:
+    # --- 1. Tablas de búsqueda: solo llave hasheada y columnas compactas ---
+    # Es lo único que crece con la encuesta (~30 bytes por persona y ~20 por hogar); PTS y la salida
+    # se procesan por bloques de chunksize filas
+    llaves_ant, df_ant = _tabla_busqueda(os.path.join(directorio, "ANTROPOMETRIA.dta"),
+                                         columnas_ant, 'LLAVE_PERSONA', chunksize)
+    llaves_pisnsp, df_pisnsp = _tabla_busqueda(os.path.join(directorio, "PISNSP.dta"), columnas_pisnsp,
+                                               'LLAVE_PERSONA', chunksize, filtro=llaves_ant)
+    llaves_sa, df_sa = _tabla_busqueda(os.path.join(directorio, "SA_1.dta"), columnas_sa, 'LLAVE_HOGAR', chunksize)
+    resumen = {
+        "personas": len(llaves_ant),
+        "hogares": len(llaves_sa),
+        "busqueda_mb": round(memoria_busqueda(llaves_ant, df_ant, llaves_pisnsp, df_pisnsp, llaves_sa, df_sa)
+                             / 2 ** 20, 1)
+    }
+
+    # --- 2. Primera pasada: unir, limpiar y escribir bloques intermedios ---
+    tmp_bloques = salida + ".bloques.tmp"
+    escritor = None
+    esquema = None
+    suma_comidas, n_comidas = 0.0, 0
+
+    try:
+        for bloque in leer_por_bloques(os.path.join(directorio, "PTS_2.dta"), columnas_pts, chunksize):
+            persona = hash_llaves(bloque['LLAVE_PERSONA'])
+            hogar = hash_llaves(bloque.pop('LLAVE_HOGAR'))
+
+            unido = unir(bloque.assign(persona=persona, hogar=hogar), persona, llaves_ant, df_ant, "inner")
+            unido = unir(unido, unido['persona'].to_numpy(), llaves_pisnsp, df_pisnsp, "left")
+            unido = unir(unido, unido['hogar'].to_numpy(), llaves_sa, df_sa, "left")
+            unido = limpiar_bloque(unido.drop(columns=['persona', 'hogar']))
+
+            # La media de totalComidasDia se calcula antes de descartar filas, como en el modo en memoria
+            suma_comidas += float(unido['totalComidasDia'].sum())
+            n_comidas += int(unido['totalComidasDia'].count())
+
+            unido = unido.dropna(subset=esenciales)[columnas_salida]
+            if unido.empty:
+                continue
+            if escritor is None:
+                esquema = pa.Schema.from_pandas(unido, preserve_index=False)
+                escritor = pq.ParquetWriter(tmp_bloques, esquema)
+            escritor.write_table(pa.Table.from_pandas(unido, schema=esquema, preserve_index=False))
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+    # --- 3. Segunda pasada: imputar totalComidasDia row group por row group ---
+    tmp_salida = salida + ".tmp"
+    if escritor is None:
+        pd.DataFrame(columns=columnas_salida).to_parquet(tmp_salida, index=False)
+    else:
+        media = suma_comidas / n_comidas if n_comidas else float('nan')
+        origen = pq.ParquetFile(tmp_bloques)
+        idx = origen.schema_arrow.get_field_index('totalComidasDia')
+        with pq.ParquetWriter(tmp_salida, origen.schema_arrow) as destino:
+            for i in range(origen.num_row_groups):
+                tabla = origen.read_row_group(i)
+                columna = pc.fill_null(pc.if_else(pc.is_nan(tabla[idx]), None, tabla[idx]), media)
+                destino.write_table(tabla.set_column(idx, 'totalComidasDia', columna))
+        os.remove(tmp_bloques)
+    os.replace(tmp_salida, salida)
+    return resumen
+
+
+# --- Diagnóstico sobre el archivo ya escrito (lee solo lo necesario) ---
+def diagnostico(salida: str) -> None:
+    archivo = pq.ParquetFile(salida)
+    comidas = archivo.read(columns=['totalComidasDia']).column(0).to_numpy(zero_copy_only=False)
+    unicos = np.unique(comidas[~np.isnan(comidas)])
+
+    print("\n totalComidasDia: valores mínimos y máximos")
+    print(unicos[:10])
+    print(unicos[::-1][:10])
+
+    print(f"\n df_cluster guardado con {archivo.metadata.num_rows} filas y {archivo.metadata.num_columns} columnas.")
+
+    # --- Vista previa para validación rápida ---
+    print("\n Vista previa del dataframe df_cluster:\n")
+    if archivo.num_row_groups:
+        print(archivo.read_row_group(0).slice(0, 5).to_pandas())
+
+    print("\n Esquema del archivo:")
+    print(archivo.schema_arrow)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ETL de ENSIN/ELCSA a df_cluster.parquet")
+    parser.add_argument("--entrada", default="data/datasets", help="Carpeta con los archivos .dta")
+    parser.add_argument("--salida", default="data/outputs/df_cluster.parquet")
+    parser.add_argument("--modo", choices=["bloques", "memoria"], default="bloques")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Filas por bloque en modo bloques")
+    parser.add_argument("--sin-diagnostico", action="store_true")
+    parser.add_argument("--resumen", help="JSON con el tamaño de las tablas de búsqueda (modo bloques)")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.salida) or ".", exist_ok=True)
+    if args.modo == "memoria":
+        procesar_en_memoria(args.entrada, args.salida)
+    else:
+        resumen = procesar_por_bloques(args.entrada, args.salida, args.chunksize)
+        print(f" Tablas de búsqueda en memoria: {resumen['busqueda_mb']} MB "
+              f"({resumen['personas']} personas, {resumen['hogares']} hogares)")
+        if args.resumen:
+            with open(args.resumen, "w") as f:
+                json.dump(resumen, f)
+
+    if not args.sin_diagnostico:
+        diagnostico(args.salida)
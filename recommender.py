@@ -1,15 +1,32 @@
+import os
+import glob
+import math
 import pandas as pd
 import joblib
 import numpy as np
 
-# --- 1. Cargar modelo y preprocesador entrenados ---
-model = joblib.load("models/KMeans_model.pkl")
-preprocessor = joblib.load("models/preprocessor.pkl")
+from sklearn.neighbors import BallTree, KDTree
 
-# --- 2. Cargar data original para inferir perfiles por cluster ---
-df = pd.read_parquet("data/outputs/df_cluster_KMeans.parquet")
+from features import preparar_lote
+from kernel_builder import compilar_motor, compilar_tabla
+from metrics import metricas
+from model_artifacts import ArtefactoIncompatible, arreglos_modelo, artefacto_vigente, cargar_arreglos, \
+    huella_arreglos, nombre_preprocesador
+from model_registry import RegistroModelos
+from prediction_cache import CachePredicciones
 
-# --- 3. Mapear perfiles y recomendaciones por cluster ---
+# --- 1. Rutas de artefactos entrenados ---
+ruta_modelo = "models/KMeans_model.pkl"
+ruta_preprocesador = "models/preprocessor.pkl"
+# Motor compilado del formato anterior (.npz); el vigente es models/<modelo>/manifest.json
+ruta_motor = "models/KMeans_kernel.npz"
+ruta_bloqueo = "models/.publicando"
+
+# Modelo que responde cuando la petición no elige uno; MODELOS_SERVIDOS limita los que se cargan
+modelo_principal = "KMeans"
+modelos_servidos = [m.strip() for m in os.environ.get("MODELOS_SERVIDOS", "").split(",") if m.strip()]
+
+# --- 2. Mapear perfiles y recomendaciones por cluster ---
 def construir_perfiles(df):
     numeric_cols = ["edad_ordinal", "imc", "totalComidasDia", "puntaje_ia"]
     for col in numeric_cols:
@@ -31,9 +48,44 @@ def construir_perfiles(df):
     resumen["% inseguridad"] = (resumen.pop("inseguridad") * 100).round(1)
     return resumen
 
-perfiles = construir_perfiles(df)
 
-# --- 4. Reglas por cluster ---
+def guardar_perfiles(perfiles: pd.DataFrame, ruta: str) -> None:
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    perfiles.to_parquet(tmp)
+    os.replace(tmp, ruta)
+
+
+def perfiles_entrenamiento(nombre: str) -> pd.DataFrame:
+    origen = f"data/outputs/df_cluster_{nombre}.parquet"
+    if not os.path.exists(origen):
+        return None
+    return construir_perfiles(pd.read_parquet(origen))
+
+
+def migrar_perfiles() -> list:
+    # Paso offline (kernel_builder.py): modelos entrenados antes de models/*_perfiles.parquet
+    migrados = []
+    for ruta_modelo in sorted(glob.glob("models/*_model.pkl")):
+        nombre = os.path.basename(ruta_modelo)[:-len("_model.pkl")]
+        ruta = f"models/{nombre}_perfiles.parquet"
+        if not os.path.exists(ruta):
+            perfiles = perfiles_entrenamiento(nombre)
+            if perfiles is not None:
+                guardar_perfiles(perfiles, ruta)
+                migrados.append(ruta)
+    return migrados
+
+
+# --- 3. Perfiles precalculados (el servicio no lee el parquet de entrenamiento) ---
+def cargar_perfiles(nombre: str = modelo_principal) -> pd.DataFrame:
+    ruta = f"models/{nombre}_perfiles.parquet"
+    if not os.path.exists(ruta):
+        # Ni se calculan aquí ni se escriben: el servicio no lee el parquet de entrenamiento
+        raise FileNotFoundError(f"Faltan los perfiles de {nombre} ({ruta}): ejecute kernel_builder.py "
+                                f"o recommender.migrar_perfiles().")
+    return pd.read_parquet(ruta)
+
+# --- 4. Reglas por cluster (escritas para los clusters de KMeans) ---
 recomendaciones = {
     0: "Promover balance nutricional y control de porciones.",
     1: "Aumentar calidad calórica y monitorear peso.",
@@ -41,27 +93,477 @@ recomendaciones = {
     3: "Reeducación nutricional en jóvenes vulnerables."
 }
 
-# --- 5. Recomendador principal ---
-def recomendar(usuario: dict) -> dict:
+# --- 5. Motor de inferencia compilado (NumPy puro, sin pandas ni sklearn) ---
+def _es_faltante(valor) -> bool:
+    return valor is None or (isinstance(valor, float) and math.isnan(valor))
+
+
+class MotorInferencia:
+    # Margen relativo por debajo del cual la tabla cede la decisión al cálculo matricial
+    tolerancia_tabla = 1e-9
+
+    def __init__(self, artefacto: dict):
+        conservadas = np.asarray(artefacto["num_conservadas"], dtype=bool)
+        self.num_cols = [str(c) for c in np.asarray(artefacto["num_cols"])[conservadas]]
+        self.num_imputacion = np.asarray(artefacto["num_imputacion"])[conservadas]
+        self.num_media = np.asarray(artefacto["num_media"])
+        self.num_escala = np.asarray(artefacto["num_escala"])
+
+        self.cat_cols = [str(c) for c in artefacto["cat_cols"]]
+        self.cat_imputacion = [str(v) for v in artefacto["cat_imputacion"]]
+
+        # Tabla categoría -> posición dentro de su columna (len(categorias) = desconocida)
+        self.cat_posiciones = []
+        self.cat_inicios = []
+        self.cat_tamanos = []
+        columna = len(self.num_cols)
+        for i in range(len(self.cat_cols)):
+            categorias = [str(v) for v in artefacto[f"cat_categorias_{i}"]]
+            self.cat_posiciones.append({cat: j for j, cat in enumerate(categorias)})
+            self.cat_inicios.append(columna)
+            self.cat_tamanos.append(len(categorias))
+            columna += len(categorias)
+        self.n_features = columna
+        # Los modelos secundarios se comprueban contra esta huella: mismo preprocesador, misma X
+        self.huella_preprocesador = huella_arreglos({k: v for k, v in artefacto.items()
+                                                     if k.startswith(("num_", "cat_"))})
+
+        self.centroides = np.ascontiguousarray(artefacto["centroides"], dtype=np.float64)
+        self.norma_centroides = (self.centroides ** 2).sum(axis=1)
+        if self.centroides.shape[1] != self.n_features:
+            raise ValueError("Los centroides no coinciden con las columnas del preprocesador.")
+
+        # Artefactos anteriores a la tabla de decisión la compilan al cargarse
+        tabla = artefacto if "tabla_puntos" in artefacto else compilar_tabla(artefacto)
+        self.tabla_puntos = np.asarray(tabla["tabla_puntos"], dtype=np.float64)
+        self.tabla_pendientes = np.asarray(tabla["tabla_pendientes"], dtype=np.float64)
+        self.tabla_pasos = np.asarray(tabla["tabla_pasos"], dtype=np.int64)
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "MotorInferencia":
+        with np.load(ruta, allow_pickle=False) as datos:
+            return cls({clave: datos[clave] for clave in datos.files})
+
+    @classmethod
+    def mapear(cls, nombre: str = modelo_principal) -> "MotorInferencia":
+        manifiesto_pre, preprocesador = cargar_arreglos(nombre_preprocesador)
+        manifiesto, arreglos = cargar_arreglos(nombre)
+        if manifiesto["tipo"] != "centroides":
+            raise ArtefactoIncompatible(f"{nombre}: el motor necesita un modelo de centroides.")
+        if manifiesto["preprocesador"] != manifiesto_pre["huella"]:
+            raise ArtefactoIncompatible(f"{nombre} se exportó con otro preprocesador.")
+        return cls({**preprocesador, **arreglos})
+
+    def clave(self, usuario: dict):
+        # Solo los valores que lee leer_lote, normalizados igual que ahí:
+        # dos usuarios con la misma clave reciben siempre el mismo cluster
+        clave = []
+        for col in self.num_cols:
+            valor = usuario.get(col)
+            if _es_faltante(valor):
+                clave.append(None)
+                continue
+            try:
+                numero = float(valor)
+            except (TypeError, ValueError):
+                return None
+            clave.append(None if math.isnan(numero) else numero)
+        for col in self.cat_cols:
+            valor = usuario.get(col)
+            if _es_faltante(valor):
+                clave.append(None)
+                continue
+            try:
+                hash(valor)
+            except TypeError:
+                return None
+            clave.append(valor)
+        return tuple(clave)
+
+    def leer_lote(self, usuarios: list) -> tuple:
+        n = len(usuarios)
+        numericos = np.full((n, len(self.num_cols)), np.nan)
+        categorias = np.empty((n, len(self.cat_cols)), dtype=np.int64)
+        errores = {}
+
+        for fila, usuario in enumerate(usuarios):
+            for j, col in enumerate(self.num_cols):
+                valor = usuario.get(col)
+                if _es_faltante(valor):
+                    continue
+                try:
+                    numericos[fila, j] = float(valor)
+                except (TypeError, ValueError):
+                    errores[fila] = f"Valor no numérico en la columna: {col}"
+                    break
+
+        # --- Imputar medias en un solo paso vectorizado ---
+        numericos = np.where(np.isnan(numericos), self.num_imputacion, numericos)
+
+        # --- Posición de cada categoría por búsqueda en tabla ---
+        for k, col in enumerate(self.cat_cols):
+            posiciones = self.cat_posiciones[k]
+            desconocida = self.cat_tamanos[k]
+            imputacion = self.cat_imputacion[k]
+            for fila, usuario in enumerate(usuarios):
+                valor = usuario.get(col)
+                if _es_faltante(valor):
+                    valor = imputacion
+                try:
+                    categorias[fila, k] = posiciones.get(valor, desconocida)
+                except TypeError:
+                    errores.setdefault(fila, f"Valor inválido en la columna: {col}")
+                    categorias[fila, k] = desconocida
+
+        return numericos, categorias, errores
+
+    def leer_tabla(self, df: pd.DataFrame) -> tuple:
+        # Equivalente vectorizado de leer_lote para un DataFrame con las columnas del modelo
+        numericos = np.column_stack([pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+                                     for col in self.num_cols]) if self.num_cols else np.empty((len(df), 0))
+        numericos = np.where(np.isnan(numericos), self.num_imputacion, numericos)
+
+        categorias = np.empty((len(df), len(self.cat_cols)), dtype=np.int64)
+        for k, col in enumerate(self.cat_cols):
+            valores = df[col].astype(object).where(df[col].notna(), self.cat_imputacion[k])
+            codigos = pd.Categorical(valores, categories=list(self.cat_posiciones[k])).codes
+            categorias[:, k] = np.where(codigos < 0, self.cat_tamanos[k], codigos)
+        return numericos, categorias
+
+    def matriz(self, numericos: np.ndarray, categorias: np.ndarray) -> np.ndarray:
+        X = np.zeros((len(numericos), self.n_features), dtype=np.float64)
+        X[:, :len(self.num_cols)] = (numericos - self.num_media) / self.num_escala
+
+        # --- One-hot (desconocidas quedan en cero) ---
+        for k, inicio in enumerate(self.cat_inicios):
+            filas = np.flatnonzero(categorias[:, k] < self.cat_tamanos[k])
+            X[filas, inicio + categorias[filas, k]] = 1.0
+        return X
+
+    def transformar_lote(self, usuarios: list) -> tuple:
+        numericos, categorias, errores = self.leer_lote(usuarios)
+        return self.matriz(numericos, categorias), errores
+
+    def predecir_matriz(self, X: np.ndarray) -> np.ndarray:
+        distancias = self.norma_centroides - 2.0 * (X @ self.centroides.T)
+        return np.argmin(distancias, axis=1)
+
+    def clasificar(self, numericos: np.ndarray, categorias: np.ndarray) -> np.ndarray:
+        # --- Tabla de decisión: una fila por combinación de categorías + pendientes numéricas ---
+        distancias = self.tabla_puntos[categorias @ self.tabla_pasos] + numericos @ self.tabla_pendientes
+        clusters = np.argmin(distancias, axis=1)
+
+        # Casi empates: el redondeo podría diferir del cálculo matricial, se resuelven con él
+        if distancias.shape[1] > 1:
+            dos = np.partition(distancias, 1, axis=1)
+            margen = self.tolerancia_tabla * (1.0 + np.abs(dos[:, 0]))
+            dudosas = np.flatnonzero(dos[:, 1] - dos[:, 0] <= margen)
+            if len(dudosas):
+                clusters[dudosas] = self.predecir_matriz(self.matriz(numericos[dudosas], categorias[dudosas]))
+        return clusters
+
+    def predecir_lote(self, usuarios: list) -> tuple:
+        numericos, categorias, errores = self.leer_lote(usuarios)
+        clusters = self.clasificar(numericos, categorias)
+        if errores:
+            clusters[list(errores)] = -1
+        return clusters, errores
+
+    def predecir(self, usuario: dict) -> int:
+        clusters, errores = self.predecir_lote([usuario])
+        if errores:
+            raise ValueError(errores[0])
+        return int(clusters[0])
+
+
+def cargar_motor() -> MotorInferencia:
+    # Cada artefacto debe ser más reciente que su propio .pkl; que modelo y preprocesador vayan juntos
+    # lo comprueba mapear() con la huella del preprocesador guardada en el manifiesto del modelo
+    if artefacto_vigente(modelo_principal, [ruta_modelo]) \
+            and artefacto_vigente(nombre_preprocesador, [ruta_preprocesador]):
+        try:
+            return MotorInferencia.mapear()
+        except (ArtefactoIncompatible, OSError) as e:
+            print(f" Artefacto de {modelo_principal} descartado: {e}")
+    if os.path.exists(ruta_motor):
+        origen = max(os.path.getmtime(ruta_modelo), os.path.getmtime(ruta_preprocesador)) \
+            if os.path.exists(ruta_modelo) and os.path.exists(ruta_preprocesador) else 0
+        if os.path.getmtime(ruta_motor) >= origen:
+            return MotorInferencia.cargar(ruta_motor)
+    model = joblib.load(ruta_modelo)
+    preprocessor = joblib.load(ruta_preprocesador)
+    return MotorInferencia(compilar_motor(preprocessor, model))
+
+
+# --- Asignación de usuarios nuevos para los demás modelos, sobre la misma matriz X ---
+class AsignadorCentroides:
+    def __init__(self, centroides: np.ndarray):
+        self.centroides = np.ascontiguousarray(centroides, dtype=np.float64)
+        self.norma_centroides = (self.centroides ** 2).sum(axis=1)
+
+    def predecir_matriz(self, X: np.ndarray) -> np.ndarray:
+        return np.argmin(self.norma_centroides - 2.0 * (X @ self.centroides.T), axis=1)
+
+
+class AsignadorDBSCAN:
+    # DBSCAN no tiene predict: cada punto toma el cluster de la muestra núcleo más cercana
+    # si está a distancia <= eps (punto frontera); si no, es ruido (-1)
+    def __init__(self, nucleos: np.ndarray, etiquetas: np.ndarray, eps: float, metrica: str):
+        self.eps = eps
+        nucleos = np.ascontiguousarray(nucleos, dtype=np.float64)
+        self.etiquetas = np.asarray(etiquetas)
+        arbol = KDTree if metrica in KDTree.valid_metrics else BallTree
+        self.indice = arbol(nucleos, metric=metrica) if len(nucleos) else None
+
+    def predecir_matriz(self, X: np.ndarray) -> np.ndarray:
+        if self.indice is None:
+            return np.full(len(X), -1)
+        distancias, vecinos = self.indice.query(X, k=1)
+        clusters = self.etiquetas[vecinos[:, 0]]
+        clusters[distancias[:, 0] > self.eps] = -1
+        return clusters
+
+
+class AsignadorGaussiano:
+    # Log-densidad ponderada de cada componente, igual que GaussianMixture.predict pero sin sklearn
+    def __init__(self, medias: np.ndarray, precisiones_cholesky: np.ndarray, pesos: np.ndarray, covarianza: str):
+        self.medias = np.ascontiguousarray(medias, dtype=np.float64)
+        self.precisiones = np.ascontiguousarray(precisiones_cholesky, dtype=np.float64)
+        self.covarianza = covarianza
+        d = self.medias.shape[1]
+        if covarianza == "full":
+            log_det = np.log(np.diagonal(self.precisiones, axis1=1, axis2=2)).sum(axis=1)
+        elif covarianza == "tied":
+            log_det = np.log(np.diag(self.precisiones)).sum()
+        elif covarianza == "diag":
+            log_det = np.log(self.precisiones).sum(axis=1)
+        else:
+            log_det = d * np.log(self.precisiones)
+        self.constante = log_det + np.log(np.asarray(pesos, dtype=np.float64))
+
+    def predecir_matriz(self, X: np.ndarray) -> np.ndarray:
+        mu, P = self.medias, self.precisiones
+        if self.covarianza == "full":
+            distancias = np.column_stack([((X @ P[k] - mu[k] @ P[k]) ** 2).sum(axis=1) for k in range(len(mu))])
+        elif self.covarianza == "tied":
+            distancias = np.column_stack([((X @ P - mu[k] @ P) ** 2).sum(axis=1) for k in range(len(mu))])
+        elif self.covarianza == "diag":
+            precision = P ** 2
+            distancias = (mu ** 2 * precision).sum(axis=1) - 2.0 * (X @ (mu * precision).T) + (X ** 2) @ precision.T
+        else:
+            precision = P ** 2
+            distancias = ((mu ** 2).sum(axis=1) - 2.0 * (X @ mu.T) + (X ** 2).sum(axis=1)[:, None]) * precision
+        return np.argmax(self.constante - 0.5 * distancias, axis=1)
+
+
+class AsignadorSklearn:
+    def __init__(self, model):
+        self.model = model
+
+    def predecir_matriz(self, X: np.ndarray) -> np.ndarray:
+        return self.model.predict(X)
+
+
+def asignador_arreglos(tipo: str, arreglos: dict, metadatos: dict):
+    if tipo == "centroides":
+        return AsignadorCentroides(arreglos["centroides"])
+    if tipo == "gaussianas":
+        return AsignadorGaussiano(arreglos["medias"], arreglos["precisiones_cholesky"], arreglos["pesos"],
+                                  metadatos["covarianza"])
+    if tipo == "dbscan":
+        return AsignadorDBSCAN(arreglos["nucleos"], arreglos["etiquetas"], metadatos["eps"], metadatos["metrica"])
+    raise ArtefactoIncompatible(f"Tipo de artefacto desconocido: {tipo}")
+
+
+def crear_asignador(model):
     try:
-        user_df = pd.DataFrame([usuario])
-
-        required_cols = ['edad_ordinal', 'imc', 'totalComidasDia', 'puntaje_ia',
-                         'sexo', 'nivel_educativo', 'estado_imc', 'estrato', 'inseguridad']
-        for col in required_cols:
-            if col not in user_df.columns:
-                raise ValueError(f"Falta la columna: {col}")
-
-        X_new = preprocessor.transform(user_df)
-        cluster = int(model.predict(X_new)[0])
-        perfil = perfiles.loc[cluster].to_dict()
-        recomendacion = recomendaciones.get(cluster, "Personalizar recomendaciones.")
-
-        return {
-            "cluster": cluster,
-            "perfil_resumido": perfil,
-            "recomendacion": recomendacion
-        }
-
-    except Exception as e:
-        return {"error": str(e)}
+        return asignador_arreglos(*arreglos_modelo(model))
+    except ArtefactoIncompatible:
+        return AsignadorSklearn(model)
+
+
+def cargar_asignador(nombre: str, motor: MotorInferencia):
+    ruta = f"models/{nombre}_model.pkl"
+    if artefacto_vigente(nombre, [ruta]):
+        try:
+            manifiesto, arreglos = cargar_arreglos(nombre)
+            # La X que arma el motor debe ser la misma con la que se ajustó el modelo
+            if manifiesto["preprocesador"] != motor.huella_preprocesador \
+                    or manifiesto["n_features"] != motor.n_features:
+                raise ArtefactoIncompatible(f"{nombre} se exportó con otro preprocesador.")
+            return asignador_arreglos(manifiesto["tipo"], arreglos, manifiesto)
+        except (ArtefactoIncompatible, OSError) as e:
+            if not os.path.exists(ruta):
+                raise
+            print(f" Artefacto de {nombre} descartado: {e}")
+    return crear_asignador(joblib.load(ruta))
+
+
+class ArtefactosServicio:
+    def __init__(self, motor: MotorInferencia, perfiles: pd.DataFrame, asignadores: dict = None,
+                 perfiles_modelos: dict = None):
+        self.motor = motor
+        self.perfiles = perfiles
+        self.perfiles_por_cluster = perfiles.to_dict(orient="index")
+
+        # El modelo principal usa el motor compilado (tabla de decisión); los demás, su asignador
+        self.asignadores = asignadores or {}
+        self.perfiles_por_modelo = {modelo_principal: self.perfiles_por_cluster}
+        for nombre, perfiles_modelo in (perfiles_modelos or {}).items():
+            self.perfiles_por_modelo[nombre] = None if perfiles_modelo is None \
+                else perfiles_modelo.to_dict(orient="index")
+
+    @property
+    def modelos(self) -> list:
+        return [modelo_principal] + list(self.asignadores)
+
+
+def cargar_artefactos() -> ArtefactosServicio:
+    motor = cargar_motor()
+    asignadores, perfiles_modelos = {}, {}
+    nombres = {os.path.basename(r)[:-len("_model.pkl")] for r in glob.glob("models/*_model.pkl")}
+    nombres |= {os.path.basename(os.path.dirname(r)) for r in glob.glob("models/*/manifest.json")}
+    for nombre in sorted(nombres - {nombre_preprocesador}):
+        if nombre == modelo_principal or (modelos_servidos and nombre not in modelos_servidos):
+            continue
+        try:
+            asignadores[nombre] = cargar_asignador(nombre, motor)
+            try:
+                perfiles_modelos[nombre] = cargar_perfiles(nombre)
+            except FileNotFoundError as e:
+                # Sin perfiles, el modelo secundario responde solo con el cluster
+                print(f" {e}")
+                perfiles_modelos[nombre] = None
+        except Exception as e:
+            # Un modelo secundario dañado no impide servir el principal
+            print(f" No se pudo cargar {nombre}: {e}")
+    # Sin perfiles del modelo principal la carga falla: el registro mantiene la versión anterior
+    return ArtefactosServicio(motor, cargar_perfiles(), asignadores, perfiles_modelos)
+
+
+# --- 6. Registro: carga diferida, precarga al arrancar y recarga en caliente ---
+registro = RegistroModelos(
+    cargar_artefactos,
+    patrones=["models/*.pkl", ruta_motor, "models/*/manifest.json", "models/*_perfiles.parquet"],
+    intervalo=float(os.environ.get("RECARGA_MODELOS_SEGUNDOS", "10")),
+    bloqueo=ruta_bloqueo
+)
+
+# --- Caché de predicciones; se invalida sola cuando cambia la versión del registro ---
+cache_predicciones = CachePredicciones(int(os.environ.get("CACHE_PREDICCIONES", "50000")))
+
+# --- 7. Recomendador principal ---
+# --- Clusters de cada modelo pedido; una sola lectura y una sola matriz X para todos ---
+def predecir_modelos(artefactos: ArtefactosServicio, version, usuarios: list, nombres: list) -> tuple:
+    motor = artefactos.motor
+
+    # --- Perfiles repetidos salen de la caché; solo los nuevos pasan por los modelos ---
+    with metricas.tramo("cache"):
+        claves = [motor.clave(usuario) for usuario in usuarios]
+        clusters = {}
+        pendientes = set()
+        for nombre in nombres:
+            claves_modelo = [None if clave is None else (nombre,) + clave for clave in claves]
+            clusters[nombre] = cache_predicciones.obtener_lote(claves_modelo, version)
+            fallos = sum(cluster is None for cluster in clusters[nombre])
+            pendientes.update(pos for pos, cluster in enumerate(clusters[nombre]) if cluster is None)
+            metricas.incrementar("cache_predicciones_total", len(usuarios) - fallos, resultado="acierto")
+            metricas.incrementar("cache_predicciones_total", fallos, resultado="fallo")
+
+    errores = {}
+    if not pendientes:
+        return clusters, errores
+
+    # Dentro del lote, cada perfil distinto se lee y se predice una sola vez
+    grupos = {}
+    for pos in sorted(pendientes):
+        grupos.setdefault(pos if claves[pos] is None else claves[pos], []).append(pos)
+    representantes = [grupo[0] for grupo in grupos.values()]
+    with metricas.tramo("transformacion"):
+        numericos, categorias, errores_lectura = motor.leer_lote([usuarios[pos] for pos in representantes])
+        X = motor.matriz(numericos, categorias) if any(n != modelo_principal for n in nombres) else None
+
+    for nombre in nombres:
+        with metricas.tramo("prediccion", modelo=nombre):
+            if nombre == modelo_principal:
+                predichos = motor.clasificar(numericos, categorias)
+            else:
+                predichos = artefactos.asignadores[nombre].predecir_matriz(X)
+        nuevos = []
+        for j, grupo in enumerate(grupos.values()):
+            if j in errores_lectura:
+                continue
+            for pos in grupo:
+                clusters[nombre][pos] = int(predichos[j])
+            if claves[grupo[0]] is not None:
+                nuevos.append(grupo[0])
+        cache_predicciones.guardar_lote([(nombre,) + claves[pos] for pos in nuevos],
+                                        [clusters[nombre][pos] for pos in nuevos], version)
+
+    for j, grupo in enumerate(grupos.values()):
+        if j in errores_lectura:
+            for pos in grupo:
+                errores[pos] = errores_lectura[j]
+    return clusters, errores
+
+
+def _resultado(artefactos: ArtefactosServicio, nombre: str, cluster: int) -> dict:
+    perfiles = artefactos.perfiles_por_modelo.get(nombre)
+    perfil = perfiles.get(cluster) if perfiles is not None else None
+    if perfiles is not None and perfil is None:
+        metricas.incrementar("errores_total", tipo="perfil")
+        return {"error": f"Cluster sin perfil: {cluster}"}
+    # Las reglas de recomendación solo tienen sentido para los clusters del modelo principal
+    reglas = recomendaciones if nombre == modelo_principal else {}
+    return {
+        "cluster": cluster,
+        "perfil_resumido": perfil,
+        "recomendacion": reglas.get(cluster, "Personalizar recomendaciones.")
+    }
+
+
+def recomendar_batch(usuarios: list, modelos: list = None) -> list:
+    metricas.observar("tamano_lote", len(usuarios))
+    # Validación y derivación de todo el lote en una pasada (features.py)
+    with metricas.tramo("derivacion"):
+        preparados, errores = preparar_lote(usuarios)
+    resultados = [None] * len(usuarios)
+    for i, detalle in errores.items():
+        resultados[i] = {"error": detalle[0]["mensaje"], "errores": detalle}
+        metricas.incrementar("errores_total", tipo=f"validacion_{detalle[0]['tipo']}")
+    validos = [i for i, usuario in enumerate(preparados) if usuario is not None]
+
+    # --- Una sola versión de artefactos para todo el lote ---
+    artefactos, version = registro.obtener_con_version()
+    nombres = list(modelos) if modelos else [modelo_principal]
+    faltantes = [nombre for nombre in nombres if nombre not in artefactos.modelos]
+    if faltantes:
+        metricas.incrementar("errores_total", tipo="modelo_no_disponible")
+        raise ValueError(f"Modelo no disponible: {faltantes[0]}. Disponibles: {', '.join(artefactos.modelos)}")
+
+    if not validos:
+        return resultados
+
+    clusters, errores_motor = predecir_modelos(artefactos, version, [preparados[i] for i in validos], nombres)
+    if errores_motor:
+        metricas.incrementar("errores_total", len(errores_motor), tipo="motor")
+    for nombre in nombres:
+        metricas.incrementar("usuarios_total", len(validos) - len(errores_motor), modelo=nombre)
+
+    with metricas.tramo("perfiles"):
+        for pos, i in enumerate(validos):
+            if pos in errores_motor:
+                resultados[i] = {"error": errores_motor[pos]}
+                continue
+            # Un solo modelo conserva la forma de siempre; varios se devuelven lado a lado
+            if len(nombres) == 1:
+                resultados[i] = _resultado(artefactos, nombres[0], clusters[nombres[0]][pos])
+            else:
+                resultados[i] = {"modelos": {nombre: _resultado(artefactos, nombre, clusters[nombre][pos])
+                                             for nombre in nombres}}
+
+    return resultados
+
+
+def recomendar(usuario: dict, modelo: str = None) -> dict:
+    return recomendar_batch([usuario], [modelo] if modelo else None)[0]
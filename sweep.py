@@ -0,0 +1,301 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import joblib
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
+from sklearn.mixture import GaussianMixture
+from sklearn.neighbors import NearestNeighbors
+from threadpoolctl import threadpool_limits
+
+from evaluation import config_por_defecto, evaluar_clustering
+
+# --- Modelos soportados y grillas por defecto ---
+clases = {
+    'KMeans': KMeans,
+    'MiniBatchKMeans': MiniBatchKMeans,
+    'DBSCAN': DBSCAN,
+    'GaussianMixture': GaussianMixture
+}
+
+grillas_por_defecto = {
+    'KMeans': {'n_clusters': list(range(2, 11)), 'random_state': [42]},
+    'MiniBatchKMeans': {'n_clusters': list(range(2, 11)), 'random_state': [42]},
+    'GaussianMixture': {'n_components': list(range(2, 11)), 'random_state': [42]},
+    'DBSCAN': {'eps': [0.3, 0.5, 0.7, 1.0], 'min_samples': [5, 10, 20]}
+}
+
+ruta_cache = "data/cache/barrido"
+
+
+# --- 1. Llaves de caché: hash del contenido de X + modelo + parámetros + forma de inicialización ---
+def hash_datos(X) -> str:
+    X = np.ascontiguousarray(X)
+    h = hashlib.sha256(f"{X.shape}|{X.dtype}".encode())
+    h.update(memoryview(X).cast("B"))
+    return h.hexdigest()
+
+
+def _hash_json(contenido) -> str:
+    return hashlib.sha256(json.dumps(contenido, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+
+def clave_resultado(hash_X: str, nombre: str, params: dict, inicializacion=None) -> str:
+    # inicializacion: None (en frío), k inicial de una cadena caliente, o "grafo" para DBSCAN
+    return _hash_json({'datos': hash_X, 'modelo': nombre, 'params': params, 'inicializacion': inicializacion})
+
+
+class CacheResultados:
+    def __init__(self, directorio: str = ruta_cache):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave: str, sufijo: str) -> str:
+        return os.path.join(self.directorio, clave + sufijo)
+
+    def obtener(self, clave: str):
+        ruta = self._ruta(clave, ".joblib")
+        return joblib.load(ruta) if os.path.exists(ruta) else None
+
+    def guardar(self, clave: str, entrada: dict) -> None:
+        ruta = self._ruta(clave, ".joblib")
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        joblib.dump(entrada, tmp)
+        os.replace(tmp, ruta)
+
+    # Las métricas van aparte: cambiar su configuración no obliga a reescribir el modelo
+    def metricas(self, clave: str, config: dict):
+        ruta = self._ruta(clave, ".metricas.json")
+        if not os.path.exists(ruta):
+            return None
+        with open(ruta) as f:
+            return json.load(f).get(_hash_json(config))
+
+    def guardar_metricas(self, clave: str, config: dict, metricas: dict) -> None:
+        ruta = self._ruta(clave, ".metricas.json")
+        todas = {}
+        if os.path.exists(ruta):
+            with open(ruta) as f:
+                todas = json.load(f)
+        todas[_hash_json(config)] = metricas
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(todas, f, default=float)
+        os.replace(tmp, ruta)
+
+
+def expandir_grilla(grilla: dict) -> list:
+    nombres = list(grilla)
+    return [dict(zip(nombres, valores)) for valores in itertools.product(*(grilla[n] for n in nombres))]
+
+
+# --- 2. Ajuste de un punto de la grilla (o lectura desde caché) ---
+def _entrada(model, labels, nombre: str, params: dict, X) -> dict:
+    entrada = {'nombre': nombre, 'params': params, 'modelo': model, 'labels': np.asarray(labels, dtype=np.int32)}
+    entrada['inercia'] = float(model.inertia_) if hasattr(model, 'inertia_') else None
+    entrada['bic'] = float(model.bic(X)) if isinstance(model, GaussianMixture) else None
+    return entrada
+
+
+def _fila(cache: CacheResultados, clave: str, entrada: dict, X, config_metricas, desde_cache: bool,
+          inicializacion) -> dict:
+    labels = entrada['labels']
+    fila = {
+        'Modelo': entrada['nombre'],
+        'params': json.dumps(entrada['params'], sort_keys=True),
+        'inicializacion': None if inicializacion is None else str(inicializacion),
+        'n_clusters': len(set(labels.tolist())) - (1 if -1 in labels else 0),
+        'inercia': entrada['inercia'],
+        'bic': entrada['bic'],
+        'clave': clave,
+        'desde_cache': desde_cache
+    }
+    if config_metricas is None:
+        return fila
+
+    metricas = cache.metricas(clave, config_metricas)
+    if metricas is None:
+        valid_mask = labels != -1
+        if valid_mask.sum() < 2 or len(np.unique(labels[valid_mask])) < 2:
+            metricas = {}
+        else:
+            metricas = evaluar_clustering(X[valid_mask], labels[valid_mask], config_metricas)
+        cache.guardar_metricas(clave, config_metricas, metricas)
+    fila.update(metricas)
+    return fila
+
+
+def _ajuste_simple(X, hash_X, nombre, params, cache, config_metricas) -> dict:
+    clave = clave_resultado(hash_X, nombre, params)
+    entrada = cache.obtener(clave)
+    desde_cache = entrada is not None
+    if entrada is None:
+        model = clases[nombre](**params)
+        entrada = _entrada(model, model.fit_predict(X), nombre, params, X)
+        cache.guardar(clave, entrada)
+    return _fila(cache, clave, entrada, X, config_metricas, desde_cache, None)
+
+
+# --- 3. Cadena caliente para KMeans/MiniBatchKMeans: k arranca de los centroides de k-1 ---
+def _nuevo_centro(X, centroides: np.ndarray, semilla: int) -> np.ndarray:
+    # Muestreo D² (como k-means++) respecto a los centroides ya existentes
+    d2 = np.full(len(X), np.inf)
+    for c in centroides:
+        d2 = np.minimum(d2, ((X - c) ** 2).sum(axis=1))
+    rng = np.random.default_rng(semilla)
+    return np.asarray(X[rng.choice(len(X), p=d2 / d2.sum())])
+
+
+def _cadena_caliente(X, hash_X, nombre, lista_params, cache, config_metricas) -> list:
+    filas = []
+    centroides, inicio, k_anterior = None, None, None
+    for params in sorted(lista_params, key=lambda p: p['n_clusters']):
+        k = params['n_clusters']
+        caliente = centroides is not None and k == k_anterior + 1
+        inicio = inicio if caliente else None
+        clave = clave_resultado(hash_X, nombre, params, inicio)
+        entrada = cache.obtener(clave)
+        desde_cache = entrada is not None
+
+        if entrada is None:
+            if caliente:
+                init = np.vstack([centroides, _nuevo_centro(X, centroides, params.get('random_state', 0) + k)])
+                model = clases[nombre](**params, init=init, n_init=1)
+            else:
+                model = clases[nombre](**params)
+            entrada = _entrada(model, model.fit_predict(X), nombre, params, X)
+            cache.guardar(clave, entrada)
+
+        filas.append(_fila(cache, clave, entrada, X, config_metricas, desde_cache, inicio))
+        centroides = entrada['modelo'].cluster_centers_
+        inicio = k if inicio is None else inicio
+        k_anterior = k
+    return filas
+
+
+# --- 4. DBSCAN: un solo grafo de vecinos (eps máximo) compartido por toda la grilla ---
+def _grilla_dbscan(X, hash_X, lista_params, cache, config_metricas) -> list:
+    claves = [clave_resultado(hash_X, 'DBSCAN', p, "grafo") for p in lista_params]
+    entradas = [cache.obtener(c) for c in claves]
+    grafo = None
+    if any(e is None for e in entradas):
+        eps_max = max(p['eps'] for p in lista_params)
+        grafo = NearestNeighbors(radius=eps_max).fit(X).radius_neighbors_graph(X, mode='distance')
+
+    filas = []
+    for params, clave, entrada in zip(lista_params, claves, entradas):
+        desde_cache = entrada is not None
+        if entrada is None:
+            model = DBSCAN(**params, metric='precomputed')
+            entrada = _entrada(model, model.fit_predict(grafo), 'DBSCAN', params, X)
+            cache.guardar(clave, entrada)
+        filas.append(_fila(cache, clave, entrada, X, config_metricas, desde_cache, "grafo"))
+    return filas
+
+
+# --- 5. Tareas: cada una corre en un proceso con X compartida por memmap (o en memoria si es secuencial) ---
+def _ejecutar_tarea(tipo, nombre, lista_params, X, hash_X, directorio_cache, config_metricas, hilos) -> list:
+    if isinstance(X, str):
+        X = np.load(X, mmap_mode='r')
+    cache = CacheResultados(directorio_cache)
+    try:
+        with threadpool_limits(limits=hilos):
+            if tipo == "cadena":
+                return _cadena_caliente(X, hash_X, nombre, lista_params, cache, config_metricas)
+            if tipo == "grafo":
+                return _grilla_dbscan(X, hash_X, lista_params, cache, config_metricas)
+            return [_ajuste_simple(X, hash_X, nombre, p, cache, config_metricas) for p in lista_params]
+    except Exception as e:
+        return [{'Modelo': nombre, 'params': json.dumps(p, sort_keys=True), 'error': f"Error con {nombre}: {e}"}
+                for p in lista_params]
+
+
+def ejecutar_tareas(X, tareas: list, workers: int = 1, config_metricas: dict = None,
+                    directorio_cache: str = ruta_cache) -> list:
+    hash_X = hash_datos(X)
+    if config_metricas is not None:
+        config_metricas = {**config_por_defecto, **config_metricas}
+    os.makedirs(directorio_cache, exist_ok=True)
+    resultados = [None] * len(tareas)
+
+    if workers <= 1:
+        # Sin pool no hay procesos con quienes compartir X: no se copia a disco
+        for i, (tipo, nombre, lista_params) in enumerate(tareas):
+            resultados[i] = _ejecutar_tarea(tipo, nombre, lista_params, X, hash_X,
+                                            directorio_cache, config_metricas, None)
+        return [fila for filas in resultados for fila in filas]
+
+    directorio = tempfile.mkdtemp(prefix="sweep_")
+    ruta_X = os.path.join(directorio, "X.npy")
+    np.save(ruta_X, np.ascontiguousarray(X))
+
+    # Reparte los núcleos entre procesos para no sobresuscribir BLAS/OpenMP
+    hilos = max(1, (os.cpu_count() or 1) // max(1, workers))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futuros = {
+                pool.submit(_ejecutar_tarea, tipo, nombre, lista_params, ruta_X, hash_X,
+                            directorio_cache, config_metricas, hilos): i
+                for i, (tipo, nombre, lista_params) in enumerate(tareas)
+            }
+            for futuro in as_completed(futuros):
+                resultados[futuros[futuro]] = futuro.result()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return [fila for filas in resultados for fila in filas]
+
+
+def tareas_barrido(grillas: dict, calentar: bool = True) -> list:
+    tareas = []
+    for nombre, grilla in grillas.items():
+        lista = expandir_grilla(grilla)
+        if calentar and nombre in ('KMeans', 'MiniBatchKMeans'):
+            # Una cadena por combinación de los demás parámetros
+            grupos = {}
+            for p in lista:
+                resto = json.dumps({k: v for k, v in p.items() if k != 'n_clusters'}, sort_keys=True)
+                grupos.setdefault(resto, []).append(p)
+            tareas += [("cadena", nombre, grupo) for grupo in grupos.values()]
+        elif calentar and nombre == 'DBSCAN':
+            tareas.append(("grafo", nombre, lista))
+        else:
+            # Cada punto independiente va en su propia tarea
+            tareas += [("simple", nombre, [p]) for p in lista]
+    return tareas
+
+
+# --- 6. API pública ---
+def ejecutar_barrido(X, grillas: dict = None, workers: int = 1, config_metricas: dict = None,
+                     directorio_cache: str = ruta_cache, calentar: bool = True) -> pd.DataFrame:
+    tareas = tareas_barrido(grillas or grillas_por_defecto, calentar)
+    return pd.DataFrame(ejecutar_tareas(X, tareas, workers, config_metricas, directorio_cache))
+
+
+def ajustar_seleccion(X, seleccion: dict, workers: int = 1, config_metricas: dict = None,
+                      directorio_cache: str = ruta_cache) -> list:
+    # Configuraciones finales: siempre en frío, reproducibles sin importar la grilla
+    tareas = [("simple", nombre, [params]) for nombre, params in seleccion.items()]
+    return ejecutar_tareas(X, tareas, workers, config_metricas or {}, directorio_cache)
+
+
+def cargar_resultado(clave: str, directorio_cache: str = ruta_cache) -> dict:
+    entrada = CacheResultados(directorio_cache).obtener(clave)
+    if entrada is None:
+        raise KeyError(f"Resultado no encontrado en caché: {clave}")
+    return entrada
+
+
+def curva_codo(X, nombre: str, ks=range(2, 11), random_state: int = 42, workers: int = 1,
+               directorio_cache: str = ruta_cache) -> pd.DataFrame:
+    grilla = {nombre: {'n_clusters': list(ks), 'random_state': [random_state]}}
+    tabla = ejecutar_barrido(X, grilla, workers, None, directorio_cache)
+    tabla['k'] = [json.loads(p)['n_clusters'] for p in tabla['params']]
+    return tabla.sort_values('k')[['k', 'inercia', 'desde_cache']]